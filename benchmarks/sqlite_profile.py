@@ -0,0 +1,107 @@
+"""Compares SQLite's default settings with cardbuilder's pragma profile on synthetic data shaped like a dictionary
+table: ingesting it in batches the way ExternalDataDataSource does, looking words up one at a time and in bulk, and
+writing one row per commit the way web API results are cached.
+
+Run with ``python benchmarks/sqlite_profile.py [rows]``; it works in a temporary directory and leaves nothing behind.
+"""
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+from os.path import join
+from typing import Callable, List, Tuple
+
+from cardbuilder.common.util import connect_to_database, pragmas_applied, INGEST_PRAGMAS, grouper
+
+BATCH_SIZE = 10000
+LOOKUPS = 50000
+BULK_CHUNK = 500
+CACHE_WRITES = 2000
+
+
+def make_rows(count: int) -> List[Tuple[str, str]]:
+    rng = random.Random(0)
+    words = {''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12))) for _ in range(count)}
+    return [(word, ' '.join(rng.choice(string.ascii_lowercase) * rng.randint(1, 8) for _ in range(40)))
+            for word in words]
+
+
+def ingest(conn: sqlite3.Connection, rows: List[Tuple[str, str]]):
+    conn.execute('CREATE TABLE dictionary (word TEXT PRIMARY KEY, content TEXT)')
+    for batch in grouper(BATCH_SIZE, rows):
+        conn.executemany('INSERT INTO dictionary VALUES (?, ?)', batch)
+        conn.commit()
+
+
+def point_lookups(conn: sqlite3.Connection, words: List[str]):
+    for word in words:
+        conn.execute('SELECT content FROM dictionary WHERE word=?', (word,)).fetchone()
+
+
+def bulk_lookups(conn: sqlite3.Connection, words: List[str]):
+    for chunk in grouper(BULK_CHUNK, words):
+        chunk = list(chunk)
+        conn.execute('SELECT word, content FROM dictionary WHERE word IN ({})'.format(','.join('?' * len(chunk))),
+                     chunk).fetchall()
+
+
+def cache_writes(conn: sqlite3.Connection, rows: List[Tuple[str, str]]):
+    conn.execute('CREATE TABLE IF NOT EXISTS web_cache (word TEXT PRIMARY KEY, content BLOB)')
+    for word, content in rows:
+        conn.execute('INSERT OR REPLACE INTO web_cache VALUES (?, ?)', (word, content.encode('utf-8')))
+        conn.commit()
+
+
+def timed(func: Callable, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def run(name: str, connect: Callable[[str], sqlite3.Connection], ingesting: Callable, rows: List[Tuple[str, str]]):
+    words = [word for word, _ in rows]
+    rng = random.Random(1)
+    lookup_words = [rng.choice(words) for _ in range(LOOKUPS)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = join(directory, 'benchmark.db')
+        conn = connect(path)
+        with ingesting(conn):
+            ingest_time = timed(ingest, conn, rows)
+        conn.close()
+
+        conn = connect(path)  # a fresh connection, so lookups start from a cold page cache
+        point_time = timed(point_lookups, conn, lookup_words)
+        bulk_time = timed(bulk_lookups, conn, lookup_words)
+        write_time = timed(cache_writes, conn, rows[:CACHE_WRITES])
+        conn.close()
+
+    print('{:<10} {:>14,.0f} {:>16,.0f} {:>15,.0f} {:>15,.0f}'.format(
+        name, len(rows) / ingest_time, LOOKUPS / point_time, LOOKUPS / bulk_time, CACHE_WRITES / write_time))
+
+
+class NoPragmas:
+    def __init__(self, conn: sqlite3.Connection):
+        pass
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows = make_rows(row_count)
+    print('{} rows, throughput in rows per second'.format(len(rows)))
+    print('{:<10} {:>14} {:>16} {:>15} {:>15}'.format('settings', 'ingest', 'point lookups', 'bulk lookups',
+                                                      'cache writes'))
+    run('default', sqlite3.connect, NoPragmas, rows)
+    run('profile', connect_to_database, lambda conn: pragmas_applied(conn, INGEST_PRAGMAS), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+import time
+from typing import Optional, Set, List, Callable
+
+from cardbuilder.common.config import Config
+from cardbuilder.common.util import grouper, log
+
+
+class CacheLimits:
+    """Keeps an SQLite table of cached web content within a maximum age and a maximum total size, evicting the least
+    recently used rows once the size is exceeded. The table needs a text key column and a content column; it is given
+    fetched_at, last_used and size columns, which are filled in for any existing rows the first time. Tables that refer
+    to content stored elsewhere can store its size explicitly and clean up after evictions with on_evict.
+
+    Limits are only checked every check_interval writes, and uses of cached rows are recorded a batch at a time, so
+    keeping to them costs very little per lookup."""
+
+    check_interval = 200
+    touch_batch_size = 100
+    # when over the size limit, rows are evicted until the table is down to this fraction of it, so that every check
+    # after the table first fills up doesn't have to evict again
+    size_after_eviction = 0.9
+
+    def __init__(self, owner_name: str, table_name: str, key_column: str, max_age: Optional[float] = None,
+                 max_bytes: Optional[int] = None, content_column: str = 'content',
+                 on_evict: Optional[Callable[[sqlite3.Connection], None]] = None):
+        """
+
+        Args:
+            owner_name: used to look up the config keys <owner_name>_cache_max_age and <owner_name>_cache_max_bytes,
+                which override max_age and max_bytes. Setting either key to 0 removes that limit.
+            table_name: the table to keep within the limits.
+            key_column: the name of the table's primary key column.
+            max_age: how many seconds a row is kept after it was fetched, or None to keep rows regardless of age.
+            max_bytes: the most content the table can hold, or None for no size limit.
+            content_column: the name of the table's content column.
+            on_evict: called with the connection after any rows have been evicted.
+        """
+        self.owner_name = owner_name
+        self.table_name = table_name
+        self.key_column = key_column
+        self.content_column = content_column
+        self.on_evict = on_evict
+        self.max_age = self._limit_from_config('cache_max_age', float, max_age)
+        self.max_bytes = self._limit_from_config('cache_max_bytes', int, max_bytes)
+
+        self._lock = threading.Lock()
+        self._touched: Set[str] = set()
+        self._writes_since_check = 0
+
+    def _limit_from_config(self, name: str, limit_type: type, default):
+        try:
+            limit = limit_type(Config.get('{}_{}'.format(self.owner_name, name)))
+            return limit if limit > 0 else None
+        except KeyError:
+            return default
+
+    def migrate(self, conn: sqlite3.Connection):
+        columns = {row[1] for row in conn.execute('PRAGMA table_info({})'.format(self.table_name))}
+        if 'fetched_at' not in columns:
+            log(self, 'Adding cache bookkeeping columns to table {}'.format(self.table_name))
+            for column in ('fetched_at REAL', 'last_used REAL', 'size INT'):
+                conn.execute('ALTER TABLE {} ADD COLUMN {}'.format(self.table_name, column))
+            now = time.time()
+            conn.execute('UPDATE {} SET fetched_at=?, last_used=?, size=length({})'.format(self.table_name,
+                                                                                           self.content_column),
+                         (now, now))
+
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_last_used ON {0}(last_used)'.format(self.table_name))
+        conn.execute('CREATE INDEX IF NOT EXISTS {0}_fetched_at ON {0}(fetched_at)'.format(self.table_name))
+        conn.commit()
+
+    def store(self, conn: sqlite3.Connection, key: str, content, size: Optional[int] = None):
+        """Inserts or replaces the content for key, evicting other rows if it's time to check the limits. The size
+        defaults to the length of the content."""
+        now = time.time()
+        size = len(content) if size is None else size
+        conn.execute('INSERT OR REPLACE INTO {} ({}, {}, fetched_at, last_used, size) VALUES (?, ?, ?, ?, ?)'
+                     .format(self.table_name, self.key_column, self.content_column), (key, content, now, now, size))
+        conn.commit()
+
+        with self._lock:
+            self._writes_since_check += 1
+            check_now = self._writes_since_check >= self.check_interval
+            if check_now:
+                self._writes_since_check = 0
+
+        if check_now:
+            self.enforce(conn)
+
+    def touch(self, conn: sqlite3.Connection, key: str):
+        """Records that the row for key was used, so it's evicted after rows that haven't been."""
+        with self._lock:
+            self._touched.add(key)
+            if len(self._touched) < self.touch_batch_size:
+                return
+            touched = self._take_touched()
+
+        self._write_touched(conn, touched)
+
+    def enforce(self, conn: sqlite3.Connection) -> int:
+        """Evicts rows older than the maximum age, then the least recently used rows until the table fits in the
+        maximum size. Returns how many rows were evicted."""
+        with self._lock:
+            touched = self._take_touched()
+        self._write_touched(conn, touched)
+
+        evicted = 0
+        if self.max_age is not None:
+            cursor = conn.execute('DELETE FROM {} WHERE fetched_at<?'.format(self.table_name),
+                                  (time.time() - self.max_age,))
+            evicted += cursor.rowcount
+
+        if self.max_bytes is not None:
+            total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM {}'.format(self.table_name)).fetchone()[0]
+            if total_size > self.max_bytes:
+                excess = total_size - self.max_bytes * self.size_after_eviction
+                keys = []
+                cursor = conn.execute('SELECT {}, size FROM {} ORDER BY last_used'.format(self.key_column,
+                                                                                           self.table_name))
+                for key, size in cursor:
+                    keys.append(key)
+                    excess -= size
+                    if excess <= 0:
+                        break
+                cursor.close()
+                self._delete(conn, keys)
+                evicted += len(keys)
+
+        conn.commit()
+        if evicted > 0:
+            log(self, 'Evicted {} rows from cache table {}'.format(evicted, self.table_name))
+            if self.on_evict is not None:
+                self.on_evict(conn)
+        return evicted
+
+    def _take_touched(self) -> List[str]:
+        touched = list(self._touched)
+        self._touched.clear()
+        return touched
+
+    def _write_touched(self, conn: sqlite3.Connection, keys: List[str]):
+        now = time.time()
+        for chunk in grouper(500, keys):
+            chunk = list(chunk)
+            conn.execute('UPDATE {} SET last_used=? WHERE {} IN ({})'.format(
+                self.table_name, self.key_column, ','.join('?' * len(chunk))), [now] + chunk)
+        conn.commit()
+
+    def _delete(self, conn: sqlite3.Connection, keys: List[str]):
+        for chunk in grouper(500, keys):
+            chunk = list(chunk)
+            conn.execute('DELETE FROM {} WHERE {} IN ({})'.format(self.table_name, self.key_column,
+                                                                   ','.join('?' * len(chunk))), chunk)
@@ -1,12 +1,10 @@
-import sqlite3
 from typing import Dict
 
-from cardbuilder.common.util import InDataDir, DATABASE_NAME, log
+from cardbuilder.common.util import InDataDir, DATABASE_NAME, log, connect_to_database
 
 
 class Config:
-    with InDataDir():
-        conn = sqlite3.connect(DATABASE_NAME)
+    conn = connect_to_database(str(InDataDir.directory / DATABASE_NAME))
 
     conn.execute('''CREATE TABLE IF NOT EXISTS config (
                 key TEXT PRIMARY KEY,
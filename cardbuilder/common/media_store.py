@@ -0,0 +1,160 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import stat
+from os.path import exists, samefile
+from pathlib import Path
+from typing import Optional
+from uuid import uuid4
+
+from cardbuilder.common.cache import CacheLimits
+from cardbuilder.common.util import InDataDir, ThreadLocalConnection, log
+
+
+class MediaStore:
+    """Stores downloaded media files in the data directory, named by the SHA-256 of their content, with an SQLite
+    table mapping each URL to the hash of what it returned. Identical files downloaded from different URLs are only
+    stored once, and files are hard linked into output directories where possible instead of being copied. The URL
+    each output file came from is remembered too, so files can be put back in place without knowing their URLs.
+
+    Stored files are made read-only, since a hard linked copy in an output directory is the same file. On Windows, where
+    read-only files get in the way of deleting output directories, files are copied instead."""
+
+    # where files are kept in the data directory by default; purge_db deletes it along with the database its index is in
+    directory_name = 'media'
+    index_table = 'media_index'
+    outputs_table = 'media_outputs'
+    # DownloadPrinter used to keep whole files in this table; they're moved into the store as they're asked for
+    legacy_table = 'download_cache'
+    link_files = os.name != 'nt'
+
+    def __init__(self, owner_name: str = 'MediaStore', max_age: Optional[float] = None,
+                 max_bytes: Optional[int] = None, directory: Optional[Path] = None):
+        """
+
+        Args:
+            owner_name: used to look up the config keys for the store's cache limits; see CacheLimits.
+            max_age: how many seconds a URL's file is kept after it was downloaded, or None for no age limit.
+            max_bytes: how many bytes of files to keep before the least recently used are removed, or None for no
+                size limit. Files shared by several URLs are counted once per URL.
+            directory: where to keep the files, by default the media directory in the data directory.
+        """
+        self.directory = InDataDir.directory / self.directory_name if directory is None else directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._connection = ThreadLocalConnection()
+
+        conn = self._connection.get()
+        conn.execute('''CREATE TABLE IF NOT EXISTS {} (
+            url TEXT PRIMARY KEY,
+            sha TEXT,
+            fetched_at REAL,
+            last_used REAL,
+            size INT);'''.format(self.index_table))
+        conn.execute('''CREATE TABLE IF NOT EXISTS {} (
+            destination TEXT PRIMARY KEY,
+            url TEXT);'''.format(self.outputs_table))
+        conn.commit()
+        self._cache_limits = CacheLimits(owner_name, self.index_table, 'url', max_age, max_bytes,
+                                         content_column='sha', on_evict=self._remove_unreferenced_files)
+        self._cache_limits.migrate(conn)
+        self._cache_limits.enforce(conn)
+
+        self._has_legacy_table = self._drop_legacy_table_if_empty(conn)
+
+    def close(self):
+        self._connection.close()
+
+    def path_for(self, sha: str) -> str:
+        return str(self.directory / sha[:2] / sha)
+
+    def get(self, url: str) -> Optional[str]:
+        """Returns the path of the stored file for url, or None if it hasn't been stored."""
+        conn = self._connection.get()
+        result = conn.execute('SELECT sha FROM {} WHERE url=?'.format(self.index_table), (url,)).fetchone()
+        if result is not None and exists(self.path_for(result[0])):
+            self._cache_limits.touch(conn, url)
+            return self.path_for(result[0])
+
+        if self._has_legacy_table:
+            result = conn.execute('SELECT content FROM {} WHERE url=?'.format(self.legacy_table), (url,)).fetchone()
+            if result is not None:
+                path = self.put(url, result[0])
+                conn.execute('DELETE FROM {} WHERE url=?'.format(self.legacy_table), (url,))
+                conn.commit()
+                return path
+
+        return None
+
+    def get_for_destination(self, destination: str) -> Optional[str]:
+        """Returns the path of the stored file last materialized at destination, or None if there isn't one."""
+        result = self._connection.get().execute('SELECT url FROM {} WHERE destination=?'.format(self.outputs_table),
+                                                (os.path.abspath(destination),)).fetchone()
+        return None if result is None else self.get(result[0])
+
+    def put(self, url: str, data: bytes) -> str:
+        """Stores data as the content of url, returning the path of the stored file."""
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.path_for(sha)
+        # indexed before the file is written, so an eviction in another thread never sees the file as unreferenced
+        self._cache_limits.store(self._connection.get(), url, sha, size=len(data))
+        if not exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written under a temporary name first so that no one ever sees a partial file under the real name
+            temp_path = '{}.{}.tmp'.format(path, uuid4().hex)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(temp_path, path)
+
+        return path
+
+    def materialize(self, path: str, destination: str, url: Optional[str] = None):
+        """Puts the stored file at path into destination, hard linking it if possible. If the file's url is given, it's
+        remembered for get_for_destination."""
+        if url is not None:
+            conn = self._connection.get()
+            conn.execute('INSERT OR REPLACE INTO {} VALUES (?, ?)'.format(self.outputs_table),
+                         (os.path.abspath(destination), url))
+            conn.commit()
+
+        if exists(destination):
+            if samefile(path, destination):
+                return
+            os.remove(destination)
+
+        if self.link_files:
+            try:
+                os.link(path, destination)
+                return
+            except OSError:  # different file system, or one that doesn't support hard links
+                pass
+
+        shutil.copyfile(path, destination)
+
+    def _drop_legacy_table_if_empty(self, conn: sqlite3.Connection) -> bool:
+        result = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                              (self.legacy_table,)).fetchone()
+        if result is None:
+            return False
+
+        if conn.execute('SELECT COUNT(*) FROM {}'.format(self.legacy_table)).fetchone()[0] == 0:
+            log(self, 'All downloads have been moved out of table {}, dropping it'.format(self.legacy_table))
+            conn.execute('DROP TABLE {}'.format(self.legacy_table))
+            conn.commit()
+            return False
+
+        return True
+
+    def _remove_unreferenced_files(self, conn: sqlite3.Connection):
+        conn.execute('DELETE FROM {} WHERE url NOT IN (SELECT url FROM {})'.format(self.outputs_table,
+                                                                                   self.index_table))
+        conn.commit()
+        referenced = {row[0] for row in conn.execute('SELECT DISTINCT sha FROM {}'.format(self.index_table))}
+        for subdirectory in self.directory.iterdir():
+            if not subdirectory.is_dir():
+                continue
+            for file in subdirectory.iterdir():
+                if file.name not in referenced and not file.name.endswith('.tmp'):
+                    os.chmod(str(file), stat.S_IRUSR | stat.S_IWUSR)  # needed to delete read-only files on Windows
+                    os.remove(str(file))
@@ -1,27 +1,62 @@
+import bz2
+import gzip
+import hashlib
 import logging
 import os
 import re
+import shutil
+import sqlite3
 import sys
+import tarfile
+import threading
+import time
 from abc import ABC
-from io import BytesIO
+from contextlib import contextmanager
+from io import TextIOWrapper
 from itertools import takewhile, repeat, zip_longest
 from pathlib import Path
-from typing import Iterable, Optional, Any, List, Callable
+from typing import Iterable, Optional, Any, List, Callable, Dict, Iterator, BinaryIO, Tuple
+from urllib.parse import urlsplit
 import platform
 
 import requests
 import spacy
 from pykakasi import kakasi as kakasi_state
+from requests.adapters import HTTPAdapter
 from retry.api import retry_call
 from spacy.cli.download import download as spacy_download
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 from cardbuilder.common import Language
-from cardbuilder.exceptions import CardBuilderUsageException
+from cardbuilder.exceptions import CardBuilderUsageException, CardBuilderException
 
 whitespace_trim = re.compile(r'\n\s+')
 
 DATABASE_NAME = 'cardbuilder.db'
+# data sources each keep their tables in their own database file in this directory, named by source_database_name
+SOURCE_DATABASE_DIRECTORY = 'sources'
+
+# applied to every connection to the database by connect_to_database. WAL lets lookups read while another thread or
+# process writes, and makes each commit an append to the log instead of a rewrite of the changed pages; the rest keeps
+# more of the database in memory than SQLite's defaults, which are sized for much smaller databases than ours.
+DATABASE_PRAGMAS: Dict[str, Any] = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 30000,  # milliseconds to wait for another connection's write to finish
+    # in WAL mode this only syncs at checkpoints; a power loss can undo the last commits but never corrupts anything
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative sizes are in KiB
+    'temp_store': 'MEMORY'
+}
+
+# applied on top of DATABASE_PRAGMAS while loading downloaded data into the database. Each table is loaded into a shadow
+# table in a single transaction and swapped in when it's complete, then checkpointed, so nothing needs to reach the disk
+# until the load is done; a load that's interrupted leaves the live table as it was, and is redone.
+INGEST_PRAGMAS: Dict[str, Any] = {
+    'synchronous': 'OFF',
+    'cache_size': -256 * 1024
+}
 
 
 class Shared:
@@ -98,6 +133,220 @@ class InDataDir(InDir):
         directory.mkdir(parents=True)
 
 
+def source_database_name(source_name: str) -> str:
+    """Returns the name of the database file for the data source class called source_name, relative to the data
+    directory."""
+    return str(Path(SOURCE_DATABASE_DIRECTORY) / '{}.db'.format(source_name.lower()))
+
+
+def connect_to_database(path: str, pragmas: Optional[Dict[str, Any]] = None, check_same_thread: bool = True,
+                        read_only: bool = False) -> sqlite3.Connection:
+    """Opens a connection to the SQLite database at path with pragmas applied, DATABASE_PRAGMAS by default. Every
+    connection to cardbuilder's databases should be opened through this, so they all share the same settings. Read-only
+    connections keep whatever journal mode the database already has, since changing it would mean writing to it."""
+    pragmas = DATABASE_PRAGMAS if pragmas is None else pragmas
+    timeout = pragmas.get('busy_timeout', 5000) / 1000
+    if read_only:
+        conn = sqlite3.connect(Path(path).absolute().as_uri() + '?mode=ro', uri=True,
+                               check_same_thread=check_same_thread, timeout=timeout)
+        pragmas = {name: value for name, value in pragmas.items() if name != 'journal_mode'}
+    else:
+        conn = sqlite3.connect(path, check_same_thread=check_same_thread, timeout=timeout)
+    set_pragmas(conn, pragmas)
+    return conn
+
+
+def set_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any]):
+    for name, value in pragmas.items():
+        conn.execute('PRAGMA {}={}'.format(name, value))
+
+
+@contextmanager
+def pragmas_applied(conn: sqlite3.Connection, pragmas: Dict[str, Any]) -> Iterator[sqlite3.Connection]:
+    """Applies pragmas to conn for the duration of the with block, then sets them back to what they were."""
+    previous = {name: conn.execute('PRAGMA {}'.format(name)).fetchone()[0] for name in pragmas}
+    set_pragmas(conn, pragmas)
+    try:
+        yield conn
+    finally:
+        set_pragmas(conn, previous)
+
+
+class ThreadLocalConnection:
+    """Lazily opens one connection to a SQLite database in the data directory per thread, because sqlite3 connections
+    can't be used from any thread other than the one that created them."""
+
+    def __init__(self, database_name: str = DATABASE_NAME, pragmas: Optional[Dict[str, Any]] = None,
+                 read_only: bool = False):
+        self.path = str(InDataDir.directory / database_name)
+        self.pragmas = pragmas
+        self.read_only = read_only
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # each connection is only ever used by the thread that opened it, but closing happens from whichever
+            # thread calls close(), so we have to turn off sqlite3's same thread check
+            conn = connect_to_database(self.path, self.pragmas, check_same_thread=False, read_only=self.read_only)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class HttpSessions:
+    """Shared HTTP sessions, one per host, so that repeated requests to the same site reuse pooled keep-alive
+    connections instead of paying for a new TCP and TLS handshake every time. Pool size, timeouts and the retry policy
+    for connection errors and server errors can be changed with configure()."""
+
+    pool_size = 10
+    timeout = 30
+    retries = 3
+    backoff_factor = 0.5
+    retry_statuses = (500, 502, 503, 504)
+
+    _sessions: Dict[Tuple[str, bool], requests.Session] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, pool_size: Optional[int] = None, timeout: Optional[float] = None,
+                  retries: Optional[int] = None, backoff_factor: Optional[float] = None):
+        for attr, value in (('pool_size', pool_size), ('timeout', timeout), ('retries', retries),
+                            ('backoff_factor', backoff_factor)):
+            if value is not None:
+                setattr(cls, attr, value)
+
+        cls.close()  # sessions are rebuilt with the new settings the next time they're needed
+
+    @classmethod
+    def get_session(cls, url: str, retry_server_errors: bool = True) -> requests.Session:
+        """Returns the session for the URL's host. Connection errors are always retried, but server errors are only
+        retried if retry_server_errors is set; callers that count their requests, like data sources with a quota, should
+        turn it off and handle server errors themselves so that every request made is one they know about."""
+        host = urlsplit(url).netloc
+        key = (host, retry_server_errors)
+        with cls._lock:
+            if key not in cls._sessions:
+                # 429s are left to the caller, so data sources can slow down instead of just retrying
+                retry = Retry(total=cls.retries, backoff_factor=cls.backoff_factor,
+                              status_forcelist=cls.retry_statuses if retry_server_errors else (),
+                              raise_on_status=False, respect_retry_after_header=False)
+                # a session only ever talks to one host, aside from the odd redirect
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=cls.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls._sessions[key] = session
+
+            return cls._sessions[key]
+
+    @classmethod
+    def connection_stats(cls) -> Dict[str, Dict[str, int]]:
+        """Returns the number of requests made and connections opened for each host, so connection reuse can be
+        checked."""
+        stats = {}
+        with cls._lock:
+            sessions = list(cls._sessions.items())
+
+        for (host, _), session in sessions:
+            host_stats = stats.setdefault(host, {'requests': 0, 'connections': 0})
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        host_stats['requests'] += pool.num_requests
+                        host_stats['connections'] += pool.num_connections
+            host_stats['reused'] = max(host_stats['requests'] - host_stats['connections'], 0)
+
+        return stats
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions = {}
+
+
+def http_get(url: str, retry_server_errors: bool = True, **kwargs) -> requests.Response:
+    """A drop-in replacement for requests.get that goes through the pooled session for the URL's host."""
+    kwargs.setdefault('timeout', HttpSessions.timeout)
+    return HttpSessions.get_session(url, retry_server_errors).get(url, **kwargs)
+
+
+def log_http_connection_stats():
+    for host, stats in HttpSessions.connection_stats().items():
+        log(None, 'HTTP requests to {}: {} requests over {} connections ({} reused)'.format(
+            host, stats['requests'], stats['connections'], stats['reused']))
+
+
+class RateLimiter:
+    """A token bucket that limits how often requests are made. When the server pushes back, the allowed rate is halved
+    and requests pause for a while; each successful request then recovers part of the configured rate, so throughput
+    settles at whatever the server tolerates."""
+
+    # the fraction of the configured rate recovered after each successful request
+    recovery_step = 0.1
+    # the allowed rate is never reduced below this fraction of the configured rate
+    min_rate_fraction = 0.05
+
+    def __init__(self, requests_per_second: Optional[float] = None):
+        """
+
+        Args:
+            requests_per_second: the maximum rate of requests, or None to only pause when backing off.
+        """
+        self.max_rate = requests_per_second
+        self.rate = requests_per_second
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be made."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.rate is not None:
+                    self._tokens = min(1.0, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if self._paused_until > now:
+                    wait = self._paused_until - now
+                elif self.rate is None or self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+    def back_off(self, delay: float):
+        """Pauses all requests for delay seconds and halves the allowed rate."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            if self.rate is not None:
+                self.rate = max(self.rate / 2, self.max_rate * self.min_rate_fraction)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate is not None and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery_step)
+
+
 def retry_with_logging(func: Callable, tries: int, delay: int, fargs=None, fkwargs=None):
     return retry_call(func, tries=tries, delay=delay, fargs=fargs, fkwargs=fkwargs, logger=Shared.logger)
 
@@ -144,32 +393,119 @@ def loading_bar(iterable: Iterable, description: str, total: Optional[int] = Non
         return iterable
 
 
+@contextmanager
+def loading_bar_callback(description: str, total: Optional[int] = None) -> Iterator[Callable[[int], None]]:
+    """Like loading_bar, for work that reports its progress rather than being iterated over. Yields a function to call
+    with how much has been done so far."""
+    if not Shared.loading_bars_enabled:
+        yield lambda done: None
+        return
+
+    bar = tqdm(desc=description, total=total)
+    try:
+        yield lambda done: bar.update(done - bar.n)
+    finally:
+        bar.close()
+
+
 def download_to_file_with_loading_bar(url: str, filename: str):
-    # https://stackoverflow.com/questions/37573483/progress-bar-while-download-file-over-http-with-requests
-    response = requests.get(url, stream=True)
-    total_size_in_bytes = int(response.headers.get('content-length', 0))
-    block_size = 1024
-    progress_bar = tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True, disable=not Shared.loading_bars_enabled)
-    with open(filename, 'wb') as file:
+    """Downloads url to filename a block at a time. The download is written to filename.download and only moved to
+    filename once it's complete; if an earlier download was interrupted, it carries on from where that one stopped, as
+    long as the server supports range requests and the file hasn't changed since."""
+    partial_filename = filename + '.download'
+    validator_filename = partial_filename + '.validator'  # the ETag or Last-Modified date of the partial download
+    offset = os.path.getsize(partial_filename) if os.path.exists(partial_filename) else 0
+    validator = None
+    if offset > 0 and os.path.exists(validator_filename):
+        with open(validator_filename, encoding='utf-8') as f:
+            validator = f.read()
+
+    headers = {} if validator is None else {'Range': 'bytes={}-'.format(offset), 'If-Range': validator}
+    response = http_get(url, stream=True, headers=headers)
+    if response.status_code == 416:  # the partial download is no longer a prefix of the file, so start over
+        response = http_get(url, stream=True)
+    response.raise_for_status()
+    if response.status_code == 206:
+        log(None, 'Resuming download of {} from {} bytes'.format(url, offset))
+        mode = 'ab'
+    else:  # a fresh download, because there was nothing to resume or the server couldn't resume it
+        offset = 0
+        mode = 'wb'
+        validator = response.headers.get('ETag', response.headers.get('Last-Modified'))
+        if validator is not None:
+            with open(validator_filename, 'w', encoding='utf-8') as f:
+                f.write(validator)
+        elif os.path.exists(validator_filename):
+            os.remove(validator_filename)
+
+    total_size_in_bytes = offset + int(response.headers.get('content-length', 0))
+    block_size = 64 * 1024
+    progress_bar = tqdm(total=total_size_in_bytes, initial=offset, unit='iB', unit_scale=True,
+                        disable=not Shared.loading_bars_enabled)
+    with open(partial_filename, mode) as file:
         for data in response.iter_content(block_size):
             progress_bar.update(len(data))
             file.write(data)
     progress_bar.close()
 
+    os.replace(partial_filename, filename)
+    if os.path.exists(validator_filename):
+        os.remove(validator_filename)
 
-def download_to_stream_with_loading_bar(url: str) -> BytesIO:
-    response = requests.get(url, stream=True)
-    total_size_in_bytes = int(response.headers.get('content-length', 0))
-    block_size = 1024
-    progress_bar = tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True, disable=not Shared.loading_bars_enabled)
-    stream = BytesIO()
-    for data in response.iter_content(block_size):
-        progress_bar.update(len(data))
-        stream.write(data)
-    progress_bar.close()
 
-    stream.seek(0)
-    return stream
+@contextmanager
+def _decompressing(archive: str, member: Optional[str]) -> Iterator[BinaryIO]:
+    if archive.endswith(('.tar.bz2', '.tar.gz', '.tgz')):
+        with tarfile.open(archive) as tar:
+            try:
+                info = tar.getmember(member)
+            except KeyError:
+                raise CardBuilderException('{} not found in {}'.format(member, archive))
+            yield tar.extractfile(info)
+    elif archive.endswith('.bz2'):
+        with bz2.open(archive, 'rb') as f:
+            yield f
+    elif archive.endswith('.gz'):
+        with gzip.open(archive, 'rb') as f:
+            yield f
+    else:
+        raise CardBuilderUsageException('Unsupported archive format: {}'.format(archive))
+
+
+def download_and_extract(url: str, filename: str, member: Optional[str] = None, encoding: Optional[str] = None):
+    """Downloads the compressed file at url, which can be bz2, gzip or a tar archive compressed with either, and
+    decompresses it to filename a block at a time, so memory use doesn't depend on the size of the file. member is the
+    file to extract from tar archives. If encoding is given, the decompressed text is converted from it to UTF-8.
+
+    The compressed file is kept next to filename until it's been extracted, so an interrupted download is resumed
+    rather than started over."""
+    archive = os.path.basename(urlsplit(url).path)
+    if not os.path.exists(archive):
+        download_to_file_with_loading_bar(url, archive)
+
+    temp_filename = filename + '.tmp'
+    block_size = 1024 * 1024
+    with _decompressing(archive, member) as source:
+        if encoding is None:
+            with open(temp_filename, 'wb') as destination:
+                shutil.copyfileobj(source, destination, block_size)
+        else:
+            with TextIOWrapper(source, encoding=encoding, newline='') as text_source, \
+                    open(temp_filename, 'w', encoding='utf-8', newline='') as destination:
+                shutil.copyfileobj(text_source, destination, block_size)
+
+    os.replace(temp_filename, filename)
+    os.remove(archive)
+
+
+def file_checksum(path: str) -> str:
+    """Returns the SHA-256 of the file at path as a hex string."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
 
 
 def grouper(n, iterable):
@@ -15,6 +15,14 @@ class WordLookupException(CardBuilderException):
         super().__init__(text)
 
 
+class ApiLimitException(WordLookupException):
+    """Raised when a web API can't be queried for a word because its daily quota is used up or it kept throttling our
+    requests. The word may well exist, so the remaining forms of the word aren't tried and the card built without it
+    isn't reused by incremental builds."""
+    def __init__(self, text):
+        super().__init__(text)
+
+
 class FieldLookupException(CardBuilderException):
     def __init__(self, text):
         super().__init__(text)
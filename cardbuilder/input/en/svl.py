@@ -1,13 +1,11 @@
-import sqlite3
 from glob import glob
-from os.path import exists
+from os.path import exists, basename
 from typing import Iterable, Tuple, List, Optional
 
-import requests
 from lxml import html
 
 from cardbuilder.common import Fieldname, Language
-from cardbuilder.common.util import log, InDataDir, loading_bar, DATABASE_NAME
+from cardbuilder.common.util import log, InDataDir, loading_bar, http_get
 from cardbuilder.input.word import WordForm, Word
 from cardbuilder.input.word_list import WordList
 from cardbuilder.lookup.data_source import ExternalDataDataSource
@@ -35,6 +33,9 @@ class SvlWords(WordList, ExternalDataDataSource):
                 for word in words:
                     yield word, level
 
+    def _source_files(self, table_name: str) -> List[str]:
+        return sorted(basename(name) for name in glob(str(InDataDir.directory / 'svl_*')))
+
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
         return self.lookup_data_type(word, form, str(content), {
             Fieldname.SUPPLEMENTAL: SingleValue(str(content))
@@ -50,7 +51,7 @@ class SvlWords(WordList, ExternalDataDataSource):
                     numstring = '0{}'.format(index) if index < 10 else str(index)
                     url = 'http://web.archive.org/web/20081219085635/http://www.alc.co.jp/goi/svl_l{}_list.htm'.format(
                         numstring)
-                    page = requests.get(url)
+                    page = http_get(url)
                     tree = html.fromstring(page.content)
                     containing_element = next(x for x in tree.xpath('//font') if len(x) > 900)
                     entries = {x.tail.strip() for x in containing_element if x.tag == 'br'}
@@ -61,18 +62,20 @@ class SvlWords(WordList, ExternalDataDataSource):
                         f.writelines(x + '\n' for x in entries)
 
     def __init__(self, order_by_wordfreq: bool = True, additional_forms: Optional[List[WordForm]] = None):
-        with InDataDir():
-            self.conn = sqlite3.connect(DATABASE_NAME)
-
-            self.default_table = type(self).__name__.lower()
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS {}(
-                word TEXT PRIMARY KEY,
-                content INT
-            );'''.format(self.default_table))
-            self.conn.commit()
-
-            self._fetch_remote_files_if_necessary()
-            self._load_data_into_database()
+        self.default_table = type(self).__name__.lower()
+        self._open_database()
+        self._prefetched = {}
+        if not self.read_only:
+            with InDataDir():
+                self.conn.execute('''CREATE TABLE IF NOT EXISTS {}(
+                    word TEXT PRIMARY KEY,
+                    content INT
+                );'''.format(self.default_table))
+                self.conn.commit()
+
+                if not self._table_is_current(self.default_table):
+                    self._fetch_remote_files_if_necessary()
+                    self._load_data_into_database()
 
         c = self.conn.execute('SELECT word, content from {}'.format(self.default_table))
 
@@ -1,13 +1,25 @@
+import asyncio
+import json
+import os
 import sqlite3
+import time
 from abc import ABC, abstractmethod
+from datetime import date
+from functools import partial
+from itertools import islice
+from logging import WARNING
 from os.path import exists
-from typing import Optional, Iterable, Tuple, Callable
+from typing import Optional, Iterable, Tuple, Callable, Dict, Any, List, Type
 import zlib
 
+import requests
+
+from cardbuilder.common.cache import CacheLimits
 from cardbuilder.common.config import Config
-from cardbuilder.common.util import log, grouper, download_to_file_with_loading_bar, DATABASE_NAME, retry_with_logging, \
-    InDataDir
-from cardbuilder.exceptions import WordLookupException
+from cardbuilder.common.util import log, grouper, download_to_file_with_loading_bar, retry_with_logging, InDataDir, \
+    ThreadLocalConnection, RateLimiter, http_get, pragmas_applied, INGEST_PRAGMAS, DATABASE_NAME, \
+    SOURCE_DATABASE_DIRECTORY, source_database_name, file_checksum
+from cardbuilder.exceptions import WordLookupException, ApiLimitException, CardBuilderUsageException
 from cardbuilder.input.word import Word
 from cardbuilder.lookup.lookup_data import LookupData
 
@@ -15,10 +27,17 @@ from cardbuilder.lookup.lookup_data import LookupData
 class DataSource(ABC):
     """The base class for all data sources, responsible for looking up various linguistic data about words.
     It implements basic logic for generating SQLite tables with the default schema (word TEXT, content) where the
-    content type is defined by the class variable content_type."""
+    content type is defined by the class variable content_type.
+
+    Each data source keeps its tables in its own database file, named after its class, so that sources can be written
+    to at the same time, rebuilt or purged on their own, and shared between machines. Database files that can't be
+    written to are opened read-only."""
 
     content_type = 'TEXT'
 
+    # SQLite limits how many parameters a statement can have, so bulk queries ask for at most this many forms at once
+    prefetch_chunk_size = 500
+
     @abstractmethod
     def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
         raise NotImplementedError()
@@ -27,30 +46,156 @@ class DataSource(ABC):
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
         raise NotImplementedError()
 
-    def __init__(self):
-        with InDataDir():
-            self.conn = sqlite3.connect(DATABASE_NAME)
+    async def lookup_word_async(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        """The asyncio counterpart of lookup_word. By default this just runs lookup_word in the event loop's executor,
+        so data sources which only support synchronous lookups can still be used from asynchronous code."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(self.lookup_word, word, form, following_link))
+
+    def prefetch(self, forms: Iterable[str]):
+        """Loads the stored content for many forms with a few bulk queries, so that the following lookups of those
+        forms don't each need their own query. Data sources without stored content ignore this."""
+        pass
+
+    def lookup_words(self, words: Iterable[Word]) -> Dict[Word, LookupData]:
+        """Looks up a whole list of words at once, returning the data for the first form of each word that was found.
+        Words with no form found are left out."""
+        words = list(words)
+        self.prefetch(form for word in words for form in word)
+
+        results = {}
+        for word in words:
+            for form in word:
+                try:
+                    results[word] = self.lookup_word(word, form)
+                    break
+                except WordLookupException:
+                    pass
 
+        return results
+
+    def __init__(self):
         self.default_table = type(self).__name__.lower()
-        self.conn.execute('''CREATE TABLE IF NOT EXISTS {}(
-            word TEXT PRIMARY KEY,
-            content {}
-        );'''.format(self.default_table, self.content_type))
-        self.conn.commit()
+        self._open_database()
+        self._prefetched: Dict[str, Any] = {}
+
+        if not self.read_only:
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS {}(
+                word TEXT PRIMARY KEY,
+                content {}
+            );'''.format(self.default_table, self.content_type))
+            self.conn.commit()
 
     def __del__(self):
-        self.conn.close()
+        self._connection.close()
+
+    @classmethod
+    def database_name(cls) -> str:
+        return source_database_name(cls.__name__)
+
+    def _open_database(self):
+        """Sets up the connection to this data source's database file, moving any of its tables that are still in the
+        shared database into it."""
+        path = InDataDir.directory / self.database_name()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.read_only = path.exists() and not os.access(str(path), os.W_OK)
+        self._connection = ThreadLocalConnection(self.database_name(), read_only=self.read_only)
+        if self.read_only:
+            log(self, 'Database file {} is read-only, so it will only be read from'.format(path))
+        else:
+            self._move_legacy_tables()
+
+    def _legacy_tables(self) -> List[str]:
+        """The tables this data source kept in the shared database before it had a database of its own."""
+        return [self.default_table]
+
+    def _legacy_shared_tables(self) -> List[str]:
+        """Tables in the shared database that all data sources kept rows in, with a source column holding their class
+        name. Only this data source's rows are moved."""
+        return []
+
+    def _obsolete_legacy_tables(self) -> List[str]:
+        """Tables this data source kept in the shared database that it no longer uses, which are dropped rather than
+        moved."""
+        return []
+
+    def _move_legacy_tables(self):
+        legacy_path = InDataDir.directory / DATABASE_NAME
+        if not legacy_path.exists():
+            return
+
+        conn = self.conn
+        existing_tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        tables = [table for table in self._legacy_tables() + self._legacy_shared_tables()
+                  if table not in existing_tables]
+        if len(tables) == 0 and len(self._obsolete_legacy_tables()) == 0:
+            return
+
+        conn.execute('ATTACH DATABASE ? AS legacy', (str(legacy_path),))
+        try:
+            legacy_tables = {row[0] for row in conn.execute("SELECT name FROM legacy.sqlite_master WHERE type='table'")}
+            for table in self._obsolete_legacy_tables():
+                if table in legacy_tables:
+                    log(self, 'Dropping table {} from {}, as it is no longer used'.format(table, DATABASE_NAME))
+                    conn.execute('DROP TABLE legacy.{}'.format(table))
+
+            for table in tables:
+                schema = conn.execute("SELECT sql FROM legacy.sqlite_master WHERE type='table' AND name=?",
+                                      (table,)).fetchone()
+                if schema is None:
+                    continue
+
+                shared = table in self._legacy_shared_tables()
+                condition, args = ('WHERE source=?', (type(self).__name__,)) if shared else ('', ())
+                log(self, 'Moving table {} from {} into {}'.format(table, DATABASE_NAME, self.database_name()))
+                conn.execute(schema[0])  # unqualified, so the table and its indexes are created in the main database
+                for index_schema, in conn.execute("SELECT sql FROM legacy.sqlite_master WHERE type='index' AND "
+                                                  "tbl_name=? AND sql IS NOT NULL", (table,)).fetchall():
+                    conn.execute(index_schema)
+                conn.execute('INSERT INTO main.{0} SELECT * FROM legacy.{0} {1}'.format(table, condition), args)
+                if shared:
+                    conn.execute('DELETE FROM legacy.{} {}'.format(table, condition), args)
+                else:
+                    conn.execute('DROP TABLE legacy.{}'.format(table))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute('DETACH DATABASE legacy')
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The SQLite connection for the calling thread, so data sources can be used from several threads at once."""
+        return self._connection.get()
 
     def get_table_rowcount(self, table_name: str = None):
         table_name = self.default_table if table_name is None else table_name
         c = self.conn.execute('SELECT COUNT(*) FROM {}'.format(table_name))
         return c.fetchone()[0]
 
+    def _query_contents(self, forms: Iterable[str]) -> Dict[str, Any]:
+        return self._query_by_forms('SELECT word, content FROM {} WHERE word IN ({{}})'.format(self.default_table),
+                                    forms)
+
+    def _query_by_forms(self, sql: str, forms: Iterable[str], args: Tuple = ()) -> Dict[str, Any]:
+        """Runs sql, which selects (word, value) rows and has a {} placeholder for the list of forms, for a few forms
+        at a time, followed by any other args."""
+        results = {}
+        for chunk in grouper(self.prefetch_chunk_size, set(forms)):
+            chunk = list(chunk)
+            cursor = self.conn.execute(sql.format(','.join('?' * len(chunk))), chunk + list(args))
+            results.update(cursor.fetchall())
+
+        return results
+
 
 class AggregatingDataSource(DataSource, ABC):
     """The base class for data sources that own other data sources and don't have a sqlite table of their own."""
 
     aggregated_content_delimiter = '||||'  # placed in between aggregated raw content
+    # the data sources it owns, whose databases hold its content
+    aggregated_sources: Tuple[Type[DataSource], ...] = ()
 
     def __init__(self):
         pass
@@ -71,10 +216,38 @@ class WebApiDataSource(DataSource, ABC):
 
     content_type = 'BLOB'
 
+    # default request limits; these can be overridden for each data source with the config keys
+    # <ClassName>_requests_per_second and <ClassName>_daily_quota
+    requests_per_second: Optional[float] = None
+    daily_quota: Optional[int] = None
+
+    # how many times a request is retried after the server responds with 429 or a server error
+    max_backoff_attempts = 5
+    backoff_base_delay = 1.0
+
+    usage_table = 'api_usage'
+
+    # how many seconds to remember that a form had no usable result, so rebuilds don't ask the API about it again; this
+    # can be overridden with the config key <ClassName>_negative_cache_ttl, and 0 turns negative caching off
+    negative_cache_ttl: float = 7 * 24 * 60 * 60
+    negative_cache_table = 'negative_cache'
+
+    # how many seconds cached responses are kept, and how many bytes of them are kept before the least recently used are
+    # evicted; these can be overridden with the config keys <ClassName>_cache_max_age and <ClassName>_cache_max_bytes
+    cache_max_age: Optional[float] = None
+    cache_max_bytes: Optional[int] = 256 * 1024 * 1024
+
     @abstractmethod
     def _query_api(self, form: str) -> str:
         raise NotImplementedError()
 
+    async def _query_api_async(self, form: str) -> str:
+        """Override this with a natively asynchronous request if possible. By default the blocking _query_api is run
+        in the event loop's executor, so no more requests are in flight at once than the executor has threads; none of
+        the data sources in cardbuilder have an asynchronous client yet."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._query_api, form)
+
     @staticmethod
     def _api_version() -> int:
         return 0
@@ -87,6 +260,9 @@ class WebApiDataSource(DataSource, ABC):
             SQLite cache.
         """
         super().__init__()
+        if self.read_only:
+            raise CardBuilderUsageException('{} needs to write its cache, but its database file {} is read-only'.format(
+                type(self).__name__, self.database_name()))
         version_key = type(self).__name__+'_api_version'
 
         try:
@@ -96,20 +272,140 @@ class WebApiDataSource(DataSource, ABC):
                           'Clearing cache and updating version...'.format(prev_api_version, self._api_version()))
                 self.conn.execute('DELETE FROM {}'.format(self.default_table))
                 self.conn.commit()
+                self.purge_negative_cache(type(self).__name__)
                 Config.set(version_key, str(self._api_version()))
         except KeyError:
             log(self, 'Found no API version, setting it to {}'.format(self._api_version()))
             Config.set(version_key, str(self._api_version()))
 
+        self.requests_per_second = self._limit_from_config('requests_per_second', float)
+        self.daily_quota = self._limit_from_config('daily_quota', int)
+        self._rate_limiter = RateLimiter(self.requests_per_second)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS {}(
+            source TEXT,
+            day TEXT,
+            requests INT,
+            PRIMARY KEY (source, day)
+        );'''.format(self.usage_table))
+        self.conn.commit()
+
+        self._cache_limits = CacheLimits(type(self).__name__, self.default_table, 'word', self.cache_max_age,
+                                         self.cache_max_bytes)
+        self._cache_limits.migrate(self.conn)
+        self._cache_limits.enforce(self.conn)
+
+        self.negative_cache_ttl = self._limit_from_config('negative_cache_ttl', float)
+        self._create_negative_cache_table(self.conn)
+        self.conn.execute('DELETE FROM {} WHERE source=? AND cached_at<=?'.format(self.negative_cache_table),
+                          (type(self).__name__, self._negative_cache_cutoff()))
+        self.conn.commit()
+
         self.enable_cache_retrieval = enable_cache_retrieval
         if self.enable_cache_retrieval:
             log(self, 'Found {} cached entries'.format(self.get_table_rowcount()))
         else:
             log(self, 'Running with cache retrieval disabled (will still write to cache)')
 
+    @classmethod
+    def _create_negative_cache_table(cls, conn: sqlite3.Connection):
+        conn.execute('''CREATE TABLE IF NOT EXISTS {}(
+            source TEXT,
+            word TEXT,
+            content BLOB,
+            cached_at REAL,
+            PRIMARY KEY (source, word)
+        );'''.format(cls.negative_cache_table))
+        conn.commit()
+
+    @classmethod
+    def purge_negative_cache(cls, source_name: Optional[str] = None) -> int:
+        """Forgets which forms had no usable result, for every web data source or just the one with the given class
+        name, so they'll be looked up again. Returns how many entries were removed."""
+        if source_name is None:
+            database_names = [str(path.relative_to(InDataDir.directory)) for path
+                              in (InDataDir.directory / SOURCE_DATABASE_DIRECTORY).glob('*.db')]
+        else:
+            database_names = [source_database_name(source_name)]
+
+        purged = 0
+        for database_name in database_names:
+            if not (InDataDir.directory / database_name).exists():
+                continue
+            connection = ThreadLocalConnection(database_name)
+            try:
+                conn = connection.get()
+                if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                                (cls.negative_cache_table,)).fetchone() is not None:
+                    purged += conn.execute('DELETE FROM {}'.format(cls.negative_cache_table)).rowcount
+                    conn.commit()
+            finally:
+                connection.close()
+
+        return purged
+
+    def _legacy_shared_tables(self) -> List[str]:
+        return [self.usage_table, self.negative_cache_table]
+
     def set_cache_retrieval(self, value: bool):
         self.enable_cache_retrieval = value
 
+    def prefetch(self, forms: Iterable[str]):
+        if not self.enable_cache_retrieval:
+            return
+
+        # forms that aren't cached are stored as None, so looking them up goes straight to the API
+        forms = set(forms)
+        cached_content = self._query_contents(forms)
+        missing_forms = forms.difference(cached_content)
+        if self.negative_cache_ttl > 0 and len(missing_forms) > 0:
+            cached_content.update(self._query_by_forms(
+                'SELECT word, content FROM {} WHERE word IN ({{}}) AND source=? AND cached_at>?'.format(
+                    self.negative_cache_table), missing_forms, (type(self).__name__, self._negative_cache_cutoff())))
+        self._prefetched = {form: cached_content.get(form) for form in forms}
+
+    def _negative_cache_cutoff(self) -> float:
+        return time.time() - self.negative_cache_ttl
+
+    def _limit_from_config(self, name: str, limit_type: type):
+        try:
+            return limit_type(Config.get('{}_{}'.format(type(self).__name__, name)))
+        except KeyError:
+            return getattr(self, name)
+
+    def _request(self, url: str, **kwargs) -> requests.Response:
+        """Makes a GET request to this data source's API while respecting its rate limit and daily quota, backing off
+        whenever the server responds with 429 or a server error. Use this instead of http_get in _query_api."""
+        for attempt in range(self.max_backoff_attempts + 1):
+            self._consume_quota()
+            self._rate_limiter.acquire()
+            # server errors are retried here rather than by the session, so each request sent is charged to the quota
+            response = http_get(url, retry_server_errors=False, **kwargs)
+            if response.status_code != 429 and response.status_code < 500:
+                self._rate_limiter.succeeded()
+                return response
+
+            retry_after = response.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else self.backoff_base_delay * 2 ** attempt
+            log(self, 'Received status {} from {}, backing off for {} seconds'.format(response.status_code, url, delay),
+                level=WARNING)
+            self._rate_limiter.back_off(delay)
+
+        raise ApiLimitException('{} was still throttled after {} attempts'.format(type(self).__name__,
+                                                                                  self.max_backoff_attempts + 1))
+
+    def _consume_quota(self):
+        if self.daily_quota is None:
+            return
+
+        source = type(self).__name__
+        today = date.today().isoformat()
+        self.conn.execute('INSERT OR IGNORE INTO {} VALUES (?, ?, 0)'.format(self.usage_table), (source, today))
+        cursor = self.conn.execute('UPDATE {} SET requests = requests + 1 WHERE source=? AND day=? AND requests < ?'
+                                   .format(self.usage_table), (source, today, self.daily_quota))
+        self.conn.commit()
+        if cursor.rowcount == 0:
+            raise ApiLimitException('{} has used its daily quota of {} requests'.format(source, self.daily_quota))
+
     def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
         cached_content = None
         if self.enable_cache_retrieval:
@@ -118,48 +414,126 @@ class WebApiDataSource(DataSource, ABC):
         if cached_content is not None:
             return self.parse_word_content(word, form, cached_content, following_link=following_link)
         else:
-            content = self._query_api(form)
+            return self._parse_and_cache(word, form, self._query_api(form), following_link)
+
+    async def lookup_word_async(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        # reading and writing the cache can wait on SQLite, so it's done in the executor to keep the event loop free
+        loop = asyncio.get_running_loop()
+        cached_content = None
+        if self.enable_cache_retrieval:
+            cached_content = await loop.run_in_executor(None, self._query_cached_api_results, form)
+
+        if cached_content is not None:
+            return self.parse_word_content(word, form, cached_content, following_link=following_link)
+        else:
+            content = await self._query_api_async(form)
+            return await loop.run_in_executor(None, partial(self._parse_and_cache, word, form, content,
+                                                            following_link))
+
+    def _parse_and_cache(self, word: Word, form: str, content: str, following_link: bool) -> LookupData:
+        compressed_content = zlib.compress(content.encode('utf-8'))
 
-            # parse it first so we don't save it if we can't parse it
+        # parse it first so we don't save it if we can't parse it
+        try:
             parsed_content = self.parse_word_content(word, form, content, following_link=following_link)
-            compressed_content = zlib.compress(content.encode('utf-8'))
+        except WordLookupException:
+            # the content is kept rather than just the failure, because whether it parses can depend on the word
+            if self.negative_cache_ttl > 0:
+                self.conn.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(self.negative_cache_table),
+                                  (type(self).__name__, form, compressed_content, time.time()))
+                self.conn.commit()
+                # prefetched forms are only looked up in _prefetched, so the miss is recorded there too
+                prefetched = self._prefetched
+                if form in prefetched:
+                    prefetched[form] = compressed_content
+            raise
 
-            # update cache
-            self.conn.execute('INSERT OR REPLACE INTO {} VALUES (?, ?)'.format(self.default_table),
-                              (form, compressed_content))
-            self.conn.commit()
+        # update cache
+        self.conn.execute('DELETE FROM {} WHERE source=? AND word=?'.format(self.negative_cache_table),
+                          (type(self).__name__, form))
+        self._cache_limits.store(self.conn, form, compressed_content)
+        self._prefetched.pop(form, None)
 
-            return parsed_content
+        return parsed_content
 
     def _query_cached_api_results(self, form: str) -> Optional[str]:
-        cursor = self.conn.execute('SELECT content FROM {} WHERE word=?'.format(self.default_table), (form,))
-        result = cursor.fetchone()
-        return zlib.decompress(result[0]).decode('utf-8') if result is not None else None
+        """Returns the cached content for form, which is content that failed to parse if the form is negatively
+        cached, or None if there is nothing cached for it."""
+        prefetched = self._prefetched  # prefetch() may swap in a new dict from another thread
+        if form in prefetched:
+            compressed_content = prefetched[form]
+        else:
+            cursor = self.conn.execute('SELECT content FROM {} WHERE word=?'.format(self.default_table), (form,))
+            result = cursor.fetchone()
+            if result is None and self.negative_cache_ttl > 0:
+                cursor = self.conn.execute('SELECT content FROM {} WHERE source=? AND word=? AND cached_at>?'.format(
+                    self.negative_cache_table), (type(self).__name__, form, self._negative_cache_cutoff()))
+                result = cursor.fetchone()
+            compressed_content = result[0] if result is not None else None
+
+        if compressed_content is None:
+            return None
+        self._cache_limits.touch(self.conn, form)
+        return zlib.decompress(compressed_content).decode('utf-8')
 
 
 class ExternalDataDataSource(DataSource, ABC):
     """The base class for data sources which depend on external data such as downloaded files. Contains logic for
-    ingesting these files into SQlite tables and looking up data from those tables."""
+    ingesting these files into SQlite tables and looking up data from those tables.
+
+    Every loaded table is recorded in an ingest manifest along with the parser version and the size, modification time
+    and checksum of the files it was loaded from, and is only loaded again when one of those changes."""
 
+    # rows are read and inserted this many at a time while loading data, which is also how often progress is reported
     batch_size = 10000
 
+    manifest_table = 'ingest_manifest'
+
     @abstractmethod
     def _read_and_convert_data(self) -> Iterable[Tuple[str, str]]:
         raise NotImplementedError()
 
+    @staticmethod
+    def _parser_version() -> int:
+        """Bump this whenever a change to the data source changes what ends up in its tables, so they're loaded
+        again."""
+        return 0
+
+    def _table_parser_version(self, table_name: str) -> int:
+        """The parser version table_name is loaded with, which is _parser_version() unless overridden, so that a change
+        to how one table is built doesn't have to reload every other table of the data source."""
+        return self._parser_version()
+
     def __init__(self):
         super().__init__()
+        if self.read_only:  # prebuilt, so there's nothing to fetch or load
+            return
+        if self._table_is_current(self.default_table):
+            log(self, 'found {} database entries for table {}'.format(self.get_table_rowcount(), self.default_table))
+            return
         with InDataDir():
             retry_with_logging(self._fetch_remote_files_if_necessary, tries=2, delay=1)
         self._load_data_into_database()
 
+    def prefetch(self, forms: Iterable[str]):
+        # forms that aren't in the table are stored as None, so looking them up fails without another query
+        forms = set(forms)
+        contents = self._query_contents(forms)
+        self._prefetched = {form: contents.get(form) for form in forms}
+
     def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
-        cursor = self.conn.execute('SELECT content FROM {} WHERE word=?'.format(self.default_table), (form,))
-        result = cursor.fetchone()
-        if result is None:
+        prefetched = self._prefetched  # prefetch() may swap in a new dict from another thread
+        if form in prefetched:
+            content = prefetched[form]
+        else:
+            cursor = self.conn.execute('SELECT content FROM {} WHERE word=?'.format(self.default_table), (form,))
+            result = cursor.fetchone()
+            content = result[0] if result is not None else None
+
+        if content is None:
             raise WordLookupException('form "{}" not found in data source table for {}'.format(form,
                                                                                                type(self).__name__))
-        return self.parse_word_content(word, form, result[0], following_link=following_link)
+        return self.parse_word_content(word, form, content, following_link=following_link)
 
     def _fetch_remote_files_if_necessary(self):
         if not hasattr(self, 'filename') or not hasattr(self, 'url'):
@@ -169,31 +543,152 @@ class ExternalDataDataSource(DataSource, ABC):
             log(self, '{} not found - downloading...'.format(self.filename))
             download_to_file_with_loading_bar(self.url, self.filename)
 
+    def _table_indexes(self, table_name: str) -> Dict[str, str]:
+        """Returns the secondary indexes for a table loaded by _load_data_into_database, as a dict of index names to
+        the columns they cover. They're created after the table is loaded, which is much faster than keeping them up to
+        date while inserting every row."""
+        return {}
+
+    def _drop_loaded_table(self, table_name: str):
+        """Drops table_name, if it exists, along with its ingest manifest entry."""
+        self.conn.execute('DROP TABLE IF EXISTS {}'.format(table_name))
+        self._create_manifest_table(self.conn)
+        self.conn.execute('DELETE FROM {} WHERE table_name=?'.format(self.manifest_table), (table_name,))
+        self.conn.commit()
+
+    def _source_files(self, table_name: str) -> List[str]:
+        """Returns the files table_name is loaded from, relative to the data directory. Changing any of them causes
+        the table to be loaded again."""
+        return [self.filename] if hasattr(self, 'filename') else []
+
+    def _table_is_current(self, table_name: str) -> bool:
+        """Returns whether table_name was completely loaded by the current parser version from source files that
+        haven't changed since. Source files that aren't there, like for databases installed with import_db, are assumed
+        not to have changed."""
+        conn = self.conn
+        self._create_manifest_table(conn)
+        entry = conn.execute('SELECT parser_version, source_files, row_count FROM {} WHERE table_name=?'.format(
+            self.manifest_table), (table_name,)).fetchone()
+        row_count = self.get_table_rowcount(table_name)
+        source_paths = {name: InDataDir.directory / name for name in self._source_files(table_name)}
+        if entry is None:
+            if row_count > 0 and not any(path.exists() for path in source_paths.values()):
+                log(self, 'table {} was loaded before ingest manifests existed, and there are no source files to load '
+                          'it from again, so it will be used as is'.format(table_name))
+                return True
+            if row_count > 0:
+                log(self, 'table {} has no record of being completely loaded, so it will be loaded again'.format(
+                    table_name))
+            return False
+
+        parser_version, recorded_files, recorded_row_count = entry
+        if parser_version != self._table_parser_version(table_name):
+            log(self, 'table {} was loaded by parser version {}, and will be loaded again with version {}'.format(
+                table_name, parser_version, self._table_parser_version(table_name)))
+            return False
+        if recorded_row_count != row_count:
+            log(self, 'table {} has {} rows but was loaded with {}, so it will be loaded again'.format(
+                table_name, row_count, recorded_row_count), level=WARNING)
+            return False
+
+        recorded_files = {source_file['name']: source_file for source_file in json.loads(recorded_files)}
+        updated = False
+        for name, path in source_paths.items():
+            if not path.exists():
+                continue
+
+            stat = path.stat()
+            recorded = recorded_files.get(name)
+            if recorded is not None and recorded['size'] == stat.st_size:
+                if recorded['mtime'] == stat.st_mtime:
+                    continue
+                if recorded['sha256'] == file_checksum(str(path)):  # only touched, not changed
+                    recorded['mtime'] = stat.st_mtime
+                    updated = True
+                    continue
+
+            log(self, '{} has changed since table {} was loaded, so it will be loaded again'.format(name, table_name))
+            return False
+
+        if updated:
+            conn.execute('UPDATE {} SET source_files=? WHERE table_name=?'.format(self.manifest_table),
+                         (json.dumps(list(recorded_files.values())), table_name))
+            conn.commit()
+        return True
+
+    @classmethod
+    def _create_manifest_table(cls, conn: sqlite3.Connection):
+        conn.execute('''CREATE TABLE IF NOT EXISTS {}(
+            table_name TEXT PRIMARY KEY,
+            parser_version INT,
+            source_files TEXT,
+            row_count INT,
+            completed_at REAL
+        );'''.format(cls.manifest_table))
+        conn.commit()
+
+    def _describe_source_files(self, table_name: str) -> List[Dict[str, Any]]:
+        descriptions = []
+        for name in self._source_files(table_name):
+            path = InDataDir.directory / name
+            if path.exists():
+                stat = path.stat()
+                descriptions.append({'name': name, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                                     'sha256': file_checksum(str(path))})
+
+        return descriptions
+
     def _load_data_into_database(self, table_name: str = None, iter_func: Callable[[], Iterable] = None,
-                                 sql: str = None):
+                                 sql: str = None, progress: Optional[Callable[[int], None]] = None):
+        """Loads the rows from iter_func into table_name, unless it's already current (see _table_is_current). The
+        rows are inserted into a shadow copy of the table, which replaces it in the same transaction, so the table is
+        never seen partly loaded and a load that fails partway leaves the previous data in place. sql is the insert
+        statement to use, with {} in place of the table name. progress, if given, is called with the number of rows
+        read so far after every batch."""
         table_name = self.default_table if table_name is None else table_name
         iter_func = self._read_and_convert_data if iter_func is None else iter_func
-        sql = 'INSERT INTO {} VALUES (?, ?)'.format(table_name) if sql is None else sql
-        data_count = self.get_table_rowcount(table_name)
-        if data_count != 0:
-            log(self, 'found {} database entries for table {}'.format(data_count, table_name))
+        sql = 'INSERT INTO {} VALUES (?, ?)' if sql is None else sql
+        if self._table_is_current(table_name):
+            log(self, 'found {} database entries for table {}'.format(self.get_table_rowcount(table_name), table_name))
             return
-        else:
-            log(self, 'sqlite table {} appears to be empty, and will be populated'.format(table_name))
-            with InDataDir():
-                for batch_iter in grouper(self.batch_size, iter_func()):
-                    self.conn.executemany(sql, batch_iter)
-                    self.conn.commit()
-
-            log(self, 'finished populating sqlite table {} with {} entries'.format(table_name,
-                                                                                   self.get_table_rowcount(table_name)))
-
-
-
-
-
-
-
-
-
 
+        log(self, 'sqlite table {} will be populated'.format(table_name))
+        conn = self.conn
+        shadow_table = '{}_shadow'.format(table_name)
+        schema = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
+                              (table_name,)).fetchone()[0]
+        source_files = self._describe_source_files(table_name)
+        with InDataDir(), pragmas_applied(conn, INGEST_PRAGMAS):
+            try:
+                conn.execute('BEGIN')
+                conn.execute('DROP TABLE IF EXISTS {}'.format(shadow_table))
+                conn.execute(schema.replace(table_name, shadow_table, 1))
+
+                rows = iter(iter_func())
+                rows_read = 0
+                while True:
+                    batch = list(islice(rows, self.batch_size))
+                    if len(batch) == 0:
+                        break
+                    conn.executemany(sql.format(shadow_table), batch)
+                    rows_read += len(batch)
+                    if progress is not None:
+                        progress(rows_read)
+
+                # counted rather than taken from rows_read, since statements like INSERT OR IGNORE can skip rows
+                row_count = conn.execute('SELECT COUNT(*) FROM {}'.format(shadow_table)).fetchone()[0]
+                conn.execute('DROP TABLE {}'.format(table_name))
+                conn.execute('ALTER TABLE {} RENAME TO {}'.format(shadow_table, table_name))
+                for index_name, columns in self._table_indexes(table_name).items():
+                    conn.execute('CREATE INDEX {} ON {} ({})'.format(index_name, table_name, columns))
+                conn.execute('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?, ?)'.format(self.manifest_table),
+                             (table_name, self._table_parser_version(table_name), json.dumps(source_files), row_count,
+                              time.time()))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+        # moves the loaded pages out of the write-ahead log, which would otherwise stay as big as the table
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        log(self, 'finished populating sqlite table {} with {} entries'.format(table_name, row_count))
@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime, timezone
+from os.path import basename, exists
+from typing import Dict
+
+from cardbuilder.common.util import InDataDir, connect_to_database, log, source_database_name, file_checksum
+from cardbuilder.exceptions import CardBuilderException, CardBuilderUsageException
+from cardbuilder.lookup.data_source import DataSource
+
+# bumped whenever the layout of artifacts changes in a way older versions of cardbuilder can't read
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST_TABLE = 'cardbuilder_artifact'
+CHECKSUM_SUFFIX = '.sha256'
+
+
+def build_database_artifact(data_source: DataSource, output_path: str) -> str:
+    """Copies the database of an already loaded data source to output_path as a single self-contained file, with a
+    manifest table describing what's in it and a sha256sum compatible checksum file next to it. Returns the checksum."""
+    source_conn = data_source.conn
+    source_conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    tables = [row[0] for row in source_conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND "
+                                                    "name NOT LIKE 'sqlite_%'")]
+    manifest = {
+        'format_version': str(ARTIFACT_FORMAT_VERSION),
+        'source': type(data_source).__name__,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'sqlite_version': sqlite3.sqlite_version,
+        'row_counts': json.dumps({table: data_source.get_table_rowcount(table) for table in tables}, sort_keys=True)
+    }
+
+    if exists(output_path):
+        os.remove(output_path)
+    conn = connect_to_database(output_path, pragmas={})
+    try:
+        source_conn.backup(conn)
+        # a rollback journal keeps the artifact in one file, which can be opened read-only where it's installed
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.execute('CREATE TABLE {} (key TEXT PRIMARY KEY, value TEXT)'.format(MANIFEST_TABLE))
+        conn.executemany('INSERT INTO {} VALUES (?, ?)'.format(MANIFEST_TABLE), manifest.items())
+        conn.commit()
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+    checksum = file_checksum(output_path)
+    with open(output_path + CHECKSUM_SUFFIX, 'w', encoding='utf-8') as f:
+        f.write('{}  {}\n'.format(checksum, basename(output_path)))
+
+    log(None, 'Wrote database for {} to {} with checksum {}'.format(manifest['source'], output_path, checksum))
+    return checksum
+
+
+def read_artifact_manifest(path: str) -> Dict[str, str]:
+    conn = connect_to_database(path, pragmas={}, read_only=True)
+    try:
+        return dict(conn.execute('SELECT key, value FROM {}'.format(MANIFEST_TABLE)).fetchall())
+    except sqlite3.DatabaseError:
+        raise CardBuilderUsageException('{} is not a cardbuilder database artifact'.format(path))
+    finally:
+        conn.close()
+
+
+def import_database_artifact(path: str) -> str:
+    """Checks an artifact made by build_database_artifact against its checksum file and installs it as the database of
+    the data source it was built from, replacing whatever that data source had before. Returns the data source's class
+    name."""
+    checksum_path = path + CHECKSUM_SUFFIX
+    if not exists(checksum_path):
+        raise CardBuilderUsageException('No checksum file found for {}; expected {}'.format(path, checksum_path))
+    with open(checksum_path, encoding='utf-8') as f:
+        expected_checksum = f.read().split()[0]
+    if file_checksum(path) != expected_checksum:
+        raise CardBuilderException('{} does not match its checksum, and may be corrupt or incomplete'.format(path))
+
+    manifest = read_artifact_manifest(path)
+    if int(manifest['format_version']) > ARTIFACT_FORMAT_VERSION:
+        raise CardBuilderUsageException('{} was built by a newer version of cardbuilder (artifact format {})'.format(
+            path, manifest['format_version']))
+
+    source_name = manifest['source']
+    destination = str(InDataDir.directory / source_database_name(source_name))
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # copied next to the destination first, so that a failed copy never leaves a partial database in its place
+    temp_destination = destination + '.import'
+    shutil.copyfile(path, temp_destination)
+    for stale_file in (destination + '-wal', destination + '-shm'):
+        if exists(stale_file):
+            os.remove(stale_file)
+    os.replace(temp_destination, destination)
+
+    log(None, 'Installed database for {} built at {} with {}'.format(source_name, manifest['created_at'],
+                                                                      ', '.join('{} rows in {}'.format(count, table)
+                                                                                for table, count in json.loads(
+                                                                                    manifest['row_counts']).items())))
+    return source_name
@@ -1,8 +1,10 @@
+import asyncio
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from json import loads
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Iterable
 
-import requests
 from bs4 import BeautifulSoup
 from bs4.element import Tag
 
@@ -28,13 +30,15 @@ class ScrapingMerriamWebster(WebApiDataSource):
     synonyms_name = 'synonyms'
     antonyms_name = 'antonyms'
 
+    requests_per_second = 5
+
     pos_cleaning_regex = re.compile(r"[^a-zA-Z]")
 
     def _query_api(self, form: str) -> str:
         url = 'https://www.merriam-webster.com/dictionary/{}'.format(form)
         # custom Accept-Encoding header is very important: without it, MW sometimes returns redirect loops
         # (this happens for example with "science")
-        html = requests.get(url, headers={'Accept-Encoding': 'identity'}).content
+        html = self._request(url, headers={'Accept-Encoding': 'identity'}).content
         return str(html)
 
     #TODO: throw lookup exception if we can't find anything/content is empty (right now we just return empty data?)
@@ -117,6 +121,8 @@ class ScrapingMerriamWebster(WebApiDataSource):
 class CollegiateThesaurus(WebApiDataSource):
     # https://dictionaryapi.com/products/api-collegiate-thesaurus
 
+    daily_quota = 1000  # the limit for free keys
+
     def __init__(self, api_key):
         super().__init__()
         log(self, 'initializing Collegiate Thesaurus with api key {}'.format(api_key))
@@ -126,7 +132,7 @@ class CollegiateThesaurus(WebApiDataSource):
         url = 'https://www.dictionaryapi.com/api/v3/references/thesaurus/json/{word}?key={api_key}'.format(
             word=word, api_key=self.api_key
         )
-        return requests.get(url).text
+        return self._request(url).text
 
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
         raw_json = loads(content)
@@ -164,6 +170,8 @@ class CollegiateThesaurus(WebApiDataSource):
 class LearnerDictionary(WebApiDataSource):
     # https://dictionaryapi.com/products/api-learners-dictionary
 
+    daily_quota = 1000  # the limit for free keys
+
     audio_file_format = 'mp3'
     number_subdir_regex = re.compile(r'^[^a-zA-Z]+')
     # this is fairly aggressive - for example it entirely erases "{it} chiefly US {/it}"
@@ -177,7 +185,7 @@ class LearnerDictionary(WebApiDataSource):
     def _query_api(self, word) -> str:
         url = 'https://www.dictionaryapi.com/api/v3/references/learners/json/{word}?key={api_key}'.format(
             word=word, api_key=self.api_key)
-        return requests.get(url).text
+        return self._request(url).text
 
     def _get_pronunciation_content(self, pronunciation_data: List) -> Tuple[List, List]:
         pronunciation_url_list = []
@@ -288,15 +296,27 @@ class LearnerDictionary(WebApiDataSource):
 })
 class MerriamWebster(AggregatingDataSource):
     # https://dictionaryapi.com/products/json
-    # Each lookup here is two requests to MW; be careful if using an account limited to 1000/day
+    # Each lookup here is two requests to MW; the dictionary and thesaurus each stop at their daily_quota, which
+    # defaults to the 1000/day free key limit
 
     keylike = re.compile(r'.+-.+-.+-.+')
+    aggregated_sources = (LearnerDictionary, CollegiateThesaurus)
 
     learners_api_conf_name = 'mw_learners_api_key'
     thesaurus_api_conf_name = 'thesaurus_api_key'
 
     def __init__(self, learners_api_key: Optional[str] = None, thesaurus_api_key: Optional[str] = None,
-                 pos_in_definitions=False):
+                 pos_in_definitions=False, concurrent_lookup=False):
+        """
+
+        Args:
+            learners_api_key: a Learner's Dictionary API key, or the location of a file containing one.
+            thesaurus_api_key: a Collegiate Thesaurus API key, or the location of a file containing one.
+            pos_in_definitions: whether to include parts of speech in definitions.
+            concurrent_lookup: whether to query the thesaurus at the same time as the dictionary. This makes lookups
+                faster, but the thesaurus is then queried even for words the dictionary doesn't have, using up its
+                quota, so it's off by default.
+        """
         api_keys = []
         for idx, key in enumerate([learners_api_key, thesaurus_api_key]):
             key_name = self.learners_api_conf_name if idx == 0 else self.thesaurus_api_conf_name
@@ -325,22 +345,66 @@ class MerriamWebster(AggregatingDataSource):
         self.learners_dict = LearnerDictionary(api_keys[0])
         self.thesaurus = CollegiateThesaurus(api_keys[1])
         self.pos_in_definitions = pos_in_definitions
+        self._thesaurus_executor = ThreadPoolExecutor(thread_name_prefix='cardbuilder-thesaurus') \
+            if concurrent_lookup else None
 
     def __del__(self):
-        pass  # no need to close any database connections like DataSource does
+        # no need to close any database connections like DataSource does
+        if getattr(self, '_thesaurus_executor', None) is not None:
+            self._thesaurus_executor.shutdown(wait=False)
+
+    def prefetch(self, forms: Iterable[str]):
+        forms = list(forms)
+        self.learners_dict.prefetch(forms)
+        self.thesaurus.prefetch(forms)
 
     def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        if self._thesaurus_executor is not None:
+            thesaurus_future = self._thesaurus_executor.submit(self.thesaurus.lookup_word, word, form)
+            lookup_thesaurus = thesaurus_future.result
+        else:
+            lookup_thesaurus = partial(self.thesaurus.lookup_word, word, form)
+
         dictionary_data = self.learners_dict.lookup_word(word, form)
+        try:  # thesaurus gags an awful lot
+            thesaurus_data = lookup_thesaurus()
+        except WordLookupException:
+            thesaurus_data = None
+
+        return self._combine_lookup_data(word, form, dictionary_data, thesaurus_data)
+
+    async def lookup_word_async(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        # both APIs are queried with blocking requests run in the event loop's executor
+        if self._thesaurus_executor is not None:
+            dictionary_data, thesaurus_data = await asyncio.gather(self.learners_dict.lookup_word_async(word, form),
+                                                                   self.thesaurus.lookup_word_async(word, form),
+                                                                   return_exceptions=True)
+            if isinstance(dictionary_data, Exception):
+                raise dictionary_data
+            if isinstance(thesaurus_data, WordLookupException):
+                thesaurus_data = None
+            elif isinstance(thesaurus_data, Exception):
+                raise thesaurus_data
+        else:
+            # only query the thesaurus for words the dictionary has, as lookup_word does
+            dictionary_data = await self.learners_dict.lookup_word_async(word, form)
+            try:
+                thesaurus_data = await self.thesaurus.lookup_word_async(word, form)
+            except WordLookupException:
+                thesaurus_data = None
+
+        return self._combine_lookup_data(word, form, dictionary_data, thesaurus_data)
 
+    def _combine_lookup_data(self, word: Word, form: str, dictionary_data: LookupData,
+                             thesaurus_data: Optional[LookupData]) -> LookupData:
         output = dictionary_data.get_data()
-        try:  # thesaurus gags an awful lot
-            thesaurus_data = self.thesaurus.lookup_word(word, form)
+        if thesaurus_data is not None:
             output = {
                 **output, **thesaurus_data.get_data()
             }
             content = dictionary_data.get_raw_content() + self.aggregated_content_delimiter \
                       + thesaurus_data.get_raw_content()
-        except WordLookupException:
+        else:
             content = dictionary_data.get_raw_content()
 
         return self.lookup_data_type(word, form, content, output)
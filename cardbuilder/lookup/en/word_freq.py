@@ -31,6 +31,9 @@ class WordFrequency(ExternalDataDataSource):
         c = self.conn.execute('''SELECT * FROM {}'''.format(self.default_table))
         self.frequency = dict(c.fetchall())
 
+    def prefetch(self, forms: Iterable[str]):
+        pass  # the whole table is already in memory
+
     def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
         if form not in self.frequency:
             raise WordLookupException('No frequency information for {}'.format(form))
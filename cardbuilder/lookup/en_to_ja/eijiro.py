@@ -3,7 +3,7 @@ from collections import defaultdict
 from logging import WARNING
 from os.path import abspath
 from string import digits
-from typing import Tuple, Iterable, Optional
+from typing import Tuple, Iterable, Optional, List
 
 from cardbuilder.common.config import Config
 from cardbuilder.common import Fieldname
@@ -221,6 +221,9 @@ class Eijiro(ExternalDataDataSource):
     def _fetch_remote_files_if_necessary(self):
         pass  # No remote files to fetch, takes an explicit file location
 
+    def _source_files(self, table_name: str) -> List[str]:
+        return [] if self.file_loc is None else [self.file_loc]
+
     def __init__(self, eijiro_location: Optional[str] = None):
         if eijiro_location is not None:
             self.file_loc = abspath(eijiro_location)
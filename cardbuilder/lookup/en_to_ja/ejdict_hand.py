@@ -4,10 +4,8 @@ from os.path import exists
 from string import ascii_lowercase
 from typing import Tuple, Iterable
 
-import requests
-
 from cardbuilder.common import Fieldname
-from cardbuilder.common.util import log, loading_bar
+from cardbuilder.common.util import log, loading_bar, http_get
 from cardbuilder.exceptions import WordLookupException
 from cardbuilder.input.word import Word
 from cardbuilder.lookup.data_source import ExternalDataDataSource
@@ -31,7 +29,7 @@ class EJDictHand(ExternalDataDataSource):
             all_content = bytes()
             for letter in loading_bar(ascii_lowercase, 'downloading EJDict-hand files'):
                 url = 'https://raw.githubusercontent.com/kujirahand/EJDict/master/src/{}.txt'.format(letter)
-                request = requests.get(url)
+                request = http_get(url)
                 all_content = all_content + request.content
 
             with open(self.filename, 'wb+') as f:
@@ -1,5 +1,3 @@
-import requests
-
 from cardbuilder.input.word import Word
 from cardbuilder.lookup.data_source import WebApiDataSource, AggregatingDataSource
 from cardbuilder.lookup.lookup_data import LookupData
@@ -19,7 +17,7 @@ class SimplaVortaro(AggregatingDataSource):
 class SimplaVortaroMeta(WebApiDataSource):
     def _query_api(self, word: str) -> str:
         url = simpla_vortaro_url + '/api/v1/trovi/{}'.format(word)
-        return requests.get(url).text
+        return self._request(url).text
 
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
         pass
@@ -28,7 +26,7 @@ class SimplaVortaroMeta(WebApiDataSource):
 class SimplaVortaroDefinition(WebApiDataSource):
     def _query_api(self, word: str) -> str:
         url = simpla_vortaro_url + '/api/v1/vorto/{}'.format(word)
-        return requests.get(url).text
+        return self._request(url).text
 
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
         pass
\ No newline at end of file
@@ -1,8 +1,6 @@
 import math
 from collections import defaultdict
 
-import requests
-
 from bs4 import BeautifulSoup
 
 from cardbuilder.common import Fieldname
@@ -48,6 +46,8 @@ class ScrapingOjad(WebApiDataSource):
 
     base_url = "http://www.gavo.t.u-tokyo.ac.jp/ojad/"
 
+    requests_per_second = 2  # this is a university server, so we go easy on it
+
     def __init__(self, male_audio: bool = True):
         super(ScrapingOjad, self).__init__()
         self.male_audio = male_audio
@@ -65,7 +65,7 @@ class ScrapingOjad(WebApiDataSource):
         url = f'{self.base_url}search/index/sortprefix:accent/narabi1:kata_asc/' \
               f'narabi2:accent_asc/narabi3:mola_asc/yure:visible/curve:fujisaki/details:invisible/limit:20/word:{form}'
 
-        html = requests.get(url).content
+        html = self._request(url).content
         return html.decode('utf-8')
 
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
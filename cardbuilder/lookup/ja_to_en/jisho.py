@@ -1,8 +1,6 @@
 from json import dumps, loads
 from typing import Dict, Set
 
-import requests
-
 from cardbuilder.common import Fieldname
 from cardbuilder.common.util import is_hiragana, Shared
 from cardbuilder.exceptions import WordLookupException
@@ -22,6 +20,8 @@ from cardbuilder.lookup.value import SingleValue, ListValue, MultiListValue
 class Jisho(WebApiDataSource):
     """The DataSource class for jisho.org's API"""
 
+    requests_per_second = 5
+
     @staticmethod
     def _to_katakana_reading(form: str) -> str:
         return ''.join(x['kana'] for x in Shared.get_kakasi().convert(form))
@@ -64,7 +64,7 @@ class Jisho(WebApiDataSource):
 
     def _query_api(self, form: str) -> str:
         url = 'https://jisho.org/api/v1/search/words?keyword={}'.format(form)
-        json = requests.get(url).json()['data']
+        json = self._request(url).json()['data']
         return dumps(json)
 
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
@@ -1,19 +1,21 @@
 import csv
 import re
-import sqlite3
-import tarfile
-from bz2 import BZ2Decompressor
-from collections import defaultdict
-from json import loads
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from itertools import groupby
+from math import ceil
 from os.path import exists
 from string import punctuation
-from typing import List, Tuple, Iterable
+from typing import List, Tuple, Iterable, Optional, Deque
 
 from fugashi import Tagger
 
 from cardbuilder.common import Fieldname, Language
-from cardbuilder.common.util import is_hiragana, fast_linecount, loading_bar, log, download_to_stream_with_loading_bar, \
-    DATABASE_NAME, InDataDir
+from cardbuilder.common.util import is_hiragana, fast_linecount, loading_bar, log, download_and_extract, \
+    InDataDir, pragmas_applied, Shared, loading_bar_callback
 from cardbuilder.exceptions import WordLookupException, CardBuilderUsageException
 from cardbuilder.input.word import Word
 from cardbuilder.lookup.data_source import ExternalDataDataSource
@@ -21,38 +23,124 @@ from cardbuilder.lookup.lookup_data import outputs, LookupData
 from cardbuilder.lookup.value import MultiValue
 
 
+# sentence ids are stored as little-endian unsigned 32 bit ints, which Tatoeba's ids are a long way from outgrowing
+_ID_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+
+def pack_sentence_pairs(pairs: Iterable[Tuple[int, int]]) -> bytes:
+    """Packs (source sentence id, target sentence id) pairs into bytes, keeping their order."""
+    ids = array(_ID_TYPECODE)
+    for source_id, target_id in pairs:
+        ids.append(source_id)
+        ids.append(target_id)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids.tobytes()
+
+
+def unpack_sentence_pairs(packed: bytes, limit: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Unpacks pairs packed by pack_sentence_pairs, only reading the first limit of them if limit is given."""
+    ids = array(_ID_TYPECODE)
+    ids.frombytes(packed if limit is None else packed[:limit * 2 * ids.itemsize])
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return list(zip(ids[::2], ids[1::2]))
+
+
+_punctuation_regex = re.compile('[{}]'.format(re.escape(punctuation)))
+_tagger: Optional[Tagger] = None
+
+
+def _split_japanese_sentence(sentence: str, lemmatize: bool) -> List[str]:
+    # taggers can't be sent to other processes, so each process that tokenizes sentences makes its own
+    global _tagger
+    if _tagger is None:
+        _tagger = Tagger()
+
+    split_words = []
+    for node in _tagger(sentence):
+        split_words.append(node.surface)
+        # the dictionary form, so conjugated verbs and adjectives are found by the form they're looked up with
+        lemma = getattr(node.feature, 'orthBase', None) if lemmatize else None
+        if lemma is not None and lemma != node.surface:
+            split_words.append(lemma)
+    return [x for x in split_words if not (len(x) == 1 and is_hiragana(x))]
+
+
+def _split_by_spaces(sentence: str) -> List[str]:
+    cleaned_sentence = _punctuation_regex.sub(' ', sentence.lower())
+    return cleaned_sentence.split()
+
+
+def _spacy_lemmas(language: Language, sentences: List[str]) -> List[List[str]]:
+    nlp = Shared.get_spacy(language)
+    return [[token.lemma_.lower() for token in doc if token.is_alpha] for doc in nlp.pipe(sentences, batch_size=256)]
+
+
+def _tokenize_sentences(language: str, lemmatize: bool, sentences: List[Tuple[int, str]]) -> List[Tuple[str, int]]:
+    """Returns a (word, sentence id) posting for every distinct word in each sentence, and with lemmatize, for the
+    lemma of every word as well, where there's a lemmatizer for the language. A module level function so that it can
+    run in worker processes."""
+    if language == Language.JAPANESE.value:
+        word_lists = [_split_japanese_sentence(sent, lemmatize) for _, sent in sentences]
+    else:
+        word_lists = [_split_by_spaces(sent) for _, sent in sentences]
+        if lemmatize and Language(language) in Shared.spacy_model_names:
+            lemma_lists = _spacy_lemmas(Language(language), [sent for _, sent in sentences])
+            for words, lemmas in zip(word_lists, lemma_lists):
+                words.extend(lemmas)
+
+    postings = []
+    for (ident, _), words in zip(sentences, word_lists):
+        postings.extend((word, ident) for word in set(words) if not word.isnumeric() and word not in punctuation)
+    return postings
+
+
 @outputs({
     Fieldname.EXAMPLE_SENTENCES: MultiValue
 })
 class TatoebaExampleSentences(ExternalDataDataSource):
 
-    links_table_name = 'tatoeba_links'
+    # links between sentences of every language used to be kept in one table, joined against at every lookup
+    legacy_links_table_name = 'tatoeba_links'
     sentences_table_name_formatstring = 'tatoeba_{}_sentences'
-    index_table_name_formatstring = 'tatoeba_{}_index'
-    punctuation_regex = re.compile('[{}]'.format(re.escape(punctuation)))
+    pairs_table_name_formatstring = 'tatoeba_{}_{}_pairs'
+    index_table_name_formatstring = 'tatoeba_{}_{}_index'
+    # the index used to list every sentence for each word, whatever the target language
+    legacy_index_table_name_formatstring = 'tatoeba_{}_index'
     links_file = 'links.csv'
     links_url = 'https://downloads.tatoeba.org/exports/links.tar.bz2'
     sentences_filename_template = '{}_sentences.tsv'
+    postings_table = 'tatoeba_postings'
+    translations_table = 'tatoeba_translations'
+    # how many of each word's best example sentences are kept in the index
+    sentences_per_word = 50
+    # roughly how many bytes each (word, sentence id) pair takes up while it's buffered in Python
+    posting_size = 100
+    # sentences are handed to tokenizing workers this many at a time, with up to this many batches per worker in flight
+    tokenize_batch_size = 1000
+    batches_in_flight_per_worker = 2
     data_dict = {}
 
+    def prefetch(self, forms: Iterable[str]):
+        pass  # lookups go through the sentence index rather than the default table
+
     def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
-        c = self.conn.execute("select sent_id_list from tatoeba_{}_index where word=?;".format(self.source_lang), (form,))
+        c = self.conn.execute('SELECT sent_pairs FROM {} WHERE word=?'.format(self._index_table()), (form,))
         index_result = c.fetchone()
         if index_result is None:
             raise WordLookupException('Word "{}" not found in the Tatoeba index for language {}'.format(form,
                                                                                                         self.source_lang))
-        else:
-            index_ids = loads(index_result[0])
-
-        c = self.conn.execute('''
-        select tatoeba_{0}_sentences.sentence as {0}_sentence, tatoeba_{1}_sentences.sentence as {1}_sentence
-        from tatoeba_{0}_sentences 
-        inner join tatoeba_links on tatoeba_{0}_sentences.sent_id=src_sent_id
-        inner join tatoeba_{1}_sentences on tatoeba_{1}_sentences.sent_id=target_sent_id
-        where tatoeba_{0}_sentences.sent_id in ({2});
-        '''.format(self.source_lang, self.target_lang, ','.join(str(x) for x in index_ids)))
-
-        example_sentence_pairs = c.fetchall()
+
+        # pairs are stored best first, so only the ones that will be returned are read
+        pairs = unpack_sentence_pairs(index_result[0], self.max_sentences)
+        source_ids = sorted({source_id for source_id, _ in pairs})
+        c = self.conn.execute('SELECT src_id, tgt_id, src_sentence, tgt_sentence FROM {} WHERE src_id IN ({})'.format(
+            self._pairs_table(), ','.join('?' * len(source_ids))), source_ids)
+        sentences_by_pair = {(source_id, target_id): (source_sentence, target_sentence)
+                             for source_id, target_id, source_sentence, target_sentence in c}
+
+        example_sentence_pairs = [sentences_by_pair[pair] for pair in pairs if pair in sentences_by_pair]
         if len(example_sentence_pairs) == 0:
             raise WordLookupException('Found no corresponding example sentences for word {} in'
                                       ' Tatoeba data for language {}'.format(form, self.target_lang))
@@ -64,19 +152,22 @@ class TatoebaExampleSentences(ExternalDataDataSource):
         })
 
     def _create_tables(self):
-        # links table
+        # translated sentence pairs for just this language pair, clustered by source sentence
+        self._drop_loaded_table(self.legacy_links_table_name)
         self.conn.execute('''CREATE TABLE IF NOT EXISTS {}(
-             src_sent_id INT,
-             target_sent_id INT
-         );'''.format(self.links_table_name))
-        self.conn.execute('''CREATE INDEX IF NOT EXISTS links_source_sentence
-            ON {} (src_sent_id);'''.format(self.links_table_name))
+             src_id INT,
+             tgt_id INT,
+             src_sentence TEXT,
+             tgt_sentence TEXT,
+             PRIMARY KEY (src_id, tgt_id)
+         ) WITHOUT ROWID;'''.format(self._pairs_table()))
 
-        # index of words to sentence IDs table
+        # index of words to their best example sentence pairs, with the IDs packed by pack_sentence_pairs
+        self._drop_loaded_table(self.legacy_index_table_name_formatstring.format(self.source_lang))
         self.conn.execute('''CREATE TABLE IF NOT EXISTS {}(
              word TEXT PRIMARY KEY,
-             sent_id_list TEXT
-         );'''.format(self.index_table_name_formatstring.format(self.source_lang)))
+             sent_pairs BLOB
+         );'''.format(self._index_table()))
 
         # sentences table for both languages
         for lang in (self.source_lang, self.target_lang):
@@ -87,7 +178,54 @@ class TatoebaExampleSentences(ExternalDataDataSource):
 
         self.conn.commit()
 
+    def _index_table(self) -> str:
+        return self.index_table_name_formatstring.format(self.source_lang, self.target_lang)
+
+    def _pairs_table(self) -> str:
+        return self.pairs_table_name_formatstring.format(self.source_lang, self.target_lang)
+
+    def _loaded_tables(self) -> List[str]:
+        # in the order they're loaded, since each is built from the ones before it
+        return [self.sentences_table_name_formatstring.format(lang) for lang in (self.source_lang, self.target_lang)] \
+               + [self._pairs_table(), self._index_table()]
+
+    def _legacy_tables(self) -> List[str]:
+        return self._loaded_tables()
+
+    def _obsolete_legacy_tables(self) -> List[str]:
+        return [self.legacy_links_table_name] + [self.legacy_index_table_name_formatstring.format(lang.value)
+                                                 for lang in Language]
+
+    def _source_files(self, table_name: str) -> List[str]:
+        for lang in (self.source_lang, self.target_lang):
+            if table_name == self.sentences_table_name_formatstring.format(lang):
+                return [self.sentences_filename_template.format(lang)]
+        # the pairs are built from both languages' sentences and the links between them, and the index from the pairs
+        return [self.sentences_filename_template.format(lang) for lang in (self.source_lang, self.target_lang)] + \
+               [self.links_file]
+
+    def _table_parser_version(self, table_name: str) -> int:
+        if table_name == self._index_table():
+            # whether lemmas are indexed changes what's in the index, so it's part of its version
+            return 2 if self.lemmatize else 1
+        return self._parser_version()
+
+    def _sorted_sentence_ids(self, lang: str) -> array:
+        cursor = self.conn.execute('SELECT sent_id FROM {} ORDER BY sent_id'.format(
+            self.sentences_table_name_formatstring.format(lang)))
+        return array(_ID_TYPECODE, (ident for ident, in cursor))
+
     def _read_links_data(self) -> Iterable[Tuple[int, int]]:
+        """Yields the links from source to target language sentences. links.csv has links between every pair of
+        languages, so the ids of each language's sentences are kept in sorted arrays to check links against, which
+        take a fraction of the memory of sets."""
+        source_ids = self._sorted_sentence_ids(self.source_lang)
+        target_ids = self._sorted_sentence_ids(self.target_lang)
+
+        def contains(ids: array, ident: int) -> bool:
+            index = bisect_left(ids, ident)
+            return index < len(ids) and ids[index] == ident
+
         #  each link is guaranteed to be in the file going both directions, so no special logic is necessary
         with InDataDir():
             line_count = fast_linecount(self.links_file)
@@ -95,7 +233,9 @@ class TatoebaExampleSentences(ExternalDataDataSource):
             with open(self.links_file, 'r', encoding='utf-8') as f:
                 reader = csv.reader(f, delimiter='\t')
                 for source_id, target_id in loading_bar(reader, 'reading links.csv', line_count):
-                    yield int(source_id), int(target_id)
+                    source_id, target_id = int(source_id), int(target_id)
+                    if contains(source_ids, source_id) and contains(target_ids, target_id):
+                        yield source_id, target_id
 
     def _read_language_sents(self, lang) -> Iterable[Tuple[int, str]]:
         filename = self.sentences_filename_template.format(lang)
@@ -105,42 +245,164 @@ class TatoebaExampleSentences(ExternalDataDataSource):
             for ident, _, sentence in loading_bar(reader, 'reading {}'.format(filename), line_count):
                 yield int(ident), sentence
 
-    def _compute_and_yield_index_data(self, id_sent_data: List[Tuple[int, str]]) -> Iterable[Tuple[str, str]]:
-        # the word index would certainly take up less memory as a trie, but it's probably not worth the trouble
-        results = defaultdict(set)
-        for ident, sent in loading_bar(id_sent_data, 'indexing sentences'):
-            words = self._split_sentence(sent)
-            for word in (w for w in words if not w.isnumeric() and w not in punctuation):
-                results[word].add(ident)
+    def _build_postings(self):
+        """Fills a temporary table with a row for every word in every source language sentence and indexes it by word.
+        Rows are buffered and written in batches sized by index_memory_budget, and SQLite spills anything that doesn't
+        fit in the rest of the budget to temporary files while indexing them, so memory use doesn't grow with the size
+        of the corpus."""
+        sentences_table = self.sentences_table_name_formatstring.format(self.source_lang)
+        batch_size = max(1, self.index_memory_budget * 1024 * 1024 // 2 // self.posting_size)
+        conn = self.conn
+        conn.execute('DROP TABLE IF EXISTS temp.{}'.format(self.postings_table))
+        conn.execute('CREATE TEMP TABLE {} (word TEXT, sent_id INT)'.format(self.postings_table))
+
+        postings = []
+        cursor = conn.execute('SELECT sent_id, sentence FROM {}'.format(sentences_table))
+        sentence_batches = iter(lambda: cursor.fetchmany(self.tokenize_batch_size), [])
+        batch_count = ceil(self.get_table_rowcount(sentences_table) / self.tokenize_batch_size)
+        for batch_postings in loading_bar(self._tokenized_batches(sentence_batches), 'indexing sentences', batch_count):
+            postings.extend(batch_postings)
+            if len(postings) >= batch_size:
+                conn.executemany('INSERT INTO temp.{} VALUES (?, ?)'.format(self.postings_table), postings)
+                postings = []
+        conn.executemany('INSERT INTO temp.{} VALUES (?, ?)'.format(self.postings_table), postings)
+
+        conn.execute('CREATE INDEX temp.{0}_word ON {0} (word, sent_id)'.format(self.postings_table))
+        conn.commit()
+
+    def _tokenized_batches(self, sentence_batches: Iterable[List[Tuple[int, str]]]) -> Iterable[List[Tuple[str, int]]]:
+        """Tokenizes batches of sentences into postings, in worker processes if there's more than one worker. Batches
+        come back in the order they were read, so the index comes out the same however many workers there are."""
+        source_language = Language(self.source_lang)
+        if self.lemmatize and source_language != Language.JAPANESE and source_language in Shared.spacy_model_names:
+            # loaded, and downloaded if need be, once up front rather than by every worker at the same time. Forked
+            # workers share the loaded model; elsewhere each worker loads its own copy, so workers cost memory
+            Shared.get_spacy(source_language)
 
-        for word, identity_set in results.items():
-            yield word, str(list(identity_set))
+        if self.workers == 1:
+            for batch in sentence_batches:
+                yield _tokenize_sentences(self.source_lang, self.lemmatize, batch)
+            return
 
-    def __init__(self, source_lang: Language, target_lang: Language):
+        # like ResolutionEngine, only a bounded window of batches is submitted at a time, so memory use doesn't depend
+        # on how far ahead of the slowest batch reading gets
+        max_in_flight = self.workers * self.batches_in_flight_per_worker
+        pending: Deque[Future] = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for batch in sentence_batches:
+                pending.append(executor.submit(_tokenize_sentences, self.source_lang, self.lemmatize, batch))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+    def _build_translations(self):
+        """Fills a temporary table with the shortest translation of every source language sentence that has one."""
+        conn = self.conn
+        conn.execute('DROP TABLE IF EXISTS temp.{}'.format(self.translations_table))
+        conn.execute('CREATE TEMP TABLE {} (src_id INTEGER PRIMARY KEY, tgt_id INT, src_length INT)'.format(
+            self.translations_table))
+        # SQLite takes the bare columns of an aggregate query from the row that min() picked
+        conn.execute('''
+        INSERT INTO temp.{0}
+        SELECT src_id, tgt_id, src_length FROM (
+            SELECT src_id, tgt_id, length(src_sentence) AS src_length, min(length(tgt_sentence))
+            FROM {1}
+            GROUP BY src_id
+        );
+        '''.format(self.translations_table, self._pairs_table()))
+        conn.commit()
+
+    def _compute_and_yield_index_data(self) -> Iterable[Tuple[str, bytes]]:
+        """Ranks each word's translated sentences, shortest first since those tend to make the most learnable examples,
+        and yields the best sentences_per_word of them with distinct translations. Only one word's sentences are read at
+        a time, and only the best are kept."""
+        cursor = self.conn.execute('''
+        SELECT word, src_id, tgt_id FROM temp.{} INNER JOIN temp.{} ON src_id=sent_id
+        ORDER BY word, src_length, src_id
+        '''.format(self.postings_table, self.translations_table))
+        for word, rows in groupby(cursor, key=lambda row: row[0]):
+            pairs = []
+            seen_translations = set()
+            for _, source_id, target_id in rows:
+                if target_id not in seen_translations:
+                    seen_translations.add(target_id)
+                    pairs.append((source_id, target_id))
+                    if len(pairs) == self.sentences_per_word:
+                        break
+            yield word, pack_sentence_pairs(pairs)
+
+    def __init__(self, source_lang: Language, target_lang: Language, max_sentences: int = 50,
+                 index_memory_budget: int = 256, workers: int = 1, lemmatize: bool = True):
+        """
+
+        Args:
+            source_lang: the language of the words being looked up.
+            target_lang: the language example sentences are translated into.
+            max_sentences: the most sentence pairs to return for a word, of the sentences_per_word best that are kept
+                for each word when the index is built.
+            index_memory_budget: roughly how many megabytes of memory building the word index can use. Past that, the
+                index is built in temporary files.
+            workers: the number of processes to tokenize sentences in while building the word index, which is worth
+                raising for languages like Japanese whose tokenizers are slow. Where worker processes can't be forked,
+                each one loads its own copy of the tokenizer, so more workers also take more memory.
+            lemmatize: whether to index sentences by the lemmas of their words as well as the words themselves, so that
+                looking up a word's dictionary form finds its inflected forms too, without needing a WordForm.LEMMA
+                form for every word. Supported for Japanese and for languages with a spaCy model.
+        """
+        if workers < 1:
+            raise CardBuilderUsageException('TatoebaExampleSentences needs at least one worker')
         self.source_lang = source_lang.value
         self.target_lang = target_lang.value
+        self.max_sentences = max_sentences
+        self.index_memory_budget = index_memory_budget
+        self.workers = workers
+        self.lemmatize = lemmatize
         # intentionally don't call parent init; tatoeba doesn't use default sql table
+        self.default_table = type(self).__name__.lower()
+        self._open_database()
+        self._prefetched = {}
+
+        if self.read_only:  # prebuilt, so there's nothing to fetch or load
+            return
+
+        self._create_tables()
+        if all(self._table_is_current(table) for table in self._loaded_tables()):
+            return
+
         with InDataDir():
-            self.conn = sqlite3.connect(DATABASE_NAME)
             self._fetch_remote_files_if_necessary()
 
-        self._create_tables()
-        self._load_data_into_database(self.links_table_name, self._read_links_data)
         for lang in (self.source_lang, self.target_lang):
             self._load_data_into_database(self.sentences_table_name_formatstring.format(lang),
                                           lambda: self._read_language_sents(lang))
+        # the sentences are filled in from their tables as each link is inserted; links.csv can list a link twice
+        pairs_sql = '''INSERT OR IGNORE INTO {{}}
+            SELECT src.sent_id, tgt.sent_id, src.sentence, tgt.sentence FROM {} AS src, {} AS tgt
+            WHERE src.sent_id=? AND tgt.sent_id=?'''.format(
+            *(self.sentences_table_name_formatstring.format(lang) for lang in (self.source_lang, self.target_lang)))
+        self._load_data_into_database(self._pairs_table(), self._read_links_data, sql=pairs_sql)
 
-        if self.source_lang == Language.JAPANESE:
-            self.tagger = Tagger('-Owakati')
-            self._split_sentence = self._split_japanese_sentence
-        else:
-            self._split_sentence = self._split_by_spaces
-
-        cursor = self.conn.execute('SELECT sent_id, sentence FROM {}'.format(
-            self.sentences_table_name_formatstring.format(self.source_lang)))
-        source_lang_data = cursor.fetchall()
-        self._load_data_into_database(self.index_table_name_formatstring.format(self.source_lang),
-                                      lambda: self._compute_and_yield_index_data(source_lang_data))
+        index_table = self._index_table()
+        if not self._table_is_current(index_table):
+            # half the budget buffers postings (see _build_postings), the other half is SQLite's page cache for the
+            # temporary table they're sorted in. It's dropped before temp_store is set back, since that would drop it
+            build_pragmas = {'temp_store': 'FILE', 'temp.cache_size': -self.index_memory_budget * 1024 // 2}
+            with pragmas_applied(self.conn, build_pragmas):
+                try:
+                    self._build_postings()
+                    self._build_translations()
+                    # the words are ranked as they're read, so the only sign of progress is the rows inserted
+                    with loading_bar_callback('ranking sentences') as progress:
+                        self._load_data_into_database(index_table, self._compute_and_yield_index_data,
+                                                      progress=progress)
+                except BaseException:
+                    self.conn.rollback()
+                    raise
+                finally:
+                    for temp_table in (self.postings_table, self.translations_table):
+                        self.conn.execute('DROP TABLE IF EXISTS temp.{}'.format(temp_table))
 
     def _fetch_remote_files_if_necessary(self):
         url_template = 'https://downloads.tatoeba.org/exports/per_language/{}/{}_sentences.tsv.bz2'
@@ -156,25 +418,8 @@ class TatoebaExampleSentences(ExternalDataDataSource):
             if not exists(filename):
                 log(self, '{} not found - downloading and extracting...'.format(filename))
 
-                stream_data = download_to_stream_with_loading_bar(url)
-                if url[-8:] == '.tar.bz2':
-                    tar = tarfile.open(fileobj=stream_data, mode='r:bz2')
-                    tar.extract(filename)
-                elif url[-4:] == '.bz2':
-                    with open(filename, 'wb+') as f:
-                        f.write(BZ2Decompressor().decompress(stream_data.read()))
-                else:
-                    raise CardBuilderUsageException('Retrieved unexpected file format from Tatoeba: {}'.format(url))
-
-    def _split_japanese_sentence(self, sentence: str) -> List[str]:
-        # hacky and only accommodates  exact matches (I.E. conjugated verbs are shot), could probably be done better
-        split_words_generator = (str(x) for x in self.tagger(sentence))
-        split_words = [x for x in split_words_generator if not (len(x) == 1 and is_hiragana(x))]
-        return split_words
-
-    def _split_by_spaces(self, sentence: str) -> List[str]:
-        cleaned_sentence = self.punctuation_regex.sub(' ', sentence.lower())
-        return cleaned_sentence.split()
+                # links come in a tar archive holding just the file we want, the sentences as bare bz2 files
+                download_and_extract(url, filename, member=filename)
 
     def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
         pass  # don't need this because we override #lookup_word
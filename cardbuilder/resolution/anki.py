@@ -1,4 +1,5 @@
 import re
+from logging import WARNING
 from os import remove
 from os.path import exists, join
 from shutil import rmtree
@@ -7,6 +8,7 @@ from typing import Dict, List, Optional, Callable
 import genanki
 
 from cardbuilder.common import Fieldname
+from cardbuilder.common.util import log
 from cardbuilder.exceptions import CardBuilderException, CardBuilderUsageException
 from cardbuilder.lookup.data_source import DataSource
 from cardbuilder.lookup.lookup_data import LookupData
@@ -20,8 +22,9 @@ anki_audio_field_regex = re.compile(r'\[sound:.+\]')
 
 
 class AnkiAudioDownloadPrinter(DownloadPrinter):
-    def __init__(self):
-        super(AnkiAudioDownloadPrinter, self).__init__(AkpgResolver.media_temp_directory, '[sound:{filename}]')
+    def __init__(self, download_workers: int = 4):
+        super(AnkiAudioDownloadPrinter, self).__init__(AkpgResolver.media_temp_directory, '[sound:{filename}]',
+                                                       download_workers)
 
 
 class AnkiWrappingPrinter(WrappingPrinter):
@@ -41,13 +44,14 @@ class AkpgResolver(Resolver):
     
     def __init__(self, fields: List[Field], 
                  mutator: Callable[[Dict[DataSource, LookupData]], Dict[DataSource, LookupData]] = None,
-                 wrap_printers=True):
+                 wrap_printers=True, workers: int = 1, concurrent_sources: bool = False,
+                 async_concurrency: Optional[int] = None):
 
         if wrap_printers:
             for field in fields:
                 field.printer = AnkiWrappingPrinter(field.printer)
 
-        super(AkpgResolver, self).__init__(fields, mutator)
+        super(AkpgResolver, self).__init__(fields, mutator, workers, concurrent_sources, async_concurrency)
 
     @staticmethod
     def _str_to_id(s: str) -> int:
@@ -69,52 +73,78 @@ class AkpgResolver(Resolver):
         self.css = css
         self.note_name = name
 
-    def _output_file(self, rows: List[CardData], name: str):
-        sample_row = rows[0]
-        output_filename = name.lower().replace(' ', '_')
-
-        templates = self.templates if hasattr(self, 'templates') else self.default_templates
-        css = self.css if hasattr(self, 'css') else ''
-        note_name = self.note_name if hasattr(self, 'note_name') else 'cardbuilder default'
-
-        model = genanki.Model(self._str_to_id(note_name), note_name,
-                              fields=[
-                                  {'name': f.name} for f in sample_row.fields
-                              ],
-                              templates=templates,
-                              css=css)
-
-        deck = genanki.Deck(self._str_to_id(name), name)
-        for row in rows:
-            fields = [x.value if len(x.value) > 0 else ' ' for x in row.fields]  # Anki sometimes doesn't like empty fields
-            deck.add_note(genanki.Note(model=model, fields=fields))
-
-        package = genanki.Package(deck)
-        if next((rf for rf in sample_row.fields if rf.source_name == Fieldname.AUDIO), None) is not None:
+    # genanki can only write a package in one go, so notes are added to the deck as cards come in (leaving the cards
+    # themselves to be garbage collected) and the package is written when the output is closed
+
+    def _open_output(self, name: str):
+        self._output_name = name
+        self._deck = genanki.Deck(self._str_to_id(name), name)
+        self._model = None
+        self._has_audio = False
+        self._media_files = []
+        self._audio_notes = []
+
+    def _append_output(self, card: CardData):
+        if self._model is None:
+            templates = self.templates if hasattr(self, 'templates') else self.default_templates
+            css = self.css if hasattr(self, 'css') else ''
+            note_name = self.note_name if hasattr(self, 'note_name') else 'cardbuilder default'
+
+            self._model = genanki.Model(self._str_to_id(note_name), note_name,
+                                        fields=[
+                                            {'name': f.name} for f in card.fields
+                                        ],
+                                        templates=templates,
+                                        css=css)
+            self._has_audio = next((rf for rf in card.fields if rf.source_name == Fieldname.AUDIO), None) is not None
+
+        fields = [x.value if len(x.value) > 0 else ' ' for x in card.fields]  # Anki sometimes doesn't like empty fields
+        note = genanki.Note(model=self._model, fields=fields)
+        self._deck.add_note(note)
+
+        if self._has_audio:
+            # this is admittedly a pretty fragile way to find audio fields, but there's no better way unless
+            # we started using a Value type specifically for audio
+            audio_field = next((rf for rf in card.fields if anki_audio_field_regex.match(rf.value)), None)
+            if audio_field is not None:
+                media_file = join(self.media_temp_directory, audio_field.value[7:-1])
+                self._media_files.append(media_file)
+                self._audio_notes.append((media_file, note, card.fields.index(audio_field)))
+
+    def _close_output(self) -> str:
+        if self._model is None:
+            raise CardBuilderException('No cards were resolved, so there is nothing to write to an Anki package')
+
+        output_filename = self._output_name.lower().replace(' ', '_')
+        package = genanki.Package(self._deck)
+        if self._has_audio:
             if not exists(self.media_temp_directory):
                 raise CardBuilderException('Field with audio source found but no temporary media directory found')
 
-            media_files = []
-            for row in rows:
-                # this is admittedly a pretty fragile way to find audio fields, but there's no better way unless
-                # we started using a Value type specifically for audio
-                audio_field = next((rf for rf in row.fields if anki_audio_field_regex.match(rf.value)), None)
-                if audio_field is not None:
-                    media_files.append(join(self.media_temp_directory, audio_field.value[7:-1]))
-
-            package.media_files = media_files
-
-            for file in package.media_files:
-                if not exists(file):
-                    raise CardBuilderUsageException('Supplied Anki media file {} not found'.format(file))
+            # files whose download failed are left out, along with the audio fields that refer to them
+            missing_files = {file for file in self._media_files if not exists(file)}
+            for file in sorted(missing_files):
+                log(self, 'Media file {} is missing, so its audio is left off its cards'.format(file), level=WARNING)
+            for media_file, note, field_index in self._audio_notes:
+                if media_file in missing_files:
+                    note.fields[field_index] = ' '
+            package.media_files = [file for file in self._media_files if file not in missing_files]
 
         final_out_name = '{}.apkg'.format(output_filename)
         if exists(output_filename):
             remove(output_filename)
         package.write_to_file(final_out_name)
+        self._deck = None
+        self._audio_notes = []
 
         # this has to come last because the directory needs to exist when we write out the anki file
         if exists(self.media_temp_directory):
             rmtree(self.media_temp_directory)
 
         return final_out_name
+
+    def _abort_output(self):
+        self._deck = None
+        self._model = None
+        self._media_files = []
+        self._audio_notes = []
@@ -1,9 +1,20 @@
-from typing import List
+import json
+from typing import List, Optional
 
+from cardbuilder.common import Fieldname
 from cardbuilder.resolution.field import ResolvedField
 
 
 class CardData:
-    def __init__(self, fields: List[ResolvedField]):
+    def __init__(self, fields: List[ResolvedField], fingerprint: Optional[str] = None):
         self.fields = fields
+        # identifies everything that went into the card, for decks that are built incrementally
+        self.fingerprint = fingerprint
 
+    def to_json(self) -> str:
+        return json.dumps([[field.name, field.source_name.value, field.value] for field in self.fields])
+
+    @classmethod
+    def from_json(cls, serialized: str, fingerprint: Optional[str] = None) -> 'CardData':
+        return cls([ResolvedField(name, Fieldname(source_name), value)
+                    for name, source_name, value in json.loads(serialized)], fingerprint)
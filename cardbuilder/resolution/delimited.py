@@ -1,15 +1,30 @@
 import csv
-from typing import List
+from typing import Optional, TextIO
 
 from cardbuilder.resolution.card_data import CardData
 from cardbuilder.resolution.resolver import Resolver
 
 
 class CsvResolver(Resolver):
-    def _output_file(self, rows: List[CardData], filename: str) -> str:
-        final_out_name = '{}.csv'.format(filename.lower().replace(' ', '_'))
-        with open(final_out_name, 'w+', encoding='utf-8') as f:
-            w = csv.writer(f, quoting=csv.QUOTE_ALL, quotechar='"', delimiter=',')
-            w.writerows([field.value for field in row.fields] for row in rows)
+    """Writes cards to a CSV file as they're resolved, so the file fills in as resolution goes along."""
 
-        return final_out_name
+    _output: Optional[TextIO] = None
+
+    def _open_output(self, name: str):
+        self._output_name = '{}.csv'.format(name.lower().replace(' ', '_'))
+        self._output = open(self._output_name, 'w+', encoding='utf-8')
+        self._writer = csv.writer(self._output, quoting=csv.QUOTE_ALL, quotechar='"', delimiter=',')
+
+    def _append_output(self, card: CardData):
+        self._writer.writerow([field.value for field in card.fields])
+
+    def _close_output(self) -> str:
+        self._output.close()
+        self._output = None
+        return self._output_name
+
+    def _abort_output(self):
+        # whatever was resolved before the failure is left in the file
+        if self._output is not None:
+            self._output.close()
+            self._output = None
@@ -0,0 +1,106 @@
+import hashlib
+from typing import Any, List, Optional, Tuple, Iterable
+
+from cardbuilder.common.util import ThreadLocalConnection, grouper, log
+from cardbuilder.input.word import Word
+from cardbuilder.lookup.lookup_data import LookupData
+from cardbuilder.resolution.card_data import CardData
+from cardbuilder.resolution.journal import hash_configuration
+
+
+class DeckFingerprints:
+    """Remembers the last card built for every word in a deck, along with a fingerprint of everything that went into
+    it: the word and its forms, the raw content every data source found for it and the field configuration. Rebuilding
+    the deck can then reuse the card for any word whose fingerprint hasn't changed, instead of resolving its fields and
+    printing them again."""
+
+    table_name = 'deck_fingerprints'
+    # like the resolution journal, entries are held in memory and written a batch at a time
+    commit_interval = 200
+
+    def __init__(self, deck: str, configuration: Any, reuse_cards: bool = True):
+        """
+
+        Args:
+            deck: the name of the deck.
+            configuration: everything besides the data that affects how cards are built, like the deck's fields.
+            reuse_cards: if False, no previous cards are returned, but the cards built this time are still recorded for
+                the next build.
+        """
+        self.deck = deck
+        self.reuse_cards = reuse_cards
+        self.configuration_hash = hash_configuration(configuration)
+        self._connection = ThreadLocalConnection()
+        self._pending: List[Tuple[str, str, str, str]] = []
+
+        conn = self._connection.get()
+        conn.execute('''CREATE TABLE IF NOT EXISTS {} (
+            deck TEXT,
+            word TEXT,
+            fingerprint TEXT,
+            fields TEXT,
+            PRIMARY KEY (deck, word)
+        );'''.format(self.table_name))
+        conn.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def fingerprint(self, word: Word, lookup_data: List[Optional[LookupData]]) -> str:
+        """Hashes word and the data found for it by each data source, in order, with None for sources that found
+        nothing."""
+        digest = hashlib.sha256()
+        for part in [self.configuration_hash, word.input_form] + list(word):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+
+        for data in lookup_data:
+            if data is None:
+                digest.update(b'\1')
+            else:
+                digest.update('{}\0{}'.format(data.found_form, data.get_raw_content()).encode('utf-8'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def previous_card(self, word: Word, fingerprint: str) -> Optional[CardData]:
+        """Returns the card last built for word if it was built with the same fingerprint, or None otherwise. Safe to
+        call from any thread."""
+        if not self.reuse_cards:
+            return None
+
+        result = self._connection.get().execute('SELECT fields FROM {} WHERE deck=? AND word=? AND fingerprint=?'
+                                                .format(self.table_name), (self.deck, word.input_form, fingerprint))
+        result = result.fetchone()
+        return None if result is None else CardData.from_json(result[0], fingerprint)
+
+    def record(self, word: Word, card: CardData):
+        if card.fingerprint is None:
+            return
+
+        self._pending.append((self.deck, word.input_form, card.fingerprint, card.to_json()))
+        if len(self._pending) >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        conn = self._connection.get()
+        conn.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(self.table_name), self._pending)
+        conn.commit()
+        self._pending = []
+
+    def prune(self, words: Iterable[Word]):
+        """Forgets every word in the deck that isn't in words."""
+        self.commit()
+        conn = self._connection.get()
+        current = {word.input_form for word in words}
+        removed = [word for word, in conn.execute('SELECT word FROM {} WHERE deck=?'.format(self.table_name),
+                                                  (self.deck,)).fetchall() if word not in current]
+        for chunk in grouper(500, removed):
+            chunk = list(chunk)
+            conn.execute('DELETE FROM {} WHERE deck=? AND word IN ({})'.format(self.table_name,
+                                                                               ','.join('?' * len(chunk))),
+                         [self.deck] + chunk)
+        conn.commit()
+        if len(removed) > 0:
+            log(self, 'Forgot {} words that are no longer in deck {}'.format(len(removed), self.deck))
@@ -0,0 +1,104 @@
+import hashlib
+import json
+from enum import Enum
+from typing import Dict, Any, List, Tuple
+
+from cardbuilder.common.util import ThreadLocalConnection
+from cardbuilder.input.word import Word
+from cardbuilder.lookup.data_source import DataSource
+from cardbuilder.resolution.card_data import CardData
+from cardbuilder.resolution.field import Field
+
+
+def describe_configuration(obj: Any) -> Any:
+    """Turns fields, printers and their settings into plain JSON-compatible data, leaving out anything that doesn't
+    affect what gets printed, so that two configurations describe the same way when they produce the same cards."""
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    elif isinstance(obj, Enum):
+        return obj.value
+    elif isinstance(obj, (list, tuple)):
+        return [describe_configuration(x) for x in obj]
+    elif isinstance(obj, dict):
+        return {str(describe_configuration(key)): describe_configuration(val) for key, val in obj.items()}
+    elif isinstance(obj, DataSource):
+        return type(obj).__name__
+    elif isinstance(obj, Field):
+        return {
+            'target_field_name': obj.target_field_name,
+            'source_field_name': obj.source_field_name.value,
+            'data_sources': [type(data_source).__name__ for data_source in obj.data_sources],
+            'required': obj.required,
+            'printer': describe_configuration(obj.printer)
+        }
+    elif hasattr(obj, '__qualname__'):  # classes and functions, like sort keys
+        return obj.__qualname__
+    else:
+        # private attributes are things like connections and executors, which don't change the output
+        attributes = {key: describe_configuration(val) for key, val in sorted(vars(obj).items())
+                      if not key.startswith('_')} if hasattr(obj, '__dict__') else {}
+        return {'type': type(obj).__name__, 'attributes': attributes}
+
+
+def hash_configuration(obj: Any) -> str:
+    return hashlib.sha256(json.dumps(describe_configuration(obj), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResolutionJournal:
+    """Records every card as soon as it's resolved, so that a run that stops partway through can be resumed without
+    resolving the same words again. Entries are kept per run, and only entries made with the same field configuration
+    are used when resuming."""
+
+    table_name = 'resolution_journal'
+    # entries are written this many at a time, so a crash loses at most this many resolved cards; they're held in
+    # memory until then rather than in an open transaction, which would lock data sources out of the database
+    commit_interval = 50
+
+    def __init__(self, run_id: str, configuration: Any):
+        self.run_id = run_id
+        self.configuration_hash = hash_configuration(configuration)
+        self._connection = ThreadLocalConnection()
+        self._pending: List[Tuple[str, str, str, str, str]] = []
+
+        conn = self._connection.get()
+        conn.execute('''CREATE TABLE IF NOT EXISTS {} (
+            run_id TEXT,
+            configuration_hash TEXT,
+            word TEXT,
+            fingerprint TEXT,
+            fields TEXT,
+            PRIMARY KEY (run_id, word)
+        );'''.format(self.table_name))
+        if 'fingerprint' not in {row[1] for row in conn.execute('PRAGMA table_info({})'.format(self.table_name))}:
+            conn.execute('ALTER TABLE {} ADD COLUMN fingerprint TEXT'.format(self.table_name))
+        conn.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def load(self) -> Dict[str, CardData]:
+        """Returns the cards recorded for this run with the current configuration, by input form."""
+        cursor = self._connection.get().execute('SELECT word, fingerprint, fields FROM {} '
+                                                'WHERE run_id=? AND configuration_hash=?'.format(self.table_name),
+                                                (self.run_id, self.configuration_hash))
+        return {word: CardData.from_json(fields, fingerprint) for word, fingerprint, fields in cursor}
+
+    def record(self, word: Word, card: CardData):
+        self._pending.append((self.run_id, self.configuration_hash, word.input_form, card.fingerprint,
+                              card.to_json()))
+        if len(self._pending) >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        conn = self._connection.get()
+        conn.executemany('INSERT OR REPLACE INTO {} (run_id, configuration_hash, word, fingerprint, fields) '
+                         'VALUES (?, ?, ?, ?, ?)'.format(self.table_name), self._pending)
+        conn.commit()
+        self._pending = []
+
+    def clear(self):
+        self._pending = []
+        conn = self._connection.get()
+        conn.execute('DELETE FROM {} WHERE run_id=?'.format(self.table_name), (self.run_id,))
+        conn.commit()
@@ -1,13 +1,17 @@
-import sqlite3
+import re
+import threading
+from logging import WARNING
 from abc import ABC, abstractmethod
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
 from os import mkdir
 from os.path import exists, join
-from typing import Optional, Callable, get_type_hints, Dict
+from typing import Optional, Callable, get_type_hints, Dict, List
 
-import requests
+from requests.exceptions import RequestException
 
-from cardbuilder.common.util import dedup_by, retry_with_logging, InDataDir, DATABASE_NAME
+from cardbuilder.common.media_store import MediaStore
+from cardbuilder.common.util import dedup_by, retry_with_logging, http_get, log
 from cardbuilder.exceptions import CardBuilderUsageException
 from cardbuilder.lookup.value import SingleValue, ListValue, MultiListValue, MultiValue, Value, PitchAccentValue
 
@@ -20,6 +24,17 @@ class Printer(ABC):
     def get_input_type(self) -> type:
         return next(val for key, val in get_type_hints(self.__call__).items() if key != 'return')
 
+    def flush(self):
+        """Waits for any work the printer has left running in the background, such as downloads. Resolvers call this
+        before writing output."""
+        pass
+
+    def restore(self, printed: str) -> bool:
+        """Redoes any side effects of having printed printed, such as putting a downloaded file in place, for cards
+        that are reused from an earlier run. Returns False if that isn't possible, in which case the card has to be
+        resolved again."""
+        return True
+
 
 class WrappingPrinter(Printer, ABC):
     def __init__(self, printer: Printer):
@@ -28,6 +43,12 @@ class WrappingPrinter(Printer, ABC):
     def get_input_type(self) -> type:
         return self._printer.get_input_type()
 
+    def flush(self):
+        self._printer.flush()
+
+    def restore(self, printed: str) -> bool:
+        return self._printer.restore(printed)
+
 
 class SingleValuePrinter(Printer):
     """The printer class for single values, like a word, part of speech, or single sentence definition."""
@@ -192,6 +213,13 @@ class CasePrinter(Printer):
     def __init__(self, printers_by_type: Dict[type, Printer]):
         self.printers_by_type = printers_by_type
 
+    def flush(self):
+        for printer in self.printers_by_type.values():
+            printer.flush()
+
+    def restore(self, printed: str) -> bool:
+        return all(printer.restore(printed) for printer in self.printers_by_type.values())
+
     def __call__(self, value: Value) -> str:
         if type(value) in self.printers_by_type:
             return self.printers_by_type[type(value)](value)
@@ -213,20 +241,40 @@ class FirstValuePrinter(CasePrinter):
 
 
 class DownloadPrinter(Printer):
-    def __init__(self, output_directory: str, format_string='{directory}/{filename}'):
+
+    # limits for the store of downloaded files, which can be overridden with the config keys
+    # DownloadPrinter_cache_max_age and DownloadPrinter_cache_max_bytes
+    cache_max_age: Optional[float] = None
+    cache_max_bytes: Optional[int] = 1024 * 1024 * 1024
+
+    download_tries = 3
+
+    def __init__(self, output_directory: str, format_string='{directory}/{filename}', download_workers: int = 4):
+        """
+
+        Args:
+            output_directory: the directory to put downloaded files in.
+            format_string: how to print a downloaded file, given its directory and filename.
+            download_workers: how many files to download at once. Files are downloaded in the background, so printing
+                doesn't wait for them; they're only guaranteed to be in the output directory after flush().
+        """
         self.output_directory = output_directory
         self.format_string = format_string
-        with InDataDir():
-            self.conn = sqlite3.connect(DATABASE_NAME)
-
-        self.conn.execute('''CREATE TABLE IF NOT EXISTS download_cache (
-            url TEXT PRIMARY KEY,
-            content BLOB);''')
-        self.conn.commit()
+        self._media_store = MediaStore(DownloadPrinter.__name__, self.cache_max_age, self.cache_max_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix='cardbuilder-download')
+        self._downloads: Dict[str, Future] = {}
+        self._downloads_lock = threading.Lock()
+        self.failed_downloads: List[str] = []
 
         if not exists(self.output_directory):
             mkdir(self.output_directory)
 
+    def __del__(self):
+        if hasattr(self, '_executor'):
+            self._executor.shutdown(wait=False)
+        if hasattr(self, '_media_store'):
+            self._media_store.close()
+
     def __call__(self, value: Value) -> str:
         if isinstance(value, SingleValue):
             url = value.get_data()
@@ -240,23 +288,56 @@ class DownloadPrinter(Printer):
 
         filename = url.split('/')[-1]
 
-        data = self._get_cached_data(url)
-        if data is None:
-            r = retry_with_logging(requests.get, tries=2, delay=1, fargs=[url])
-            data = r.content
-            self._cache_data(url, data)
-
-        with open(join(self.output_directory, filename), 'wb') as f:
-            f.write(data)
+        # the same url always goes to the same file, so each one only needs to be fetched once
+        with self._downloads_lock:
+            if url not in self._downloads:
+                self._downloads[url] = self._executor.submit(self._fetch, url, join(self.output_directory, filename))
 
         return self.format_string.format(directory=self.output_directory, filename=filename)
 
-    def _get_cached_data(self, url: str) -> Optional[bytes]:
-        cursor = self.conn.execute('SELECT content FROM download_cache WHERE url=?', (url,))
-        result = cursor.fetchone()
-        return result[0] if result else None
-
-    def _cache_data(self, url: str, data: bytes):
-        self.conn.execute('INSERT OR REPLACE INTO download_cache VALUES (?, ?)', (url, data))
-        self.conn.commit()
-
+    def flush(self):
+        """Waits for the downloads started so far. A download that fails is logged and recorded in failed_downloads
+        rather than raised, so one bad URL doesn't cost the rest of the deck; its file is just missing from the output
+        directory."""
+        with self._downloads_lock:
+            downloads = self._downloads
+            self._downloads = {}
+
+        for url, download in downloads.items():
+            try:
+                download.result()
+            except (RequestException, OSError) as ex:
+                log(self, 'Failed to download {}: {}'.format(url, ex), level=WARNING)
+                self.failed_downloads.append(url)
+
+    def restore(self, printed: str) -> bool:
+        # printed values that didn't come from this printer, like blanks, don't match and have nothing to restore
+        match = re.fullmatch(re.escape(self.format_string).replace(r'\{directory\}', re.escape(self.output_directory))
+                             .replace(r'\{filename\}', '(?P<filename>[^/]+)'), printed)
+        if match is None:
+            return True
+
+        destination = join(self.output_directory, match.group('filename'))
+        if exists(destination):
+            return True
+
+        stored_path = self._media_store.get_for_destination(destination)
+        if stored_path is None:
+            return False
+
+        self._media_store.materialize(stored_path, destination)
+        return True
+
+    def _fetch(self, url: str, destination: str):
+        stored_path = self._media_store.get(url)
+        if stored_path is None:
+            data = retry_with_logging(self._download, tries=self.download_tries, delay=1, fargs=[url])
+            stored_path = self._media_store.put(url, data)
+
+        self._media_store.materialize(stored_path, destination, url)
+
+    @staticmethod
+    def _download(url: str) -> bytes:
+        response = http_get(url)
+        response.raise_for_status()  # so error pages don't get stored as media
+        return response.content
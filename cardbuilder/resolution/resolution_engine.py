@@ -1,24 +1,63 @@
-from typing import Union, List, Iterable, Callable, Dict
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Union, List, Iterable, Callable, Dict, Deque, Tuple, Optional
 
-from cardbuilder.common.util import loading_bar
-from cardbuilder.exceptions import CardResolutionException, WordLookupException, CardBuilderUsageException
+from cardbuilder.common.util import loading_bar, grouper
+from cardbuilder.exceptions import CardResolutionException, WordLookupException, CardBuilderUsageException, \
+    ApiLimitException
 from cardbuilder.input.word import Word
 from cardbuilder.input.word_list import WordList
 from cardbuilder.lookup.data_source import DataSource
 from cardbuilder.lookup.lookup_data import LookupData
 from cardbuilder.resolution.card_data import CardData
 from cardbuilder.resolution.field import Field
+from cardbuilder.resolution.fingerprints import DeckFingerprints
 
 
 class ResolutionEngine:
 
+    # how many words each worker can have queued up ahead of the card currently being yielded
+    words_in_flight_per_worker = 4
+
+    # stored content is loaded from every data source in bulk for this many words at a time, ahead of resolving them
+    prefetch_size = 1000
+
     def __init__(self, fields: List[Field],
-                 mutator: Callable[[Dict[DataSource, LookupData]], Dict[DataSource, LookupData]] = None):
+                 mutator: Callable[[Dict[DataSource, LookupData]], Dict[DataSource, LookupData]] = None,
+                 workers: int = 1, concurrent_sources: bool = False, async_concurrency: Optional[int] = None):
+        """
+
+        Args:
+            fields: the fields to resolve for every word.
+            mutator: an optional function that can modify lookup data before it is resolved to fields.
+            workers: the number of words to resolve concurrently. Cards are always produced in input order.
+            concurrent_sources: whether to query all data sources for a word at the same time instead of one after
+                another, so lookup time for a word is that of the slowest source rather than the sum of all of them.
+            async_concurrency: if set, words are resolved on an asyncio event loop through lookup_word_async, with at
+                most this many words in flight at once. Data sources and printers that are only synchronous run on a
+                thread pool of the same size, and that includes every web data source in cardbuilder for now, since
+                they make blocking requests; for them this is as concurrent as that many workers, not more. Can't be
+                combined with multiple workers.
+        """
         self.mutator = self.default_mutator if mutator is None else mutator
         self.fields = fields
         if len(set(x.target_field_name for x in self.fields)) != len(self.fields):
             raise CardBuilderUsageException('Duplicate target field name in fields list')
 
+        if workers < 1:
+            raise CardBuilderUsageException('ResolutionEngine needs at least one worker')
+        self.workers = workers
+        self.concurrent_sources = concurrent_sources
+
+        if async_concurrency is not None:
+            if async_concurrency < 1:
+                raise CardBuilderUsageException('ResolutionEngine async concurrency must be at least one')
+            if workers > 1:
+                raise CardBuilderUsageException('ResolutionEngine can use either multiple workers or asyncio, not both')
+        self.async_concurrency = async_concurrency
+        self._source_executor: Optional[ThreadPoolExecutor] = None
+
         self.datasource_by_name = {}
         for field in fields:
             for data_source in field.data_sources:
@@ -31,30 +70,190 @@ class ResolutionEngine:
                     self.datasource_by_name[name] = data_source
 
         self.failed_resolutions = []
+        # when set, cards built before from exactly the same data are reused instead of being resolved again
+        self.fingerprints: Optional[DeckFingerprints] = None
 
     @staticmethod
     def default_mutator(data_by_source: Dict[DataSource, LookupData]) -> Dict[DataSource, LookupData]:
         return data_by_source
 
     def cards(self, words: Union[List[str], WordList]) -> Iterable[CardData]:
+        for _, card in self.resolved_words(words):
+            if card is not None:
+                yield card
+
+    def resolved_words(self, words: Union[List[str], WordList]) -> Iterable[Tuple[Word, Optional[CardData]]]:
+        """Like cards(), but yields every word in order alongside its card, which is None if the word failed to
+        resolve."""
         self.failed_resolutions = []
-        for word in loading_bar(words, 'populating cards'):
+        if self.concurrent_sources and len(self.datasource_by_name) > 1:
+            self._source_executor = ThreadPoolExecutor(max_workers=self.workers * len(self.datasource_by_name),
+                                                       thread_name_prefix='cardbuilder-lookup')
+        try:
+            yield from self._resolve_cards(words)
+        finally:
+            if self._source_executor is not None:
+                self._source_executor.shutdown()
+                self._source_executor = None
+
+    def _resolve_cards(self, words: Union[List[str], WordList]) -> Iterable[Tuple[Word, Optional[CardData]]]:
+        if self.async_concurrency is not None:
+            yield from self._cards_async(words)
+        elif self.workers == 1:
+            for word in loading_bar(self._prefetching(words), 'populating cards', len(words)):
+                try:
+                    yield word, self._resolve_fieldlist(word)
+                except CardResolutionException as ex:
+                    self.failed_resolutions.append((word, ex))
+                    yield word, None
+        else:
+            yield from self._cards_concurrently(words)
+
+    def _prefetching(self, words: Union[List[str], WordList]) -> Iterable[Word]:
+        # a few words from the previous chunk may still be waiting on a worker when the next chunk is prefetched; they
+        # just fall back to querying one form at a time
+        for chunk in grouper(self.prefetch_size, words):
+            chunk = list(chunk)
+            forms = [form for word in chunk for form in word]
+            for datasource in self.datasource_by_name.values():
+                datasource.prefetch(forms)
+            yield from chunk
+
+    def _cards_concurrently(self, words: Union[List[str], WordList]) -> Iterable[Tuple[Word, Optional[CardData]]]:
+        # only a bounded window of words is submitted at a time, so a huge word list doesn't turn into a huge list of
+        # finished cards waiting behind one slow lookup
+        max_in_flight = self.workers * self.words_in_flight_per_worker
+        pending: Deque[Tuple[Word, Future]] = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cardbuilder-resolution') as executor:
+            for word in loading_bar(self._prefetching(words), 'populating cards', len(words)):
+                pending.append((word, executor.submit(self._resolve_fieldlist, word)))
+                if len(pending) >= max_in_flight:
+                    yield from self._collect_result(*pending.popleft())
+
+            while pending:
+                yield from self._collect_result(*pending.popleft())
+
+    def _collect_result(self, word: Word, future: Future) -> Iterable[Tuple[Word, Optional[CardData]]]:
+        try:
+            yield word, future.result()
+        except CardResolutionException as ex:
+            self.failed_resolutions.append((word, ex))
+            yield word, None
+
+    def _cards_async(self, words: Union[List[str], WordList]) -> Iterable[Tuple[Word, Optional[CardData]]]:
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.async_concurrency, thread_name_prefix='cardbuilder-async')
+        loop.set_default_executor(executor)
+        limit = loop.run_until_complete(self._create_limit())
+
+        # like _cards_concurrently, only a bounded window of words is scheduled at once; the loop runs whenever we wait
+        # for the oldest card, so every other scheduled word makes progress in the meantime
+        max_in_flight = self.async_concurrency * self.words_in_flight_per_worker
+        pending: Deque[Tuple[Word, asyncio.Task]] = deque()
+        try:
+            for word in loading_bar(self._prefetching(words), 'populating cards', len(words)):
+                pending.append((word, loop.create_task(self._resolve_fieldlist_async(word, limit))))
+                if len(pending) >= max_in_flight:
+                    yield from self._collect_async_result(loop, *pending.popleft())
+
+            while pending:
+                yield from self._collect_async_result(loop, *pending.popleft())
+        finally:
+            if pending:
+                for _, task in pending:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*(task for _, task in pending), return_exceptions=True))
+            loop.close()
+            executor.shutdown()
+
+    async def _create_limit(self) -> asyncio.Semaphore:
+        # before python 3.10 semaphores bind to the current event loop when they're created
+        return asyncio.Semaphore(self.async_concurrency)
+
+    def _collect_async_result(self, loop: asyncio.AbstractEventLoop, word: Word,
+                              task: asyncio.Task) -> Iterable[Tuple[Word, Optional[CardData]]]:
+        try:
+            yield word, loop.run_until_complete(task)
+        except CardResolutionException as ex:
+            self.failed_resolutions.append((word, ex))
+            yield word, None
+
+    async def _resolve_fieldlist_async(self, word: Word, limit: asyncio.Semaphore) -> CardData:
+        async with limit:
+            datasources = list(self.datasource_by_name.values())
+            results = await asyncio.gather(*(self._lookup_in_source_async(datasource, word)
+                                             for datasource in datasources))
+
+            # printers can do blocking work like downloading audio, so fields are resolved off the event loop
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._build_card, word, datasources, results)
+
+    @staticmethod
+    async def _lookup_in_source_async(datasource: DataSource,
+                                      word: Word) -> Tuple[Optional[LookupData], Optional[WordLookupException]]:
+        first_failure = None
+        for form in word:
             try:
-                yield self._resolve_fieldlist(word)
-            except CardResolutionException as ex:
-                self.failed_resolutions.append((word, ex))
+                return await datasource.lookup_word_async(word, form), first_failure
+            except ApiLimitException as ex:
+                return None, ex
+            except WordLookupException as ex:
+                if first_failure is None:
+                    first_failure = ex
+
+        return None, first_failure
+
+    @staticmethod
+    def _lookup_in_source(datasource: DataSource,
+                          word: Word) -> Tuple[Optional[LookupData], Optional[WordLookupException]]:
+        first_failure = None
+        for form in word:
+            try:
+                return datasource.lookup_word(word, form), first_failure  # if we find something, we're done
+            except ApiLimitException as ex:
+                return None, ex  # the other forms can't be looked up either
+            except WordLookupException as ex:
+                if first_failure is None:  # record the first failure
+                    first_failure = ex
+
+        return None, first_failure
 
     def _resolve_fieldlist(self, word: Word) -> CardData:
+        datasources = list(self.datasource_by_name.values())
+        if self._source_executor is not None:
+            futures = [self._source_executor.submit(self._lookup_in_source, datasource, word)
+                       for datasource in datasources]
+            results = [future.result() for future in futures]
+        else:
+            results = [self._lookup_in_source(datasource, word) for datasource in datasources]
+
+        return self._build_card(word, datasources, results)
+
+    def restore_card(self, card: CardData) -> bool:
+        """Lets each field's printer restore anything its printed value depends on, like downloaded files, returning
+        whether all of them could."""
+        return all(field.printer.restore(resolved_field.value)
+                   for field, resolved_field in zip(self.fields, card.fields))
+
+    def _build_card(self, word: Word, datasources: List[DataSource],
+                    results: List[Tuple[Optional[LookupData], Optional[WordLookupException]]]) -> CardData:
+        fingerprint = None
+        # a card missing data only because an API limit was hit is neither reused nor remembered, so the next
+        # incremental build looks the word up again
+        limited = any(isinstance(failure, ApiLimitException) for _, failure in results)
+        if self.fingerprints is not None and not limited:
+            fingerprint = self.fingerprints.fingerprint(word, [data for data, _ in results])
+            previous_card = self.fingerprints.previous_card(word, fingerprint)
+            if previous_card is not None and self.restore_card(previous_card):
+                return previous_card
+
         data_by_source = {}
         failures_by_source = {}
-        for datasource in self.datasource_by_name.values():
-            for form in word:
-                try:
-                    data_by_source[datasource] = datasource.lookup_word(word, form)
-                    break  # if we find something, we're done
-                except WordLookupException as ex:
-                    if datasource not in failures_by_source:  # record the first failure
-                        failures_by_source[datasource] = ex
+        for datasource, (data, failure) in zip(datasources, results):
+            if data is not None:
+                data_by_source[datasource] = data
+            if failure is not None:
+                failures_by_source[datasource] = failure
 
         data_by_source = self.mutator(data_by_source)
         resolved_fields = []
@@ -69,4 +268,4 @@ class ResolutionEngine:
             else:
                 resolved_fields.append(resolved_field)
 
-        return CardData(resolved_fields)
+        return CardData(resolved_fields, fingerprint)
@@ -1,8 +1,8 @@
 import logging
-from abc import ABC, abstractmethod
-from typing import List, Union, Tuple, Dict, Callable
+from abc import ABC
+from typing import List, Union, Tuple, Dict, Callable, Optional
 
-from cardbuilder.common.util import log
+from cardbuilder.common.util import log, log_http_connection_stats
 from cardbuilder.exceptions import CardResolutionException, CardBuilderUsageException
 from cardbuilder.input.word import Word
 from cardbuilder.input.word_list import WordList
@@ -10,6 +10,8 @@ from cardbuilder.lookup.data_source import DataSource
 from cardbuilder.lookup.lookup_data import LookupData
 from cardbuilder.resolution.card_data import CardData
 from cardbuilder.resolution.field import Field
+from cardbuilder.resolution.fingerprints import DeckFingerprints
+from cardbuilder.resolution.journal import ResolutionJournal
 from cardbuilder.resolution.resolution_engine import ResolutionEngine
 
 
@@ -17,19 +19,96 @@ class Resolver(ABC):
     """The base class for all resolvers, responsible for taking lookup data and transforming it into an output format
     that can be used as flashcards. """
     def __init__(self, fields: List[Field],
-                 mutator: Callable[[Dict[DataSource, LookupData]], Dict[DataSource, LookupData]] = None):
-        self.engine = ResolutionEngine(fields, mutator)
+                 mutator: Callable[[Dict[DataSource, LookupData]], Dict[DataSource, LookupData]] = None,
+                 workers: int = 1, concurrent_sources: bool = False, async_concurrency: Optional[int] = None):
+        self.engine = ResolutionEngine(fields, mutator, workers, concurrent_sources, async_concurrency)
 
-    @abstractmethod
     def _output_file(self, rows: List[CardData], filename: str) -> str:
-        raise NotImplementedError('Resolver classes must define _output_file')
+        raise NotImplementedError('Resolver classes must define _output_file or the streaming output methods')
 
-    def resolve_to_file(self, words: Union[List[Word], WordList], name: str) -> List[Tuple[str, CardResolutionException]]:
+    # Output is written through _open_output, _append_output and _close_output as cards are resolved. By default the
+    # cards are collected and passed to _output_file at the end; resolvers that can write cards as they come should
+    # override these instead, so memory use doesn't grow with the size of the deck.
+
+    def _open_output(self, name: str):
+        self._output_name = name
+        self._output_rows = []
+
+    def _append_output(self, card: CardData):
+        self._output_rows.append(card)
+
+    def _close_output(self) -> str:
+        """Finishes the output and returns the name of the file written."""
+        rows = self._output_rows
+        self._output_rows = None
+        return self._output_file(rows, self._output_name)
+
+    def _abort_output(self):
+        """Called instead of _close_output when resolution fails partway through."""
+        self._output_rows = None
+
+    def resolve_to_file(self, words: Union[List[Word], WordList], name: str,
+                        resume: bool = False, incremental: bool = True) -> List[Tuple[str, CardResolutionException]]:
+        """Resolves cards for words and writes them to an output file called name. Resolved cards are journaled as
+        they're produced; with resume, cards journaled by an earlier run with the same name and fields that didn't
+        finish are reused instead of being resolved again.
+
+        With incremental, the cards built for a deck called name are remembered along with a fingerprint of the data
+        they were built from, and cards for words whose data and fields haven't changed since are reused on the next
+        build. Words are still looked up every time, but reused cards skip resolving and printing their fields. Without
+        it every card is built again, and remembered for the next incremental build."""
         if len(words) == 0:
             raise CardBuilderUsageException('Cannot resolve an empty wordlist')
-        cards = list(self.engine.cards(words))
-        final_out_name = self._output_file(cards, name)
+
+        configuration = [self.engine.fields, self.engine.mutator]
+        journal = ResolutionJournal(name, configuration)
+        fingerprints = DeckFingerprints(name, configuration, reuse_cards=incremental)
+        if resume:
+            journaled_cards = {word: card for word, card in journal.load().items() if self.engine.restore_card(card)}
+            log(self, 'Resuming with {} cards that were already resolved'.format(len(journaled_cards)))
+        else:
+            journal.clear()
+            journaled_cards = {}
+
+        remaining_words = [word for word in words if word.input_form not in journaled_cards]
+        self.engine.fingerprints = fingerprints
+        results = iter(self.engine.resolved_words(remaining_words))
+
+        self._open_output(name)
+        try:
+            for word in words:
+                if word.input_form in journaled_cards:
+                    card = journaled_cards[word.input_form]
+                    fingerprints.record(word, card)
+                    self._append_output(card)
+                    continue
+
+                resolved_word, card = next(results)
+                if card is not None:
+                    journal.record(resolved_word, card)
+                    fingerprints.record(resolved_word, card)
+                    self._append_output(card)
+            next(results, None)  # lets the engine clean up
+
+            for field in self.engine.fields:
+                field.printer.flush()  # files like audio have to be downloaded before they can be packaged
+            journal.commit()
+        except BaseException:
+            journal.close()
+            # reused cards are checked with their printers first, so what was recorded is worth keeping
+            fingerprints.close()
+            self._abort_output()
+            raise
+        finally:
+            self.engine.fingerprints = None
+        final_out_name = self._close_output()
+        journal.clear()
+        journal.close()
+        fingerprints.prune(words)
+        fingerprints.close()
+
         log(self, 'Resolved card data written to file {}'.format(final_out_name))
+        log_http_connection_stats()
         failed_resolutions = self.engine.failed_resolutions
         if len(failed_resolutions) > 0:
             log(self, 'Failed to resolve {} cards'.format(len(failed_resolutions)), level=logging.WARNING)
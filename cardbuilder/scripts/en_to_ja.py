@@ -14,7 +14,7 @@ from cardbuilder.resolution.instantiable import instantiable_resolvers
 from cardbuilder.resolution.printer import ListValuePrinter, MultiListValuePrinter, TatoebaPrinter, \
     DownloadPrinter, FirstValuePrinter
 from cardbuilder.scripts.helpers import build_parser_with_common_args, get_args_and_input_from_parser, \
-    log_failed_resolutions, anki_card_html, anki_css
+    log_failed_resolutions, anki_card_html, anki_css, add_index_workers_argument
 from cardbuilder.scripts.router import command
 
 
@@ -30,6 +30,10 @@ def main():
     --output_format     (任意）出力するデータ形式。CSVやAnkiなど色々あるが、デフォルトではAnkiになる
     --start     (任意) 入力から処理する最初の単語を定義する整数（5なら5語目以上のみ処理される）
     --stop      (任意) 入力から処理する最後の単語を定義する整数（5なら5語目以下のみ処理される）
+    --workers   (任意) 並行して処理する単語の数。デフォルトは1
+    --resume    (任意) 同じ--outputで中断した実行を再開し、既に作成したカードを再利用する
+    --rebuild   (任意) 同じ--outputの前回の作成から変更のないカードを再利用せず、全てのカードを作り直す
+    --index_workers     (任意）初回の例文インデックス作成に使うプロセス数。デフォルトはCPUコア数（最大4）
     --eijiro_location     (任意）英辞郎のテキストファイルの位置（提供すると英辞郎の定義分が使われる）
     --learner_key     (任意）Merriam-Webster Learner's DictionaryのAPIキー（廃止予定)
     --thesaurus_key     (任意）Merriam-Webster Collegiate ThesaurusのAPIキー（廃止予定)
@@ -46,6 +50,7 @@ def main():
                                                 "Thesaurus api key")
     parser.add_argument('--eijiro_location', help="The location of a dictionary containing the Eijiro data. If present,"
                                                   "Eijiro will be used instead of EJDictHand")
+    add_index_workers_argument(parser)
 
     args, input_words = get_args_and_input_from_parser(parser, Language.ENGLISH)
     try:
@@ -71,7 +76,8 @@ def main():
             log(None, 'Eijiro location not provided and no previously loaded content found: falling back to EJDictHand')
             jp_def_printer = ListValuePrinter(number_format_string='{number} .', join_string='\n')
 
-    tatoeba = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE)
+    # lemmatizing English sentences is slow, so the first run indexes them in several processes
+    tatoeba = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, workers=args.index_workers)
     wf = WordFrequency()
 
     def word_freq_sort_key(value: SingleValue) -> int:
@@ -111,7 +117,7 @@ def main():
         Field(tatoeba, Fieldname.EXAMPLE_SENTENCES, '例文', printer=tatoeba_printer)
     ]
 
-    resolver = instantiable_resolvers[args.output_format](fields)
+    resolver = instantiable_resolvers[args.output_format](fields, workers=args.workers)
     if args.output_format == 'anki':
         resolver.set_note_data(args.output,
                                [{'name': '英語->日本語', 'qfmt': anki_card_html('en_to_ja', 'word_card_front'),
@@ -119,7 +125,8 @@ def main():
                                 {'name': '日本語->英語', 'qfmt': anki_card_html('en_to_ja', 'def_card_front'),
                                  'afmt': anki_card_html('en_to_ja', 'def_card_back')}], css=anki_css())
 
-    failed_resolutions = resolver.resolve_to_file(input_words, args.output)
+    failed_resolutions = resolver.resolve_to_file(input_words, args.output, resume=args.resume,
+                                                  incremental=not args.rebuild)
     log_failed_resolutions(failed_resolutions)
 
     if args.output_format == 'csv':
@@ -19,6 +19,9 @@ def main():
     --output_format     (Optional) The type of data to output, such as CSV file or Anki. Defaults to Anki
     --start     (Optional) an integer specifying the beginning of the range of input words to generate cards for
     --stop      (Optional) an integer specifying the end of the range of input words to generate cards for
+    --workers   (Optional) the number of words to look up concurrently. Defaults to 1
+    --resume    (Optional) continue an unfinished run with the same --output, reusing the cards it already resolved
+    --rebuild   (Optional) resolve every card again instead of reusing unchanged cards from the last build of --output
 
     Used like ``cardbuilder eo_to_en --input words.txt --output cards``.
     """
@@ -34,7 +37,7 @@ def main():
         Field(dictionary, Fieldname.PART_OF_SPEECH, 'Part of Speech'),
     ]
 
-    resolver = instantiable_resolvers[args.output_format](fields)
+    resolver = instantiable_resolvers[args.output_format](fields, workers=args.workers)
 
     if args.output_format == 'anki':
         resolver.set_note_data(args.output, [
@@ -43,7 +46,8 @@ def main():
             {'name': 'English->Esperanto', 'qfmt': anki_card_html('eo_to_en', 'def_card_front'),
              'afmt': anki_card_html('eo_to_en', 'def_card_back')}], css=anki_css())
 
-    failed_resolutions = resolver.resolve_to_file(input_words, args.output)
+    failed_resolutions = resolver.resolve_to_file(input_words, args.output, resume=args.resume,
+                                                  incremental=not args.rebuild)
     log_failed_resolutions(failed_resolutions)
 
 
@@ -24,10 +24,22 @@ def build_parser_with_common_args() -> ArgumentParser:
                         help='The format the cards will be resolved to', default='anki')
     parser.add_argument('--output', help='The name of the output deck or file. Defaults to cards_{time}', type=str,
                         default='cards_{}'.format(datetime.now().strftime('%d_%H_%M')))
+    parser.add_argument('--workers', help='The number of words to look up concurrently', type=int, default=1)
+    parser.add_argument('--resume', help='Continue an unfinished run with the same --output, reusing the cards it '
+                                         'already resolved', action='store_true')
+    parser.add_argument('--rebuild', help='Resolve every card again, instead of reusing cards from the last build of '
+                                          'the same --output whose words and data haven\'t changed',
+                        action='store_true')
     parser.format_usage()
     return parser
 
 
+def add_index_workers_argument(parser: ArgumentParser):
+    # each worker tokenizes with its own model, so the default stops at a few workers rather than one per core
+    parser.add_argument('--index_workers', help='The number of processes to index example sentences with, the first '
+                                                'time they\'re needed', type=int, default=min(os.cpu_count() or 1, 4))
+
+
 def get_args_and_input_from_parser(parser: ArgumentParser,
                                    input_language: Language) -> Tuple[Namespace, Union[WordList, List[str]]]:
     args = parser.parse_args()
@@ -9,7 +9,7 @@ from cardbuilder.resolution.instantiable import instantiable_resolvers
 from cardbuilder.resolution.printer import TatoebaPrinter, MultiListValuePrinter, ListValuePrinter, \
     PitchAccentPrinter, DownloadPrinter
 from cardbuilder.scripts.helpers import build_parser_with_common_args, get_args_and_input_from_parser, \
-    log_failed_resolutions, anki_css, anki_card_html
+    log_failed_resolutions, anki_css, anki_card_html, add_index_workers_argument
 from cardbuilder.scripts.router import command
 
 
@@ -25,17 +25,25 @@ def main():
     --output_format     (Optional) The type of data to output, such as CSV file or Anki. Defaults to Anki
     --start     (Optional) an integer specifying the beginning of the range of input words to generate cards for
     --stop      (Optional) an integer specifying the end of the range of input words to generate cards for
+    --workers   (Optional) the number of words to look up concurrently. Defaults to 1
+    --resume    (Optional) continue an unfinished run with the same --output, reusing the cards it already resolved
+    --rebuild   (Optional) resolve every card again instead of reusing unchanged cards from the last build of --output
+    --index_workers     (Optional) the number of processes to index example sentences with the first time they're
+                        needed. Defaults to the number of cores, up to 4
 
     This command relies on jisho.org to fetch definitions, and consequently requires internet.
 
     Used like ``cardbuilder ja_to_en --input words.txt --output cards``.
     """
     parser = build_parser_with_common_args()
+    add_index_workers_argument(parser)
     args, input_words = get_args_and_input_from_parser(parser, Language.JAPANESE)
 
     dictionary = Jisho()
     ojad = ScrapingOjad()
-    example_sentences = TatoebaExampleSentences(source_lang=Language.JAPANESE, target_lang=Language.ENGLISH)
+    # Japanese sentences are slow to tokenize, so the first run indexes them in several processes
+    example_sentences = TatoebaExampleSentences(source_lang=Language.JAPANESE, target_lang=Language.ENGLISH,
+                                                workers=args.index_workers)
 
     if args.output_format == 'anki':
         audio_printer = AnkiAudioDownloadPrinter()
@@ -55,7 +63,7 @@ def main():
         Field(example_sentences, Fieldname.EXAMPLE_SENTENCES, 'Example Sentences', printer=TatoebaPrinter())
     ]
 
-    resolver = instantiable_resolvers[args.output_format](fields)
+    resolver = instantiable_resolvers[args.output_format](fields, workers=args.workers)
     if args.output_format == 'anki':
         resolver.set_note_data(args.output, [
             {'name': 'Japanese->English', 'qfmt': anki_card_html('ja_to_en', 'word_card_front'),
@@ -63,7 +71,8 @@ def main():
             {'name': 'English->Japanese', 'qfmt': anki_card_html('ja_to_en', 'def_card_front'),
              'afmt': anki_card_html('ja_to_en', 'def_card_back')}], css=anki_css())
 
-    failed_resolutions = resolver.resolve_to_file(input_words, args.output)
+    failed_resolutions = resolver.resolve_to_file(input_words, args.output, resume=args.resume,
+                                                  incremental=not args.rebuild)
     log_failed_resolutions(failed_resolutions)
 
 
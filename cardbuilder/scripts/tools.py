@@ -1,9 +1,21 @@
 import glob
+import inspect
 import os
+import shutil
+import stat
 import sys
+from argparse import ArgumentParser
+from typing import List, Type
 
+from cardbuilder.common import Language
 from cardbuilder.common.config import Config
-from cardbuilder.common.util import DATABASE_NAME, InDataDir, log
+from cardbuilder.common.media_store import MediaStore
+from cardbuilder.common.util import DATABASE_NAME, InDataDir, log, SOURCE_DATABASE_DIRECTORY
+from cardbuilder.exceptions import CardBuilderUsageException
+from cardbuilder.lookup.data_source import AggregatingDataSource, DataSource, WebApiDataSource, \
+    ExternalDataDataSource
+from cardbuilder.lookup.database_artifacts import build_database_artifact, import_database_artifact
+from cardbuilder.lookup.instantiable import instantiable_data_sources
 from cardbuilder.scripts.router import command, commands
 
 
@@ -24,6 +36,24 @@ def _confirm_intent(action: str):
             sys.stdout.write("Please respond with 'yes' or 'no' (or 'y' or 'n').\n")
 
 
+def _remove_read_only(func, path, _):
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    func(path)
+
+
+def _data_source_type(source_name: str, choices: List[str], kind: str = 'data source') -> Type[DataSource]:
+    if source_name not in choices:
+        raise CardBuilderUsageException('Unknown {} {}; choose one of {}'.format(kind, source_name, ', '.join(choices)))
+    return instantiable_data_sources[source_name]
+
+
+def _database_owners(data_source_type: Type[DataSource]) -> List[Type[DataSource]]:
+    """Returns the data sources whose databases hold data_source_type's content."""
+    if issubclass(data_source_type, AggregatingDataSource):
+        return list(data_source_type.aggregated_sources)
+    return [data_source_type]
+
+
 @command('set_conf')
 def set_conf() -> None:
     """
@@ -54,14 +84,55 @@ def view_conf() -> None:
 @command('purge_db')
 def purge_database() -> None:
     """
-    Deletes Cardbuilder's local database, clearing the config and any cached content.
+    Deletes Cardbuilder's local databases, clearing the config and any cached content, including downloaded media files.
+    Optionally takes the name of a single data source, to delete only that data source's database.
 
-    Used like ``cardbuilder purge_db``
+    Used like ``cardbuilder purge_db`` or ``cardbuilder purge_db <data source>``
     """
-    _confirm_intent('purge cardbuilder\'s entire local database')
+    source_name = sys.argv[1] if len(sys.argv) > 1 else None
+    if source_name is None:
+        _confirm_intent('purge cardbuilder\'s entire local database')
+        paths = [InDataDir.directory / DATABASE_NAME] + \
+            list((InDataDir.directory / SOURCE_DATABASE_DIRECTORY).glob('*.db'))
+    else:
+        paths = [InDataDir.directory / owner.database_name() for owner
+                 in _database_owners(_data_source_type(source_name, list(instantiable_data_sources)))]
+        paths = [path for path in paths if path.exists()]
+        if len(paths) == 0:
+            log(None, 'No database found for {}'.format(source_name))
+            return
+        _confirm_intent('purge the database{} for {}'.format('s' if len(paths) > 1 else '', source_name))
+
+    for path in paths:
+        for file in (str(path), str(path) + '-wal', str(path) + '-shm'):  # write-ahead logging leaves the last two
+            if os.path.exists(file):
+                os.remove(file)
+
+    # the media store's index is in the shared database, so without it the stored files would never be found or removed
+    media_directory = InDataDir.directory / MediaStore.directory_name
+    if source_name is None and media_directory.exists():
+        shutil.rmtree(str(media_directory), onerror=_remove_read_only)  # stored media files are read-only
+
+
+@command('purge_misses')
+def purge_negative_cache() -> None:
+    """
+    Clears the record of words that web data sources found no results for, so they're looked up online again next
+    time instead of waiting for the record to expire. Optionally takes the name of a single data source to clear.
 
-    with InDataDir():
-        os.remove(DATABASE_NAME)
+    Used like ``cardbuilder purge_misses`` or ``cardbuilder purge_misses <data source>``
+    """
+    source_name = sys.argv[1] if len(sys.argv) > 1 else None
+    if source_name is None:
+        purged = WebApiDataSource.purge_negative_cache()
+    else:
+        # only web data sources remember misses
+        web_sources = [name for name, data_source in instantiable_data_sources.items()
+                       if any(issubclass(owner, WebApiDataSource) for owner in _database_owners(data_source))]
+        purged = sum(WebApiDataSource.purge_negative_cache(owner.__name__) for owner
+                     in _database_owners(_data_source_type(source_name, web_sources, 'web data source'))
+                     if issubclass(owner, WebApiDataSource))
+    log(None, 'Cleared {} cached misses{}'.format(purged, '' if source_name is None else ' for ' + source_name))
 
 
 @command('purge_conf')
@@ -87,7 +158,61 @@ def purge_all_data() -> None:
     _confirm_intent('purge cardbuilder\'s database and all downloaded data')
     with InDataDir():
         for file in glob.glob('*'):
-            os.remove(file)
+            if os.path.isdir(file):
+                shutil.rmtree(file, onerror=_remove_read_only)  # stored media files are read-only
+            else:
+                os.remove(file)
+
+
+@command('build_db')
+def build_database() -> None:
+    """
+    Loads a data source's downloaded data into its database, then writes a copy of the database that other machines can
+    install with import_db instead of loading the data themselves. A checksum file is written next to it.
+
+    Arguments:
+    source      a data source that loads downloaded data, like eijiro or tatoeba
+    --output    (Optional) the file to write, by default <source>.db in the current directory
+    --eijiro_location     (Optional) the location of the Eijiro text file, for eijiro
+    --source_lang, --target_lang     (Optional) the languages to load, for tatoeba
+
+    Used like ``cardbuilder build_db ejdict-hand`` or
+    ``cardbuilder build_db tatoeba --source_lang jpn --target_lang eng``
+    """
+    parser = ArgumentParser()
+    parser.add_argument('source', choices=[name for name, data_source in instantiable_data_sources.items()
+                                           if issubclass(data_source, ExternalDataDataSource)])
+    parser.add_argument('--output', type=str)
+    parser.add_argument('--eijiro_location', type=str)
+    parser.add_argument('--source_lang', type=str)
+    parser.add_argument('--target_lang', type=str)
+    args = parser.parse_args()
+
+    data_source_type = instantiable_data_sources[args.source]
+    kwargs = {}
+    for name, parameter in inspect.signature(data_source_type.__init__).parameters.items():
+        value = getattr(args, name, None)
+        if value is not None:
+            kwargs[name] = Language(value) if parameter.annotation is Language else value
+        elif name != 'self' and parameter.default is inspect.Parameter.empty:
+            raise CardBuilderUsageException('{} needs --{}'.format(args.source, name))
+
+    output = args.output if args.output is not None else '{}.db'.format(args.source)
+    build_database_artifact(data_source_type(**kwargs), output)
+
+
+@command('import_db')
+def import_database() -> None:
+    """
+    Installs a data source database written by build_db, after checking it against its checksum file, replacing any
+    database the data source already had.
+
+    Used like ``cardbuilder import_db <file>``
+    """
+    if len(sys.argv) < 2:
+        print('Please pass in the database file to import, like "import_db eijiro.db"')
+    else:
+        import_database_artifact(sys.argv[1])
 
 
 @command('help')
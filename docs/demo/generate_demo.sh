@@ -19,7 +19,7 @@ eval "$(conda shell.bash hook)"
 conda activate demo
 pip install asciinema cardbuilder
 echo "Dropping Jisho table for demo"
-sqlite3 ~/.local/share/cardbuilder/cardbuilder.db "drop table jisho;"
+yes | cardbuilder purge_db jisho
 
 asciinema rec demo --command ./demo.sh
 GIFSICLE_OPTS="-k 10 --conserve_memory -O2 -Okeep-empty"
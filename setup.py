@@ -26,7 +26,7 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     include_package_data=True,
     package_data={'': ['resources/*', 'resources/*/*', 'resources/*/*/*']},
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[
         "requests ~= 2.25.1",
         "lxml ~= 4.6.2",
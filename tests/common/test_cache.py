@@ -0,0 +1,50 @@
+import sqlite3
+import time
+
+from cardbuilder.common.cache import CacheLimits
+
+
+class TestCacheLimits:
+
+    def get_conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE test_cache (word TEXT PRIMARY KEY, content BLOB)')
+        conn.execute('INSERT INTO test_cache VALUES (?, ?)', ('old', b'x' * 10))
+        conn.commit()
+        return conn
+
+    def test_migration(self):
+        conn = self.get_conn()
+        limits = CacheLimits('TestCacheLimits', 'test_cache', 'word')
+        limits.migrate(conn)
+        limits.migrate(conn)
+
+        fetched_at, last_used, size = conn.execute('SELECT fetched_at, last_used, size FROM test_cache').fetchone()
+        assert(fetched_at is not None and last_used is not None)
+        assert(size == 10)
+
+    def test_size_eviction(self):
+        conn = self.get_conn()
+        limits = CacheLimits('TestCacheLimits', 'test_cache', 'word', max_bytes=35)
+        limits.check_interval = 4
+        limits.migrate(conn)
+
+        for word in ['a', 'b', 'c']:
+            limits.store(conn, word, b'x' * 10)
+            time.sleep(0.01)
+        limits.touch(conn, 'old')  # recently used, so it should outlive 'a' and 'b'
+        assert(conn.execute('SELECT COUNT(*) FROM test_cache').fetchone()[0] == 4)
+
+        limits.store(conn, 'd', b'x' * 10)  # fourth write, which checks the limits
+        remaining = {row[0] for row in conn.execute('SELECT word FROM test_cache')}
+        assert(remaining == {'old', 'c', 'd'})
+
+    def test_age_eviction(self):
+        conn = self.get_conn()
+        limits = CacheLimits('TestCacheLimits', 'test_cache', 'word', max_age=60)
+        limits.migrate(conn)
+        conn.execute('UPDATE test_cache SET fetched_at=?', (time.time() - 120,))
+        limits.store(conn, 'new', b'x')
+
+        assert(limits.enforce(conn) == 1)
+        assert([row[0] for row in conn.execute('SELECT word FROM test_cache')] == ['new'])
@@ -0,0 +1,67 @@
+import os
+import stat
+from os.path import join, samefile
+
+import pytest
+
+from cardbuilder.common.media_store import MediaStore
+from cardbuilder.common.util import ThreadLocalConnection
+
+
+@pytest.mark.usefixtures('data_directory')
+class TestMediaStore:
+
+    def test_store_and_materialize(self, tmp_path):
+        store = MediaStore(directory=tmp_path / 'media')
+        first_path = store.put('http://media.test/first.mp3', b'audio')
+        second_path = store.put('http://media.test/second.mp3', b'audio')
+
+        assert(first_path == second_path)
+        assert(store.get('http://media.test/first.mp3') == first_path)
+        assert(store.get('http://media.test/missing.mp3') is None)
+
+        output_directory = tmp_path / 'output'
+        output_directory.mkdir()
+        destination = join(str(output_directory), 'first.mp3')
+        store.materialize(first_path, destination)
+        store.materialize(first_path, destination)
+        with open(destination, 'rb') as f:
+            assert(f.read() == b'audio')
+        if store.link_files:
+            assert(samefile(first_path, destination))
+
+        store.close()
+
+    def test_get_for_destination(self, tmp_path):
+        store = MediaStore(directory=tmp_path / 'media')
+        # the same filename from two places, put in two output directories
+        for directory in ('first', 'second'):
+            url = 'http://media.test/{}/word.mp3'.format(directory)
+            (tmp_path / directory).mkdir()
+            store.materialize(store.put(url, directory.encode('utf-8')), str(tmp_path / directory / 'word.mp3'), url)
+
+        for directory in ('first', 'second'):
+            with open(store.get_for_destination(str(tmp_path / directory / 'word.mp3')), 'rb') as f:
+                assert(f.read() == directory.encode('utf-8'))
+        assert(store.get_for_destination(str(tmp_path / 'third' / 'word.mp3')) is None)
+
+        store.close()
+
+    def test_legacy_migration(self, tmp_path):
+        connection = ThreadLocalConnection()
+        conn = connection.get()
+        conn.execute('CREATE TABLE IF NOT EXISTS download_cache (url TEXT PRIMARY KEY, content BLOB)')
+        conn.execute('INSERT OR REPLACE INTO download_cache (url, content) VALUES (?, ?)',
+                     ('http://media.test/legacy.mp3', b'legacy audio'))
+        conn.commit()
+
+        store = MediaStore(directory=tmp_path / 'media')
+        path = store.get('http://media.test/legacy.mp3')
+        with open(path, 'rb') as f:
+            assert(f.read() == b'legacy audio')
+        assert(not os.stat(path).st_mode & stat.S_IWUSR)
+        assert(conn.execute('SELECT COUNT(*) FROM download_cache WHERE url=?',
+                            ('http://media.test/legacy.mp3',)).fetchone()[0] == 0)
+
+        store.close()
+        connection.close()
@@ -0,0 +1,202 @@
+import bz2
+import io
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cardbuilder.common.util import HttpSessions, http_get, RateLimiter, connect_to_database, pragmas_applied, \
+    INGEST_PRAGMAS, download_to_file_with_loading_bar, download_and_extract
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    content = b'cardbuilder'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.content)))
+        self.end_headers()
+        self.wfile.write(self.content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves files by path, with an ETag and support for resuming through range requests."""
+    protocol_version = 'HTTP/1.1'
+    files = {}
+    etag = '"v1"'
+    requested_ranges = []
+
+    def do_GET(self):
+        content = self.files[self.path]
+        requested_range = self.headers.get('Range')
+        self.requested_ranges.append(requested_range)
+        if requested_range is not None and self.headers.get('If-Range') == self.etag:
+            start = int(requested_range[len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(content) - 1, len(content)))
+            content = content[start:]
+        else:
+            self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def server_url():
+    yield from serve(StandInHandler)
+
+
+@pytest.fixture
+def file_server_url():
+    FileHandler.files = {}
+    FileHandler.requested_ranges = []
+    yield from serve(FileHandler)
+
+
+class TestHttpSessions:
+
+    def test_connection_reuse(self, server_url):
+        HttpSessions.close()
+        for i in range(5):
+            assert(http_get('{}/{}'.format(server_url, i)).content == StandInHandler.content)
+
+        host = server_url.split('//')[1]
+        stats = HttpSessions.connection_stats()[host]
+        assert(stats['requests'] == 5)
+        assert(stats['connections'] == 1)
+        assert(stats['reused'] == 4)
+
+    def test_configure(self, server_url):
+        first_session = HttpSessions.get_session(server_url)
+        HttpSessions.configure(pool_size=2)
+        second_session = HttpSessions.get_session(server_url)
+
+        assert(first_session is not second_session)
+        assert(second_session.get_adapter(server_url)._pool_maxsize == 2)
+        HttpSessions.configure(pool_size=10)
+
+
+class TestRateLimiter:
+
+    def test_rate(self):
+        limiter = RateLimiter(20)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+
+        assert(time.monotonic() - start >= 0.25)
+
+    def test_back_off_and_recovery(self):
+        limiter = RateLimiter(20)
+        limiter.acquire()
+        limiter.back_off(0.2)
+        assert(limiter.rate == 10)
+
+        start = time.monotonic()
+        limiter.acquire()
+        assert(time.monotonic() - start >= 0.2)
+
+        for _ in range(20):
+            limiter.succeeded()
+        assert(limiter.rate == 20)
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        start = time.monotonic()
+        for _ in range(100):
+            limiter.acquire()
+        assert(time.monotonic() - start < 0.1)
+
+        limiter.back_off(0.1)
+        limiter.acquire()
+        assert(time.monotonic() - start >= 0.1)
+        assert(limiter.rate is None)
+
+
+class TestDatabaseConnections:
+
+    def test_pragma_profile(self, tmp_path):
+        conn = connect_to_database(str(tmp_path / 'test.db'))
+        assert(conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal')
+        assert(conn.execute('PRAGMA temp_store').fetchone()[0] == 2)  # memory
+        assert(conn.execute('PRAGMA synchronous').fetchone()[0] == 1)  # normal
+        cache_size = conn.execute('PRAGMA cache_size').fetchone()[0]
+
+        with pragmas_applied(conn, INGEST_PRAGMAS):
+            assert(conn.execute('PRAGMA synchronous').fetchone()[0] == 0)  # off
+            assert(conn.execute('PRAGMA cache_size').fetchone()[0] == INGEST_PRAGMAS['cache_size'])
+
+        assert(conn.execute('PRAGMA synchronous').fetchone()[0] == 1)
+        assert(conn.execute('PRAGMA cache_size').fetchone()[0] == cache_size)
+        conn.close()
+
+
+class TestDownloads:
+
+    def test_resume(self, tmp_path, file_server_url):
+        content = bytes(range(256)) * 100
+        FileHandler.files['/data.bin'] = content
+        filename = str(tmp_path / 'data.bin')
+
+        # an interrupted download of the same version of the file carries on where it stopped
+        with open(filename + '.download', 'wb') as f:
+            f.write(content[:1000])
+        with open(filename + '.download.validator', 'w', encoding='utf-8') as f:
+            f.write(FileHandler.etag)
+        download_to_file_with_loading_bar(file_server_url + '/data.bin', filename)
+        assert(FileHandler.requested_ranges == ['bytes=1000-'])
+        with open(filename, 'rb') as f:
+            assert(f.read() == content)
+        assert(not (tmp_path / 'data.bin.download').exists())
+        assert(not (tmp_path / 'data.bin.download.validator').exists())
+
+        # but one of a version that's since changed starts over
+        with open(filename + '.download', 'wb') as f:
+            f.write(b'stale')
+        with open(filename + '.download.validator', 'w', encoding='utf-8') as f:
+            f.write('"v0"')
+        download_to_file_with_loading_bar(file_server_url + '/data.bin', filename)
+        with open(filename, 'rb') as f:
+            assert(f.read() == content)
+
+    def test_extract(self, tmp_path, monkeypatch, file_server_url):
+        monkeypatch.chdir(tmp_path)
+        text = '見出し\t訳\n' * 1000
+        FileHandler.files['/sentences.tsv.bz2'] = bz2.compress(text.encode('utf-8'))
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+            for name, data in (('readme.txt', b'ignored'), ('dict.txt', text.encode('shift_jisx0213'))):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        FileHandler.files['/dict.tar.gz'] = archive.getvalue()
+
+        download_and_extract(file_server_url + '/sentences.tsv.bz2', 'sentences.tsv')
+        download_and_extract(file_server_url + '/dict.tar.gz', 'dict.txt', member='dict.txt', encoding='shift_jisx0213')
+        for filename in ('sentences.tsv', 'dict.txt'):
+            with open(filename, encoding='utf-8', newline='') as f:
+                assert(f.read() == text)
+
+        # the downloaded archives are removed once they've been extracted
+        assert(sorted(path.name for path in tmp_path.iterdir()) == ['dict.txt', 'sentences.tsv'])
@@ -0,0 +1,20 @@
+import pytest
+
+from cardbuilder.common.config import Config
+from cardbuilder.common.util import InDataDir, DATABASE_NAME, connect_to_database
+
+
+@pytest.fixture
+def data_directory(tmp_path, monkeypatch):
+    """Points the data directory, and the config stored in it, at a scratch directory, so tests neither depend on nor
+    change the real one."""
+    directory = tmp_path / 'data'
+    directory.mkdir()
+    monkeypatch.setattr(InDataDir, 'directory', directory)
+
+    conn = connect_to_database(str(directory / DATABASE_NAME))
+    conn.execute('CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT);')
+    monkeypatch.setattr(Config, 'conn', conn)
+    monkeypatch.setattr(Config, '_cache', None)
+    yield directory
+    conn.close()
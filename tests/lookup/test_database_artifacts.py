@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from cardbuilder.common import Language
+from cardbuilder.common.util import InDataDir
+from cardbuilder.exceptions import CardBuilderException
+from cardbuilder.input.word import Word
+from cardbuilder.lookup.database_artifacts import build_database_artifact, import_database_artifact, \
+    read_artifact_manifest
+from tests.lookup.test_external_data_data_source import DummyExternalDictionary
+
+
+@pytest.mark.usefixtures('data_directory')
+class TestDatabaseArtifacts:
+
+    def remove_database(self):
+        path = str(InDataDir.directory / DummyExternalDictionary.database_name())
+        for file in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(file):
+                os.remove(file)
+
+    def teardown_method(self):
+        DummyExternalDictionary.fail_after = None
+
+    def test_build_and_import(self, tmp_path):
+        artifact = str(tmp_path / 'dummy.db')
+        build_database_artifact(DummyExternalDictionary(), artifact)
+
+        manifest = read_artifact_manifest(artifact)
+        assert(manifest['source'] == 'DummyExternalDictionary')
+        assert('"dummyexternaldictionary": 5' in manifest['row_counts'])
+        assert(os.path.exists(artifact + '.sha256'))
+
+        # the imported database is used as is, without reading any data
+        self.remove_database()
+        assert(import_database_artifact(artifact) == 'DummyExternalDictionary')
+        DummyExternalDictionary.fail_after = 0
+        dictionary = DummyExternalDictionary()
+        assert(dictionary.lookup_word(Word('bb', Language.ENGLISH), 'bb').get_raw_content() == 'second')
+
+    def test_checksum_mismatch(self, tmp_path):
+        artifact = str(tmp_path / 'dummy.db')
+        build_database_artifact(DummyExternalDictionary(), artifact)
+        with open(artifact, 'ab') as f:
+            f.write(b'tampered')
+
+        with pytest.raises(CardBuilderException):
+            import_database_artifact(artifact)
@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from cardbuilder.common import Fieldname, Language
+from cardbuilder.common.util import ThreadLocalConnection, InDataDir
+from cardbuilder.input.word import Word
+from cardbuilder.lookup.data_source import ExternalDataDataSource
+from cardbuilder.lookup.lookup_data import outputs, LookupData
+from cardbuilder.lookup.value import SingleValue
+
+
+@outputs({
+    Fieldname.DEFINITIONS: SingleValue
+})
+class DummyExternalDictionary(ExternalDataDataSource):
+    batch_size = 2
+    filename = 'dummyexternaldictionary.txt'
+    rows = [('a', 'first'), ('bb', 'second'), ('ccc', 'third'), ('dddd', 'fourth'), ('eeeee', 'fifth')]
+    fail_after = None
+    reads = 0
+
+    def _fetch_remote_files_if_necessary(self):
+        pass
+
+    def _read_and_convert_data(self):
+        DummyExternalDictionary.reads += 1
+        for index, row in enumerate(self.rows):
+            if index == self.fail_after:
+                raise ValueError('Unreadable row')
+            yield row
+
+    def _table_indexes(self, table_name: str):
+        return {'dummyexternaldictionary_content': 'content'}
+
+    def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
+        return self.lookup_data_type(word, form, content, {Fieldname.DEFINITIONS: SingleValue(content)})
+
+
+@pytest.mark.usefixtures('data_directory')
+class TestExternalDataDataSource:
+
+    def setup_method(self):
+        DummyExternalDictionary.reads = 0
+
+    def teardown_method(self):
+        DummyExternalDictionary.fail_after = None
+
+    def test_failed_load_leaves_table_empty(self):
+        DummyExternalDictionary.fail_after = 3
+        with pytest.raises(ValueError):
+            DummyExternalDictionary()
+
+        connection = ThreadLocalConnection(DummyExternalDictionary.database_name())
+        assert(connection.get().execute('SELECT COUNT(*) FROM dummyexternaldictionary').fetchone()[0] == 0)
+        connection.close()
+
+        DummyExternalDictionary.fail_after = None
+        dictionary = DummyExternalDictionary()
+        assert(dictionary.get_table_rowcount() == 5)
+        assert(dictionary.lookup_word(Word('ccc', Language.ENGLISH), 'ccc').get_raw_content() == 'third')
+
+    def test_reloads_when_inputs_change(self, monkeypatch):
+        source_file = InDataDir.directory / DummyExternalDictionary.filename
+        source_file.write_text('version 1')
+        DummyExternalDictionary()
+        DummyExternalDictionary()
+        assert(DummyExternalDictionary.reads == 1)
+
+        # touching the file without changing it doesn't count
+        os.utime(str(source_file), (0, 0))
+        DummyExternalDictionary()
+        assert(DummyExternalDictionary.reads == 1)
+
+        source_file.write_text('version 2')
+        monkeypatch.setattr(DummyExternalDictionary, 'rows', DummyExternalDictionary.rows + [('ffffff', 'sixth')])
+        assert(DummyExternalDictionary().get_table_rowcount() == 6)
+        assert(DummyExternalDictionary.reads == 2)
+
+        monkeypatch.setattr(DummyExternalDictionary, '_parser_version', staticmethod(lambda: 1))
+        DummyExternalDictionary()
+        assert(DummyExternalDictionary.reads == 3)
+
+        # a reload that fails partway leaves the previous table in place
+        source_file.write_text('version three')
+        DummyExternalDictionary.fail_after = 3
+        with pytest.raises(ValueError):
+            DummyExternalDictionary()
+        connection = ThreadLocalConnection(DummyExternalDictionary.database_name())
+        assert(connection.get().execute('SELECT COUNT(*) FROM dummyexternaldictionary').fetchone()[0] == 6)
+        connection.close()
+
+    def test_indexes_and_progress(self):
+        dictionary = DummyExternalDictionary()
+        conn = dictionary.conn
+        assert(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='index' AND name=?",
+                            ('dummyexternaldictionary_content',)).fetchone()[0] == 1)
+
+        # with nothing recorded about it, the table is loaded again from its source file
+        (InDataDir.directory / DummyExternalDictionary.filename).write_text('version 1')
+        conn.execute('DELETE FROM ingest_manifest')
+        conn.commit()
+        progress = []
+        dictionary._load_data_into_database(progress=progress.append)
+        assert(progress == [2, 4, 5])
+        assert(dictionary.get_table_rowcount() == 5)
+
+    def test_legacy_table_migration(self):
+        legacy_connection = ThreadLocalConnection()
+        legacy_conn = legacy_connection.get()
+        legacy_conn.execute('CREATE TABLE dummyexternaldictionary (word TEXT PRIMARY KEY, content TEXT)')
+        legacy_conn.execute("INSERT INTO dummyexternaldictionary VALUES ('legacy', 'from the shared database')")
+        legacy_conn.commit()
+
+        dictionary = DummyExternalDictionary()
+        assert(dictionary.get_table_rowcount() == 1)
+        assert(dictionary.lookup_word(Word('legacy', Language.ENGLISH), 'legacy').get_raw_content() ==
+               'from the shared database')
+        assert(legacy_conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='dummyexternaldictionary'")
+               .fetchone()[0] == 0)
+        legacy_connection.close()
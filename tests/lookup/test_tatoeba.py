@@ -1,13 +1,27 @@
+from contextlib import contextmanager
+
 import pytest
+import spacy
 
 from cardbuilder.common import Fieldname, Language
+from cardbuilder.common.util import Shared, ThreadLocalConnection
 from cardbuilder.exceptions import WordLookupException
 from cardbuilder.input.word import Word
+from cardbuilder.lookup import tatoeba
 from cardbuilder.lookup.data_source import DataSource
-from cardbuilder.lookup.tatoeba import TatoebaExampleSentences
+from cardbuilder.lookup.tatoeba import TatoebaExampleSentences, pack_sentence_pairs, unpack_sentence_pairs, \
+    _tokenize_sentences
 from tests.lookup.data_source_test import DataSourceTest
 
 
+@spacy.language.Language.component('test_plural_lemmatizer')
+def plural_lemmatizer(doc):
+    # a stand-in for a real model's lemmatizer, which would have to be downloaded
+    for token in doc:
+        token.lemma_ = token.lower_[:-1] if token.lower_.endswith('s') else token.lower_
+    return doc
+
+
 class TestTatoeba(DataSourceTest):
     def get_data_source(self) -> DataSource:
         return TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE)
@@ -34,3 +48,170 @@ class TestTatoeba(DataSourceTest):
         #
         # nihongo_data = jp_tatoeba.lookup_word(Word('日本語', Language.JAPANESE), '日本語')
 
+
+
+class TestTatoebaIndex:
+    english = ['The dog is hot.', 'A dog!', 'Cats sleep.', 'My dog sleeps.', 'Is it hot?', 'The dog!']
+    japanese = ['犬は暑い。', '犬だ！', '猫は寝る。', '暑い？', 'この犬は暑いです。']
+    # the fourth English sentence has no translation, and the sixth shares one with the second. links.csv also has
+    # links between sentences in other languages, every link in both directions, and sometimes the same link twice
+    links = [(1, 101), (1, 105), (2, 102), (3, 103), (5, 104), (6, 102)]
+    other_links = [(101, 1), (7, 8), (101, 9), (1, 101)]
+
+    @pytest.fixture
+    def data_source(self, data_directory):
+        # the source files are put in the data directory, so nothing is downloaded
+        with open(str(data_directory / 'eng_sentences.tsv'), 'w', encoding='utf-8') as f:
+            f.writelines('{}\teng\t{}\n'.format(ident, sent) for ident, sent in enumerate(self.english, 1))
+        with open(str(data_directory / 'jpn_sentences.tsv'), 'w', encoding='utf-8') as f:
+            f.writelines('{}\tjpn\t{}\n'.format(ident, sent) for ident, sent in enumerate(self.japanese, 101))
+        with open(str(data_directory / 'links.csv'), 'w', encoding='utf-8') as f:
+            f.writelines('{}\t{}\n'.format(source, target) for source, target in self.links + self.other_links)
+
+        # English lemmas need a spaCy model, which would have to be downloaded
+        data_source = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, lemmatize=False)
+        yield data_source
+        data_source._connection.close()
+
+    def test_sentence_pair_packing(self):
+        pairs = [(70000, 3), (4294967295, 12), (5, 5)]
+        packed = pack_sentence_pairs(pairs)
+        assert(len(packed) == 8 * len(pairs))
+        assert(unpack_sentence_pairs(packed) == pairs)
+        assert(unpack_sentence_pairs(packed, limit=2) == pairs[:2])
+        assert(unpack_sentence_pairs(pack_sentence_pairs([])) == [])
+
+    def test_lookup(self, data_source):
+        dog_data = data_source.lookup_word(Word('dog', Language.ENGLISH), 'dog')
+        # shortest first, with the shortest translation of each, and without repeating translations
+        assert([(source.get_data(), target.get_data())
+                for source, target in dog_data[Fieldname.EXAMPLE_SENTENCES].get_data()] ==
+               [('A dog!', '犬だ！'), ('The dog is hot.', '犬は暑い。')])
+
+        data_source.max_sentences = 1
+        hot_data = data_source.lookup_word(Word('hot', Language.ENGLISH), 'hot')
+        assert(len(hot_data[Fieldname.EXAMPLE_SENTENCES].get_data()) == 1)
+
+        with pytest.raises(WordLookupException):  # only in an untranslated sentence
+            data_source.lookup_word(Word('sleeps', Language.ENGLISH), 'sleeps')
+        with pytest.raises(WordLookupException):
+            data_source.lookup_word(Word('bird', Language.ENGLISH), 'bird')
+
+    def test_pairs(self, data_source):
+        # only links from English to Japanese sentences are kept, with both sentences alongside them
+        assert(data_source.conn.execute('SELECT * FROM tatoeba_eng_jpn_pairs').fetchall() ==
+               [(source_id, target_id, self.english[source_id - 1], self.japanese[target_id - 101])
+                for source_id, target_id in sorted(self.links)])
+
+    def test_reuse(self, data_source, monkeypatch):
+        data_source._connection.close()
+
+        def fail():
+            raise AssertionError('links.csv was read again')
+        monkeypatch.setattr(TatoebaExampleSentences, '_read_links_data', lambda self: fail())
+        data_source = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, lemmatize=False)
+        assert(data_source.get_table_rowcount('tatoeba_eng_jpn_pairs') == len(self.links))
+        data_source._connection.close()
+
+    def test_index_progress(self, data_source, monkeypatch):
+        index_table = 'tatoeba_eng_jpn_index'
+        word_count = data_source.get_table_rowcount(index_table)
+        data_source.conn.execute('DELETE FROM {}'.format(index_table))
+        data_source.conn.commit()
+        data_source._connection.close()
+
+        progress = []
+
+        @contextmanager
+        def recording_callback(description, total=None):
+            yield progress.append
+        monkeypatch.setattr(tatoeba, 'loading_bar_callback', recording_callback)
+        monkeypatch.setattr(TatoebaExampleSentences, 'batch_size', 2)
+        data_source = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, lemmatize=False)
+        assert(progress == sorted(progress) and len(set(progress)) == len(progress))
+        assert(progress[-1] == word_count)
+        data_source._connection.close()
+
+    def test_small_memory_budget(self, data_source):
+        index_table = 'tatoeba_eng_jpn_index'
+        expected_index = data_source.conn.execute('SELECT * FROM {} ORDER BY word'.format(index_table)).fetchall()
+        data_source.conn.execute('DELETE FROM {}'.format(index_table))
+        data_source.conn.commit()
+        data_source._connection.close()
+
+        # every posting is written as soon as it's found, and sorted in temporary files
+        data_source = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, index_memory_budget=0,
+                                              lemmatize=False)
+        assert(data_source.conn.execute('SELECT * FROM {} ORDER BY word'.format(index_table)).fetchall() ==
+               expected_index)
+        assert(data_source.conn.execute("SELECT COUNT(*) FROM sqlite_temp_master WHERE type='table'").fetchone()[0]
+               == 0)
+        data_source._connection.close()
+
+    def test_worker_processes(self, data_source, monkeypatch):
+        index_table = 'tatoeba_eng_jpn_index'
+        expected_index = data_source.conn.execute('SELECT * FROM {} ORDER BY word'.format(index_table)).fetchall()
+        data_source.conn.execute('DELETE FROM {}'.format(index_table))
+        data_source.conn.commit()
+        data_source._connection.close()
+
+        monkeypatch.setattr(TatoebaExampleSentences, 'tokenize_batch_size', 2)
+        data_source = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, workers=2, lemmatize=False)
+        assert(data_source.conn.execute('SELECT * FROM {} ORDER BY word'.format(index_table)).fetchall() ==
+               expected_index)
+        data_source._connection.close()
+
+    @pytest.mark.parametrize('workers', [1, 2])
+    def test_english_lemmas(self, data_source, monkeypatch, workers):
+        index_table = 'tatoeba_eng_jpn_index'
+        data_source.conn.execute('DELETE FROM {}'.format(index_table))
+        data_source.conn.commit()
+        data_source._connection.close()
+
+        nlp = spacy.blank('en')
+        nlp.add_pipe('test_plural_lemmatizer')
+        monkeypatch.setitem(Shared.spacy_models, Language.ENGLISH, nlp)
+        assert(('cat', 3) in _tokenize_sentences(Language.ENGLISH.value, True, [(3, 'Cats sleep.')]))
+
+        # the model is loaded before any workers start, and forked workers use the same one
+        monkeypatch.setattr(TatoebaExampleSentences, 'tokenize_batch_size', 2)
+        data_source = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, workers=workers)
+        cat_data = data_source.lookup_word(Word('cat', Language.ENGLISH), 'cat')
+        assert([(source.get_data(), target.get_data())
+                for source, target in cat_data[Fieldname.EXAMPLE_SENTENCES].get_data()] == [('Cats sleep.', '猫は寝る。')])
+        data_source._connection.close()
+
+    def test_japanese_tokenization(self):
+        postings = _tokenize_sentences(Language.JAPANESE.value, False, [(1, '犬が好きです。'), (2, '犬と猫。')])
+        assert(('犬', 1) in postings and ('犬', 2) in postings and ('猫', 2) in postings)
+        assert(('が', 1) not in postings)
+
+    def test_japanese_lemmas(self):
+        sentences = [(1, '犬が走っていました。'), (2, '猫は走らない。')]
+        assert(('走る', 1) not in _tokenize_sentences(Language.JAPANESE.value, False, sentences))
+
+        postings = _tokenize_sentences(Language.JAPANESE.value, True, sentences)
+        assert(('走っ', 1) in postings and ('走る', 1) in postings and ('走る', 2) in postings)
+
+    def test_legacy_index(self, data_source):
+        conn = data_source.conn
+        conn.execute('CREATE TABLE tatoeba_eng_index (word TEXT PRIMARY KEY, sent_id_list TEXT)')
+        conn.execute("INSERT INTO tatoeba_eng_index VALUES ('dog', '[1, 2, 4]')")
+        conn.execute('CREATE TABLE tatoeba_links (src_sent_id INT, target_sent_id INT)')
+        conn.execute('INSERT INTO tatoeba_links VALUES (1, 101)')
+        conn.commit()
+        data_source._connection.close()
+
+        # older versions kept the same tables in the shared database
+        legacy_connection = ThreadLocalConnection()
+        legacy_conn = legacy_connection.get()
+        legacy_conn.execute('CREATE TABLE tatoeba_jpn_index (word TEXT PRIMARY KEY, sent_id_list TEXT)')
+        legacy_conn.execute('CREATE TABLE tatoeba_links (src_sent_id INT, target_sent_id INT)')
+        legacy_conn.commit()
+
+        data_source = TatoebaExampleSentences(Language.ENGLISH, Language.JAPANESE, lemmatize=False)
+        for conn in (data_source.conn, legacy_conn):
+            assert(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name IN "
+                                "('tatoeba_eng_index', 'tatoeba_jpn_index', 'tatoeba_links')").fetchone()[0] == 0)
+        data_source._connection.close()
+        legacy_connection.close()
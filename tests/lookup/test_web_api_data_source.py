@@ -0,0 +1,150 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from cardbuilder.common import Fieldname, Language
+from cardbuilder.exceptions import WordLookupException, ApiLimitException
+from cardbuilder.input.word import Word
+from cardbuilder.lookup.data_source import WebApiDataSource
+from cardbuilder.lookup.lookup_data import outputs, LookupData
+from cardbuilder.lookup.value import SingleValue
+from tests.common.test_util import serve
+
+
+@outputs({
+    Fieldname.DEFINITIONS: SingleValue
+})
+class DummyWebDictionary(WebApiDataSource):
+    def __init__(self):
+        super().__init__()
+        self.queried_forms = []
+
+    def _query_api(self, form: str) -> str:
+        self.queried_forms.append(form)
+        return 'definition of {}'.format(form) if form.startswith('known') else ''
+
+    def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
+        if len(content) == 0:
+            raise WordLookupException('No definition for {}'.format(form))
+
+        return self.lookup_data_type(word, form, content, {Fieldname.DEFINITIONS: SingleValue(content)})
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Responds with each status in turn, repeating the last one once they run out."""
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+    requests = 0
+
+    def do_GET(self):
+        status, headers = self.statuses[min(self.requests, len(self.statuses) - 1)]
+        type(self).requests += 1
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def scripted_server_url():
+    ScriptedHandler.statuses = [(200, {})]
+    ScriptedHandler.requests = 0
+    yield from serve(ScriptedHandler)
+
+
+class TestWebApiDataSource:
+
+    @pytest.fixture(autouse=True)
+    def dictionary(self, data_directory):
+        self.dictionary = DummyWebDictionary()
+
+    def lookup(self, form: str) -> LookupData:
+        return self.dictionary.lookup_word(Word(form, Language.ENGLISH), form)
+
+    def test_negative_cache(self):
+        for _ in range(2):
+            with pytest.raises(WordLookupException):
+                self.lookup('unknown')
+            assert(self.lookup('known')[Fieldname.DEFINITIONS].get_data() == 'definition of known')
+        assert(self.dictionary.queried_forms == ['unknown', 'known'])
+
+        self.dictionary.prefetch(['unknown', 'known', 'known2'])
+        with pytest.raises(WordLookupException):
+            self.lookup('unknown')
+        self.lookup('known2')
+        assert(self.dictionary.queried_forms == ['unknown', 'known', 'known2'])
+
+        assert(WebApiDataSource.purge_negative_cache('dummywebdictionary') == 1)
+        self.dictionary.prefetch([])
+        with pytest.raises(WordLookupException):
+            self.lookup('unknown')
+        assert(self.dictionary.queried_forms[-1] == 'unknown')
+
+    def test_negative_cache_within_prefetch(self):
+        # a form repeated among the prefetched forms is only queried once, whether or not it's found
+        self.dictionary.prefetch(['unknown', 'known', 'unknown', 'known'])
+        for _ in range(2):
+            with pytest.raises(WordLookupException):
+                self.lookup('unknown')
+            self.lookup('known')
+        assert(self.dictionary.queried_forms == ['unknown', 'known'])
+
+    def test_negative_cache_expiry(self):
+        self.dictionary.negative_cache_ttl = 0
+        for _ in range(2):
+            with pytest.raises(WordLookupException):
+                self.lookup('unknown')
+        assert(self.dictionary.queried_forms == ['unknown', 'unknown'])
+
+    def test_back_off(self, scripted_server_url, monkeypatch):
+        backoffs = []
+        monkeypatch.setattr(self.dictionary._rate_limiter, 'back_off', backoffs.append)
+        ScriptedHandler.statuses = [(429, {'Retry-After': '7'}), (503, {}), (200, {})]
+
+        assert(self.dictionary._request(scripted_server_url).status_code == 200)
+        assert(backoffs == [7, self.dictionary.backoff_base_delay * 2])
+        assert(ScriptedHandler.requests == 3)
+
+    def test_persistent_server_errors(self, scripted_server_url, monkeypatch):
+        monkeypatch.setattr(self.dictionary._rate_limiter, 'back_off', lambda delay: None)
+        ScriptedHandler.statuses = [(503, {})]
+        self.dictionary.daily_quota = 100
+
+        with pytest.raises(ApiLimitException):
+            self.dictionary._request(scripted_server_url)
+        # every request sent is charged to the quota, with none retried behind its back
+        assert(ScriptedHandler.requests == self.dictionary.max_backoff_attempts + 1)
+        assert(self.dictionary.conn.execute('SELECT requests FROM {}'.format(self.dictionary.usage_table)).fetchone()[0]
+               == ScriptedHandler.requests)
+
+    def test_daily_quota(self, scripted_server_url):
+        self.dictionary.daily_quota = 2
+        for _ in range(2):
+            assert(self.dictionary._request(scripted_server_url).status_code == 200)
+
+        with pytest.raises(ApiLimitException):
+            self.dictionary._request(scripted_server_url)
+        assert(ScriptedHandler.requests == 2)
+
+    def test_async_cache_access_off_the_event_loop(self, monkeypatch):
+        cache_threads = []
+        for name in ('_query_cached_api_results', '_parse_and_cache'):
+            method = getattr(self.dictionary, name)
+
+            def recording(*args, method=method):
+                cache_threads.append(threading.current_thread())
+                return method(*args)
+            monkeypatch.setattr(self.dictionary, name, recording)
+
+        async def lookup():
+            return await self.dictionary.lookup_word_async(Word('known', Language.ENGLISH), 'known')
+
+        assert(asyncio.run(lookup())[Fieldname.DEFINITIONS].get_data() == 'definition of known')
+        assert(len(cache_threads) == 2)
+        assert(threading.main_thread() not in cache_threads)
@@ -1,11 +1,48 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import join, exists
+
 import pytest
 
 from cardbuilder.exceptions import CardBuilderUsageException
 from cardbuilder.lookup.value import SingleValue, ListValue, MultiListValue, MultiValue
 from cardbuilder.resolution.printer import SingleValuePrinter, ListValuePrinter, MultiListValuePrinter, \
-    MultiValuePrinter
+    MultiValuePrinter, DownloadPrinter
+
+
+class AudioHandler(BaseHTTPRequestHandler):
+    requested_paths = []
+
+    def do_GET(self):
+        AudioHandler.requested_paths.append(self.path)
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        content = self.path.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
 
+    def log_message(self, *args):
+        pass
 
+
+@pytest.fixture
+def audio_server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), AudioHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.usefixtures('data_directory')
 class TestPrinter:
 
     def test_single_value_printer(self):
@@ -65,3 +102,35 @@ class TestPrinter:
 fiction
 0. dragon'''
         assert printer2(mlv1) == 'dog, cat-dragon-giraffe'
+
+    def test_download_printer(self, audio_server_url, tmp_path):
+        AudioHandler.requested_paths = []
+        output_directory = str(tmp_path / 'audio')
+        printer = DownloadPrinter(output_directory, '[sound:{filename}]')
+        printer.download_tries = 1
+
+        # unique names so files cached by earlier runs don't hide requests
+        names = ['{}-{}.mp3'.format(name, tmp_path.name) for name in ('first', 'second')]
+        for name in names + names:
+            assert(printer(SingleValue('{}/{}'.format(audio_server_url, name))) == '[sound:{}]'.format(name))
+        printer.flush()
+
+        assert(sorted(AudioHandler.requested_paths) == sorted('/' + name for name in names))
+        for name in names:
+            with open(join(output_directory, name), 'rb') as f:
+                assert(f.read() == '/{}'.format(name).encode('utf-8'))
+
+        # cards reused from an earlier run put their downloads back in place without fetching them again
+        os.remove(join(output_directory, names[0]))
+        assert(printer.restore('[sound:{}]'.format(names[0])))
+        assert(exists(join(output_directory, names[0])))
+        assert(printer.restore(''))
+        assert(not printer.restore('[sound:never-downloaded-{}.mp3]'.format(tmp_path.name)))
+        assert(len(AudioHandler.requested_paths) == 2)
+
+        # a failed download is recorded for the resolver instead of raised
+        missing_url = '{}/missing-{}.mp3'.format(audio_server_url, tmp_path.name)
+        printer(SingleValue(missing_url))
+        printer.flush()
+        assert(printer.failed_downloads == [missing_url])
+        assert(not exists(join(output_directory, 'missing-{}.mp3'.format(tmp_path.name))))
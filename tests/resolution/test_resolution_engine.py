@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+from typing import Dict
+
+import pytest
+
+from cardbuilder.common import Fieldname, Language
+from cardbuilder.exceptions import WordLookupException, CardBuilderUsageException, ApiLimitException
+from cardbuilder.input.word import Word, WordForm
+from cardbuilder.lookup.data_source import DataSource
+from cardbuilder.lookup.lookup_data import outputs, LookupData
+from cardbuilder.lookup.value import SingleValue
+from cardbuilder.resolution.field import Field
+from cardbuilder.resolution.resolution_engine import ResolutionEngine
+
+
+@outputs({
+    Fieldname.DEFINITIONS: SingleValue
+})
+class DummyDictionary(DataSource):
+    def __init__(self, definitions: Dict[str, str], delay: float = 0):
+        self.definitions = definitions
+        self.delay = delay
+        self.lookup_threads = set()
+        self.prefetched_chunks = []
+
+    def __del__(self):
+        pass
+
+    def prefetch(self, forms):
+        self.prefetched_chunks.append(list(forms))
+
+    def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        self.lookup_threads.add(threading.current_thread().name)
+        # later words finish first, so results come back out of order unless the engine reorders them
+        time.sleep(self.delay / (len(form) + 1))
+        if form not in self.definitions:
+            raise WordLookupException('No definition for {}'.format(form))
+
+        return self.parse_word_content(word, form, self.definitions[form])
+
+    def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
+        return self.lookup_data_type(word, form, content, {Fieldname.DEFINITIONS: SingleValue(content)})
+
+
+@outputs({
+    Fieldname.DEFINITIONS: SingleValue
+})
+class SecondDummyDictionary(DummyDictionary):
+    pass
+
+
+@outputs({
+    Fieldname.DEFINITIONS: SingleValue
+})
+class AsyncDummyDictionary(DummyDictionary):
+    def __init__(self, definitions: Dict[str, str], delay: float = 0):
+        super().__init__(definitions, delay)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def lookup_word_async(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        self.in_flight += 1
+        self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        await asyncio.sleep(self.delay / (len(form) + 1))
+        self.in_flight -= 1
+        if form not in self.definitions:
+            raise WordLookupException('No definition for {}'.format(form))
+
+        return self.parse_word_content(word, form, self.definitions[form])
+
+
+@outputs({
+    Fieldname.DEFINITIONS: SingleValue
+})
+class LimitedDictionary(DummyDictionary):
+    def __init__(self):
+        super().__init__({})
+        self.looked_up_forms = []
+
+    def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        self.looked_up_forms.append(form)
+        raise ApiLimitException('Out of requests')
+
+
+@pytest.mark.usefixtures('data_directory')
+class TestResolutionEngine:
+
+    definitions = {'a': 'first', 'bb': 'second', 'dddd': 'fourth', 'eeeee': 'fifth'}
+
+    def get_words(self):
+        return [Word(w, Language.ENGLISH) for w in ['a', 'bb', 'ccc', 'dddd', 'eeeee']]
+
+    def get_engine(self, dictionary: DataSource, **kwargs) -> ResolutionEngine:
+        return ResolutionEngine([
+            Field(dictionary, Fieldname.WORD, 'word'),
+            Field(dictionary, Fieldname.DEFINITIONS, 'definition', required=True)
+        ], **kwargs)
+
+    def test_serial_resolution(self):
+        engine = self.get_engine(DummyDictionary(self.definitions))
+        cards = list(engine.cards(self.get_words()))
+
+        assert([card.fields[1].value for card in cards] == ['first', 'second', 'fourth', 'fifth'])
+        assert([str(word) for word, _ in engine.failed_resolutions] == ['ccc'])
+
+    def test_concurrent_resolution(self):
+        dictionary = DummyDictionary(self.definitions, delay=0.05)
+        engine = self.get_engine(dictionary, workers=4)
+        cards = list(engine.cards(self.get_words()))
+
+        assert([card.fields[0].value for card in cards] == ['a', 'bb', 'dddd', 'eeeee'])
+        assert([card.fields[1].value for card in cards] == ['first', 'second', 'fourth', 'fifth'])
+        assert([str(word) for word, _ in engine.failed_resolutions] == ['ccc'])
+        assert(len(dictionary.lookup_threads) > 1)
+
+        with pytest.raises(CardBuilderUsageException):
+            self.get_engine(dictionary, workers=0)
+
+    def test_concurrent_sources(self):
+        dictionary = DummyDictionary(self.definitions, delay=0.05)
+        second_dictionary = SecondDummyDictionary({'ccc': 'third'}, delay=0.05)
+        engine = ResolutionEngine([
+            Field([dictionary, second_dictionary], Fieldname.WORD, 'word'),
+            Field([dictionary, second_dictionary], Fieldname.DEFINITIONS, 'definition', required=True)
+        ], concurrent_sources=True)
+        cards = list(engine.cards(self.get_words()))
+
+        assert([card.fields[1].value for card in cards] == ['first', 'second', 'third', 'fourth', 'fifth'])
+        assert(len(engine.failed_resolutions) == 0)
+        assert(all(name.startswith('cardbuilder-lookup') for name in dictionary.lookup_threads))
+
+    def test_async_resolution(self):
+        async_dictionary = AsyncDummyDictionary(self.definitions, delay=0.05)
+        sync_dictionary = SecondDummyDictionary({'ccc': 'third'}, delay=0.05)
+        engine = ResolutionEngine([
+            Field([async_dictionary, sync_dictionary], Fieldname.WORD, 'word'),
+            Field([async_dictionary, sync_dictionary], Fieldname.DEFINITIONS, 'definition', required=True)
+        ], async_concurrency=3)
+        words = self.get_words() + [Word('ffffff', Language.ENGLISH)]
+        cards = list(engine.cards(words))
+
+        assert([card.fields[1].value for card in cards] == ['first', 'second', 'third', 'fourth', 'fifth'])
+        assert([str(word) for word, _ in engine.failed_resolutions] == ['ffffff'])
+        assert(async_dictionary.max_in_flight == 3)
+        assert(all(name.startswith('cardbuilder-async') for name in sync_dictionary.lookup_threads))
+
+        with pytest.raises(CardBuilderUsageException):
+            self.get_engine(async_dictionary, workers=2, async_concurrency=2)
+
+    def test_prefetching(self):
+        dictionary = DummyDictionary(self.definitions)
+        engine = self.get_engine(dictionary)
+        engine.prefetch_size = 2
+        cards = list(engine.cards(self.get_words()))
+
+        assert(len(cards) == 4)
+        assert(dictionary.prefetched_chunks == [['a', 'bb'], ['ccc', 'dddd'], ['eeeee']])
+
+        results = dictionary.lookup_words(self.get_words())
+        assert({str(word): data[Fieldname.DEFINITIONS].get_data() for word, data in results.items()} ==
+               {'a': 'first', 'bb': 'second', 'dddd': 'fourth', 'eeeee': 'fifth'})
+        assert(dictionary.prefetched_chunks[-1] == ['a', 'bb', 'ccc', 'dddd', 'eeeee'])
+
+    def test_api_limit(self):
+        dictionary = LimitedDictionary()
+        engine = self.get_engine(dictionary)
+        cards = list(engine.cards([Word('Dog', Language.ENGLISH, [WordForm.PHONETICALLY_EQUIVALENT])]))
+
+        assert(len(cards) == 0)
+        assert(dictionary.looked_up_forms == ['Dog'])  # the other forms would have been limited too
+        assert('Out of requests' in str(engine.failed_resolutions[0][1]))
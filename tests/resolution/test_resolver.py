@@ -0,0 +1,177 @@
+import csv
+import sqlite3
+import zipfile
+
+import pytest
+
+from cardbuilder.common import Fieldname, Language
+from cardbuilder.exceptions import CardBuilderException
+from cardbuilder.input.word import Word
+from cardbuilder.lookup.lookup_data import outputs, LookupData
+from cardbuilder.lookup.value import SingleValue
+from cardbuilder.resolution.anki import AkpgResolver, AnkiAudioDownloadPrinter
+from cardbuilder.resolution.delimited import CsvResolver
+from cardbuilder.resolution.field import Field
+from cardbuilder.resolution.printer import SingleValuePrinter
+from tests.resolution.test_printer import audio_server_url
+from tests.resolution.test_resolution_engine import DummyDictionary
+
+
+@outputs({
+    Fieldname.DEFINITIONS: SingleValue
+})
+class InterruptingDictionary(DummyDictionary):
+    interrupt = True
+
+    def lookup_word(self, word: Word, form: str, following_link: bool = False) -> LookupData:
+        self.looked_up_forms.append(form)
+        if form == 'interrupt' and self.interrupt:
+            raise KeyboardInterrupt()
+        return super().lookup_word(word, form, following_link)
+
+
+@outputs({
+    Fieldname.AUDIO: SingleValue
+})
+class AudioDictionary(DummyDictionary):
+    def parse_word_content(self, word: Word, form: str, content: str, following_link: bool = False) -> LookupData:
+        return self.lookup_data_type(word, form, content, {Fieldname.AUDIO: SingleValue(content)})
+
+
+class RecordingPrinter(SingleValuePrinter):
+    def __init__(self):
+        super().__init__()
+        self._printed = []  # private, so it isn't part of the field configuration
+
+    def __call__(self, value: SingleValue) -> str:
+        self._printed.append(value.get_data())
+        return super().__call__(value)
+
+
+@pytest.mark.usefixtures('data_directory')
+class TestResolver:
+
+    definitions = {'a': 'first', 'bb': 'second', 'dddd': 'fourth'}
+
+    def get_fields(self, dictionary: DummyDictionary):
+        return [
+            Field(dictionary, Fieldname.WORD, 'word'),
+            Field(dictionary, Fieldname.DEFINITIONS, 'definition', required=True)
+        ]
+
+    def get_words(self, *words: str):
+        return [Word(w, Language.ENGLISH) for w in words]
+
+    def test_csv_output(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        resolver = CsvResolver(self.get_fields(DummyDictionary(self.definitions)))
+        failures = resolver.resolve_to_file(self.get_words('a', 'bb', 'ccc', 'dddd'), 'Test Deck')
+
+        assert([str(word) for word, _ in failures] == ['ccc'])
+        with open('test_deck.csv', encoding='utf-8') as f:
+            assert(list(csv.reader(f)) == [['a', 'first'], ['bb', 'second'], ['dddd', 'fourth']])
+
+    def test_partial_csv_output(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        dictionary = InterruptingDictionary(self.definitions)
+        dictionary.looked_up_forms = []
+        resolver = CsvResolver(self.get_fields(dictionary))
+
+        with pytest.raises(KeyboardInterrupt):
+            resolver.resolve_to_file(self.get_words('a', 'bb', 'interrupt', 'dddd'), 'Test Deck')
+
+        with open('test_deck.csv', encoding='utf-8') as f:
+            assert(list(csv.reader(f)) == [['a', 'first'], ['bb', 'second']])
+
+    def test_resume(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        dictionary = InterruptingDictionary(dict(self.definitions, interrupt='third'))
+        dictionary.looked_up_forms = []
+        resolver = CsvResolver(self.get_fields(dictionary))
+        words = self.get_words('a', 'bb', 'interrupt', 'dddd')
+
+        with pytest.raises(KeyboardInterrupt):
+            resolver.resolve_to_file(words, 'Resumed Deck')
+
+        dictionary.interrupt = False
+        dictionary.looked_up_forms = []
+        resolver.resolve_to_file(words, 'Resumed Deck', resume=True)
+
+        assert(dictionary.looked_up_forms == ['interrupt', 'dddd'])
+        with open('resumed_deck.csv', encoding='utf-8') as f:
+            assert([row[1] for row in csv.reader(f)] == ['first', 'second', 'third', 'fourth'])
+
+        # the journal is cleared once a run finishes, so resuming again resolves everything
+        dictionary.looked_up_forms = []
+        resolver.resolve_to_file(words, 'Resumed Deck', resume=True)
+        assert(dictionary.looked_up_forms == ['a', 'bb', 'interrupt', 'dddd'])
+
+    def test_anki_output(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        resolver = AkpgResolver(self.get_fields(DummyDictionary(self.definitions)))
+        resolver.resolve_to_file(self.get_words('a', 'bb'), 'Test Deck')
+        assert((tmp_path / 'test_deck.apkg').exists())
+
+        with pytest.raises(CardBuilderException):
+            resolver.resolve_to_file(self.get_words('ccc'), 'Empty Deck')
+
+    def test_anki_output_with_failed_download(self, tmp_path, monkeypatch, audio_server_url):
+        monkeypatch.chdir(tmp_path)
+        dictionary = AudioDictionary({word: '{}/{}-{}.mp3'.format(audio_server_url, word, tmp_path.name)
+                                      for word in ('found', 'missing')})
+        printer = AnkiAudioDownloadPrinter()
+        printer.download_tries = 1
+        resolver = AkpgResolver([
+            Field(dictionary, Fieldname.WORD, 'word'),
+            Field(dictionary, Fieldname.AUDIO, 'audio', printer=printer)
+        ])
+        resolver.resolve_to_file(self.get_words('found', 'missing'), 'Audio Deck')
+
+        # the deck is still written, with the audio that could be downloaded
+        with zipfile.ZipFile(str(tmp_path / 'audio_deck.apkg')) as package:
+            media = package.read('media').decode('utf-8')
+            package.extract('collection.anki2', str(tmp_path))
+        assert('found-' in media)
+        assert('missing-' not in media)
+
+        # and the card whose audio is missing doesn't refer to it
+        conn = sqlite3.connect(str(tmp_path / 'collection.anki2'))
+        notes = sorted(fields for fields, in conn.execute('SELECT flds FROM notes'))
+        conn.close()
+        assert(notes[0].startswith('found\x1f[sound:found-'))
+        assert(notes[1] == 'missing\x1f ')
+
+    def test_incremental_rebuild(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        dictionary = DummyDictionary(dict(self.definitions))
+        printer = RecordingPrinter()
+        resolver = CsvResolver([Field(dictionary, Fieldname.WORD, 'word'),
+                                Field(dictionary, Fieldname.DEFINITIONS, 'definition', printer=printer, required=True)])
+
+        resolver.resolve_to_file(self.get_words('a', 'bb', 'dddd'), 'Incremental Deck')
+        assert(printer._printed == ['first', 'second', 'fourth'])
+
+        # only the word whose data changed is resolved again
+        dictionary.definitions['bb'] = 'second, edited'
+        printer._printed = []
+        resolver.resolve_to_file(self.get_words('a', 'bb', 'dddd'), 'Incremental Deck')
+        assert(printer._printed == ['second, edited'])
+        with open('incremental_deck.csv', encoding='utf-8') as f:
+            assert([row[1] for row in csv.reader(f)] == ['first', 'second, edited', 'fourth'])
+
+        # words removed from the deck are forgotten, so adding them back resolves them again
+        printer._printed = []
+        resolver.resolve_to_file(self.get_words('a', 'bb'), 'Incremental Deck')
+        assert(printer._printed == [])
+        resolver.resolve_to_file(self.get_words('a', 'bb', 'dddd'), 'Incremental Deck')
+        assert(printer._printed == ['fourth'])
+
+        # as does asking for a full rebuild
+        printer._printed = []
+        resolver.resolve_to_file(self.get_words('a', 'bb', 'dddd'), 'Incremental Deck', incremental=False)
+        assert(printer._printed == ['first', 'second, edited', 'fourth'])
+
+        # which still records the cards it built, for the next incremental build to reuse
+        printer._printed = []
+        resolver.resolve_to_file(self.get_words('a', 'bb', 'dddd'), 'Incremental Deck')
+        assert(printer._printed == [])